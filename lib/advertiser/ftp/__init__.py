@@ -7,7 +7,6 @@ import signal
 import logging
 import subprocess
 import atomicwrites
-from mc_util import McUtil
 
 
 class Advertiser:
@@ -24,16 +23,25 @@ class Advertiser:
         self._cfgFile = os.path.join(self._tmpDir, "ftpd.cfg")
         self._logFile = os.path.join(param["log-directory"], "ftpd.log")
         self._listenIp = param["listen-ip"]
+        self._portAllocator = param["port-allocator"]
         self._mirrorSiteDict = param["mirror-sites"]
 
         self._port = None
+        self._listenFd = None
         self._proc = None
         self._advertisedMirrorSiteIdList = []
         try:
-            self._port = McUtil.getFreeSocketPort("tcp")
-            self._generateCfgFile()
-            self._proc = subprocess.Popen([self._execFile, self._cfgFile], cwd=self._tmpDir)
-            McUtil.waitSocketPortForProc("tcp", self._listenIp, self._port, self._proc)
+            # ftpd serves on the inherited listening socket, connections are queued by the kernel before it is ready, so no need to wait
+            sock = self._portAllocator.get_listen_socket()
+            oldMask = signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGUSR1])     # unblocked by ftpd when it is able to reload
+            try:
+                self._port = sock.getsockname()[1]
+                self._listenFd = sock.fileno()
+                self._generateCfgFile()
+                self._proc = subprocess.Popen([self._execFile, self._cfgFile], cwd=self._tmpDir, pass_fds=[self._listenFd])
+            finally:
+                signal.pthread_sigmask(signal.SIG_SETMASK, oldMask)
+                sock.close()
             logging.info("Advertiser (ftp) started, listening on port %d." % (self._port))
         except Exception:
             self.dispose()
@@ -47,6 +55,20 @@ class Advertiser:
         if self._port is not None:
             self._port = None
 
+    def add_mirror_site(self, mirror_site_id, param):
+        assert mirror_site_id not in self._mirrorSiteDict
+        self._mirrorSiteDict[mirror_site_id] = param
+
+    def remove_mirror_site(self, mirror_site_id):
+        if mirror_site_id in self._advertisedMirrorSiteIdList:
+            self._advertisedMirrorSiteIdList.remove(mirror_site_id)
+            self._generateCfgFile()
+            os.kill(self._proc.pid, signal.SIGUSR1)
+        del self._mirrorSiteDict[mirror_site_id]
+
+    def get_port(self):
+        return self._port
+
     def get_access_info(self, mirror_site_id):
         assert mirror_site_id in self._mirrorSiteDict
         return {
@@ -55,8 +77,11 @@ class Advertiser:
         }
 
     def advertise_mirror_site(self, mirror_site_id):
-        assert mirror_site_id in self._mirrorSiteDict
-        self._advertisedMirrorSiteIdList.append(mirror_site_id)
+        self.advertise_mirror_sites([mirror_site_id])
+
+    def advertise_mirror_sites(self, mirror_site_id_list):
+        assert all([x in self._mirrorSiteDict for x in mirror_site_id_list])
+        self._advertisedMirrorSiteIdList += mirror_site_id_list
         self._generateCfgFile()
         os.kill(self._proc.pid, signal.SIGUSR1)
 
@@ -66,6 +91,7 @@ class Advertiser:
         dataObj["logFile"] = self._logFile
         dataObj["ip"] = self._listenIp
         dataObj["port"] = self._port
+        dataObj["fd"] = self._listenFd
         dataObj["dirmap"] = {x: self._mirrorSiteDict[x]["storage-param"]["file"]["data-directory"] for x in self._advertisedMirrorSiteIdList}
 
         # write file
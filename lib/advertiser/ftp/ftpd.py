@@ -5,6 +5,7 @@ import os
 import sys
 import json
 import signal
+import socket
 import logging
 import logging.handlers
 import pyftpdlib.servers
@@ -226,6 +227,8 @@ def refreshCfgFromCfgFile():
             cfg["ip"] = dataObj["ip"]                               # cfg["ip"] is not changable
         if "port" not in cfg:
             cfg["port"] = dataObj["port"]                           # cfg["port"] is not changable
+        if "fd" not in cfg:
+            cfg["fd"] = dataObj.get("fd")                           # cfg["fd"] is not changable
         cfg["dirmap"] = dataObj["dirmap"]
 
 
@@ -244,7 +247,12 @@ def runServer():
     handler.authorizer = authorizer
     handler.abstracted_fs = VirtualFS
 
-    server = pyftpdlib.servers.FTPServer((cfg["ip"], cfg["port"]), handler)
+    if cfg["fd"] is not None:
+        # listening socket inherited from the daemon
+        sock = socket.socket(fileno=cfg["fd"])
+        server = pyftpdlib.servers.FTPServer(sock, handler)
+    else:
+        server = pyftpdlib.servers.FTPServer((cfg["ip"], cfg["port"]), handler)
     server.serve_forever()
 
 
@@ -257,4 +265,5 @@ if __name__ == "__main__":
     cfg = dict()
     refreshCfgFromCfgFile()
     signal.signal(signal.SIGUSR1, sigHandler)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGUSR1])           # blocked by parent, reload request may be pending
     runServer()
@@ -19,13 +19,15 @@ class Advertiser:
         self._tmpDir = param["temp-directory"]
         self._virtRootDir = os.path.join(self._tmpDir, "vroot")
         self._listenIp = param["listen-ip"]
+        self._portAllocator = param["port-allocator"]
         self._mirrorSiteDict = param["mirror-sites"]
 
         self._port = None
         self._proc = None
         try:
+            self._port = self._portAllocator.reserve_port()
             McUtil.ensureDir(self._virtRootDir)
-            self._port = McUtil.getFreeSocketPort("tcp")
+            self._portAllocator.unreserve_port()
             self._proc = subprocess.Popen([
                 "/usr/libexec/git-core/git-daemon",
                 "--export-all",
@@ -45,9 +47,21 @@ class Advertiser:
             self._proc.wait()
             self._proc = None
         if self._port is not None:
+            self._portAllocator.unreserve_port()
             self._port = None
         McUtil.forceDelete(self._virtRootDir)
 
+    def add_mirror_site(self, mirror_site_id, param):
+        assert mirror_site_id not in self._mirrorSiteDict
+        self._mirrorSiteDict[mirror_site_id] = param
+
+    def remove_mirror_site(self, mirror_site_id):
+        McUtil.forceDelete(os.path.join(self._virtRootDir, mirror_site_id))
+        del self._mirrorSiteDict[mirror_site_id]
+
+    def get_port(self):
+        return self._port
+
     def get_access_info(self, mirror_site_id):
         assert mirror_site_id in self._mirrorSiteDict
         return {
@@ -56,6 +70,10 @@ class Advertiser:
         }
 
     def advertise_mirror_site(self, mirror_site_id):
-        assert mirror_site_id in self._mirrorSiteDict
-        realPath = self._mirrorSiteDict[mirror_site_id]["storage-param"]["file"]["data-directory"]
-        os.symlink(realPath, os.path.join(self._virtRootDir, mirror_site_id))
+        self.advertise_mirror_sites([mirror_site_id])
+
+    def advertise_mirror_sites(self, mirror_site_id_list):
+        assert all([x in self._mirrorSiteDict for x in mirror_site_id_list])
+        for msId in mirror_site_id_list:
+            realPath = self._mirrorSiteDict[msId]["storage-param"]["file"]["data-directory"]
+            os.symlink(realPath, os.path.join(self._virtRootDir, msId))
@@ -26,15 +26,17 @@ class Advertiser:
         self._errorLogFile = os.path.join(self._logDir, "error.log")
         self._accessLogFile = os.path.join(self._logDir, "access.log")
         self._listenIp = param["listen-ip"]
+        self._portAllocator = param["port-allocator"]
         self._mirrorSiteDict = param["mirror-sites"]
 
         self._port = None
         self._proc = None
         self._advertisedMirrorSiteIdList = []
         try:
-            self._port = McUtil.getFreeSocketPort("tcp")
+            self._port = self._portAllocator.reserve_port()
             self._generateVirtualRootDir()
             self._generateCfgFn()
+            self._portAllocator.unreserve_port()
             self._proc = subprocess.Popen(["/usr/sbin/apache2", "-f", self._cfgFn, "-DFOREGROUND"], cwd=self._virtRootDir)
             McUtil.waitSocketPortForProc("tcp", self._listenIp, self._port, self._proc)
             logging.info("Advertiser (httpdir) started, listening on port %d." % (self._port))
@@ -48,9 +50,25 @@ class Advertiser:
             self._proc.wait()
             self._proc = None
         if self._port is not None:
+            self._portAllocator.unreserve_port()
             self._port = None
         McUtil.forceDelete(self._virtRootDir)
 
+    def add_mirror_site(self, mirror_site_id, param):
+        assert mirror_site_id not in self._mirrorSiteDict
+        self._mirrorSiteDict[mirror_site_id] = param
+
+    def remove_mirror_site(self, mirror_site_id):
+        if mirror_site_id in self._advertisedMirrorSiteIdList:
+            self._advertisedMirrorSiteIdList.remove(mirror_site_id)
+            McUtil.forceDelete(os.path.join(self._virtRootDir, mirror_site_id))
+            self._generateCfgFn()
+            os.kill(self._proc.pid, signal.SIGUSR1)
+        del self._mirrorSiteDict[mirror_site_id]
+
+    def get_port(self):
+        return self._port
+
     def get_access_info(self, mirror_site_id):
         assert mirror_site_id in self._mirrorSiteDict
         return {
@@ -59,8 +77,11 @@ class Advertiser:
         }
 
     def advertise_mirror_site(self, mirror_site_id):
-        assert mirror_site_id in self._mirrorSiteDict
-        self._advertisedMirrorSiteIdList.append(mirror_site_id)
+        self.advertise_mirror_sites([mirror_site_id])
+
+    def advertise_mirror_sites(self, mirror_site_id_list):
+        assert all([x in self._mirrorSiteDict for x in mirror_site_id_list])
+        self._advertisedMirrorSiteIdList += mirror_site_id_list
         self._generateVirtualRootDir()
         self._generateCfgFn()
         os.kill(self._proc.pid, signal.SIGUSR1)
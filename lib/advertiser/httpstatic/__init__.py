@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import json
+import time
+import signal
+import logging
+import threading
+import subprocess
+import atomicwrites
+from . import dirlisting
+
+
+class Advertiser:
+
+    """
+    Serves storage-file directories by a few httpd.py worker processes, which is much lighter
+    than apache. Each worker has its own listening socket bound to the same port with
+    SO_REUSEPORT, so the kernel distributes connections among them.
+
+    Small and frequently requested files (repository indexes, release files, etc.) are cached
+    in memory by each worker. The cache of a mirror site is dropped when the mirror site is
+    updated, cached files are also checked against the disk every "cacheRevalidateInterval"
+    seconds, for mirror sites whose files are changed by others.
+
+    Directory listings (HTML and JSON) are precomputed in a background thread when a mirror site
+    is advertised and after it is updated, only the changed directories are scanned again. They
+    are stored in the mirror site's cache directory, so they are kept across restarts. Entry sizes
+    and mtimes in a listing file can be out of date without the directory's key changing, so the
+    listings of a mirror site are only served after its generation finishes, directories are
+    listed on the fly while the mirror site is being updated or its listings are being generated.
+
+    Config in main config file:
+        "advertiserConfig": {
+            "httpstatic": {
+                "workers": NUMBER,                      # default: number of CPUs, at most 4
+                "cacheSize": BYTES,                     # for each worker, default: 64MiB, 0 disables the cache
+                "cacheMaxFileSize": BYTES,              # default: 8MiB
+                "cacheFilePatterns": [PATTERN, ...],    # file name patterns, default: DEFAULT_CACHE_FILE_PATTERNS
+                "cacheRevalidateInterval": SECONDS,     # default: 60, 0 disables revalidation
+                "precomputedListing": BOOL,             # default: true
+            },
+        }
+    """
+
+    DEFAULT_CACHE_FILE_PATTERNS = [
+        "repomd.xml", "repomd.xml.asc", "repomd.xml.key",                   # yum, dnf, zypper
+        "Release", "Release.gpg", "InRelease", "Packages*", "Sources*",     # apt
+        "*.db", "*.db.sig",                                                 # pacman
+        "APKINDEX.tar.gz",                                                  # apk
+        "repodata.json", "current_repodata.json", "index.json",             # conda, etc.
+        "index.html",                                                       # pypi simple index, etc.
+    ]
+
+    @staticmethod
+    def get_properties():
+        return {
+            "storage-dependencies": ["file"],
+        }
+
+    def __init__(self, param):
+        self._execFile = os.path.join(os.path.dirname(os.path.realpath(__file__)), "httpd.py")
+        self._tmpDir = param["temp-directory"]
+        self._logDir = param["log-directory"]
+        self._cfgFile = os.path.join(self._tmpDir, "httpd.cfg")
+        self._listenIp = param["listen-ip"]
+        self._portAllocator = param["port-allocator"]
+        self._mirrorSiteDict = param["mirror-sites"]
+
+        cfg = param["config"]
+        for key in cfg:
+            if key not in ["workers", "cacheSize", "cacheMaxFileSize", "cacheFilePatterns", "cacheRevalidateInterval", "precomputedListing"]:
+                raise Exception("invalid key \"%s\" in config" % (key))
+        self._workerCount = cfg.get("workers", min(4, os.cpu_count()))
+        if not isinstance(self._workerCount, int) or self._workerCount <= 0:
+            raise Exception("invalid value of \"workers\"")
+        self._cacheCfg = {
+            "size": cfg.get("cacheSize", 64 * 1024 * 1024),
+            "maxFileSize": cfg.get("cacheMaxFileSize", 8 * 1024 * 1024),
+            "filePatterns": cfg.get("cacheFilePatterns", self.DEFAULT_CACHE_FILE_PATTERNS),
+            "revalidateInterval": cfg.get("cacheRevalidateInterval", 60),
+        }
+        for key, cfgKey in [("size", "cacheSize"), ("maxFileSize", "cacheMaxFileSize"), ("revalidateInterval", "cacheRevalidateInterval")]:
+            if not isinstance(self._cacheCfg[key], int) or self._cacheCfg[key] < 0:
+                raise Exception("invalid value of \"%s\"" % (cfgKey))
+        if not isinstance(self._cacheCfg["filePatterns"], list) or not all([isinstance(x, str) for x in self._cacheCfg["filePatterns"]]):
+            raise Exception("invalid value of \"cacheFilePatterns\"")
+        self._bPrecomputedListing = cfg.get("precomputedListing", True)
+        if not isinstance(self._bPrecomputedListing, bool):
+            raise Exception("invalid value of \"precomputedListing\"")
+
+        self._port = None
+        self._procList = []
+        self._advertisedMirrorSiteIdList = []
+        self._generationDict = dict()                   # dict<mirror-id,int>, cache of a mirror site is dropped when its generation changes
+        self._listingUpdater = None
+        self._listingReadySet = set()                   # mirror sites whose listing files are up to date
+        self._lock = threading.Lock()                   # config file is also generated by the listing thread
+        try:
+            if self._bPrecomputedListing:
+                self._listingUpdater = _ListingUpdater(self._mirrorSiteDict, self._listingGenerated)
+            # workers serve on the inherited listening sockets, connections are queued by the kernel before they are ready, so no need to wait
+            self._generateCfgFile()
+            sockList = self._portAllocator.get_listen_sockets(self._workerCount)
+            oldMask = signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGUSR1])     # unblocked by the workers when they are able to reload
+            try:
+                self._port = sockList[0].getsockname()[1]
+                for i, sock in enumerate(sockList):
+                    proc = subprocess.Popen([self._execFile, self._cfgFile, str(sock.fileno()), str(i)], cwd=self._tmpDir, pass_fds=[sock.fileno()])
+                    self._procList.append(proc)
+            finally:
+                signal.pthread_sigmask(signal.SIG_SETMASK, oldMask)
+                for sock in sockList:
+                    sock.close()
+            logging.info("Advertiser (httpstatic) started, listening on port %d with %d workers." % (self._port, self._workerCount))
+        except Exception:
+            self.dispose()
+            raise
+
+    def dispose(self):
+        if self._listingUpdater is not None:
+            self._listingUpdater.dispose()
+            self._listingUpdater = None
+        for proc in self._procList:
+            proc.terminate()
+        for proc in self._procList:
+            proc.wait()
+        self._procList = []
+        if self._port is not None:
+            self._port = None
+
+    def add_mirror_site(self, mirror_site_id, param):
+        assert mirror_site_id not in self._mirrorSiteDict
+        self._mirrorSiteDict[mirror_site_id] = param
+
+    def remove_mirror_site(self, mirror_site_id):
+        with self._lock:
+            if self._listingUpdater is not None:
+                self._listingUpdater.cancel(mirror_site_id)
+            self._listingReadySet.discard(mirror_site_id)
+            if mirror_site_id in self._advertisedMirrorSiteIdList:
+                self._advertisedMirrorSiteIdList.remove(mirror_site_id)
+                self._generateCfgFile()
+                self._reloadWorkers()
+            self._generationDict.pop(mirror_site_id, None)
+            del self._mirrorSiteDict[mirror_site_id]
+
+    def get_port(self):
+        return self._port
+
+    def get_access_info(self, mirror_site_id):
+        assert mirror_site_id in self._mirrorSiteDict
+        return {
+            "url": "http://{IP}:%d/%s" % (self._port, mirror_site_id),
+            "description": "",
+        }
+
+    def advertise_mirror_site(self, mirror_site_id):
+        self.advertise_mirror_sites([mirror_site_id])
+
+    def advertise_mirror_sites(self, mirror_site_id_list):
+        assert all([x in self._mirrorSiteDict for x in mirror_site_id_list])
+        with self._lock:
+            self._advertisedMirrorSiteIdList += mirror_site_id_list
+            self._generateCfgFile()
+            self._reloadWorkers()
+            if self._listingUpdater is not None:
+                for msId in mirror_site_id_list:
+                    self._listingUpdater.requestUpdate(msId)
+
+    def notify_mirror_site_updated(self, mirror_site_id):
+        # called when an update starts and when it exits, listings are not served until they are generated again
+        if mirror_site_id not in self._advertisedMirrorSiteIdList:
+            return                                      # nothing is cached
+        with self._lock:
+            self._generationDict[mirror_site_id] = self._generationDict.get(mirror_site_id, 0) + 1
+            self._listingReadySet.discard(mirror_site_id)
+            self._generateCfgFile()
+            self._reloadWorkers()
+            if self._listingUpdater is not None:
+                self._listingUpdater.requestUpdate(mirror_site_id)
+
+    def _listingGenerated(self, mirror_site_id):
+        # called in listing thread, listings are stale again if another generation has been requested in between
+        with self._lock:
+            if mirror_site_id not in self._advertisedMirrorSiteIdList or self._listingUpdater.isPending(mirror_site_id):
+                return
+            self._listingReadySet.add(mirror_site_id)
+            self._generateCfgFile()
+            self._reloadWorkers()
+
+    def _reloadWorkers(self):
+        for proc in self._procList:
+            os.kill(proc.pid, signal.SIGUSR1)
+
+    def _generateCfgFile(self):
+        # generate file content
+        dataObj = dict()
+        dataObj["logDir"] = self._logDir
+        dataObj["dirmap"] = {x: self._mirrorSiteDict[x]["storage-param"]["file"]["data-directory"] for x in self._advertisedMirrorSiteIdList}
+        dataObj["generation"] = {x: self._generationDict.get(x, 0) for x in self._advertisedMirrorSiteIdList}
+        dataObj["cache"] = self._cacheCfg
+        dataObj["listing"] = {x: _getListingDir(self._mirrorSiteDict[x]) for x in self._advertisedMirrorSiteIdList if x in self._listingReadySet}
+
+        # write file
+        with atomicwrites.atomic_write(self._cfgFile, overwrite=True) as f:
+            json.dump(dataObj, f)
+
+
+class _ListingUpdater:
+
+    """
+    Generates directory listings of the mirror sites in a background thread, one mirror site
+    at a time. finishedFunc(mirror-id) is called in the thread when a generation finishes.
+    """
+
+    def __init__(self, mirrorSiteDict, finishedFunc):
+        self.mirrorSiteDict = mirrorSiteDict
+        self.finishedFunc = finishedFunc
+
+        # members shared with the thread, protected by self.cond
+        self.cond = threading.Condition()
+        self.queue = []                                 # list<mirror-id>
+        self.bStop = False
+
+        self.thread = threading.Thread(target=self._threadFunc, name="httpstatic-listing")
+        self.thread.start()
+
+    def dispose(self):
+        with self.cond:
+            self.bStop = True
+            self.cond.notify()
+        self.thread.join()
+
+    def requestUpdate(self, mirrorSiteId):
+        with self.cond:
+            if mirrorSiteId not in self.queue:
+                self.queue.append(mirrorSiteId)
+                self.cond.notify()
+
+    def isPending(self, mirrorSiteId):
+        with self.cond:
+            return mirrorSiteId in self.queue
+
+    def cancel(self, mirrorSiteId):
+        # generation in progress is not interrupted, its listing files are simply not served
+        with self.cond:
+            if mirrorSiteId in self.queue:
+                self.queue.remove(mirrorSiteId)
+
+    def _threadFunc(self):
+        while True:
+            with self.cond:
+                while not self.bStop and len(self.queue) == 0:
+                    self.cond.wait()
+                if self.bStop:
+                    return
+                msId = self.queue.pop(0)
+
+            try:
+                param = self.mirrorSiteDict.get(msId)
+                if param is None:
+                    continue                            # removed after requested
+                t = time.monotonic()
+                generator = dirlisting.ListingGenerator(param["storage-param"]["file"]["data-directory"], _getListingDir(param), "/%s/" % (msId))
+                ret = generator.run(lambda: self.bStop)
+                if ret is None:
+                    return                              # stopped
+                logging.info("Mirror site \"%s\" directory listings generated, %d of %d directories changed, %.1f seconds." % (msId, ret[1], ret[0], time.monotonic() - t))
+                self.finishedFunc(msId)
+            except Exception:
+                logging.error("Mirror site \"%s\" directory listing generation failed." % (msId), exc_info=True)
+
+
+def _getListingDir(param):
+    return os.path.join(param["cache-directory"], "listing")
@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import html
+import stat
+import time
+import struct
+import hashlib
+import urllib.parse
+import atomicwrites
+
+# Precomputed directory listings, generated by the advertiser and served by httpd.py.
+#
+# Each directory has one listing file, stored in LISTING-DIR/XX/SHA1-OF-RELATIVE-PATH:
+#     header:         magic, entry count, (mtime_ns, ctime_ns) of the directory, offset and size of the HTML
+#     offset table:   (entry count + 1) uint32, offsets of the entries relative to the first entry
+#     entries:        flags, size, mtime, name length, name, sorted by name
+#     HTML:           the complete HTML page, sent by os.sendfile()
+# A page of entries costs two small reads, no matter how many entries the directory has.
+
+_HEADER = struct.Struct("<4sIQQQQ")
+_OFFSET = struct.Struct("<I")
+_ENTRY = struct.Struct("<BQqH")
+_MAGIC = b"MCL1"
+
+_FLAG_DIR = 0x1
+_FLAG_SYMLINK = 0x2
+
+
+def getListingFile(listingDir, relPath):
+    # relPath is "" for the top directory
+    h = hashlib.sha1(os.fsencode(relPath)).hexdigest()
+    return os.path.join(listingDir, h[:2], h)
+
+
+def getDirKey(st):
+    # creating, removing or renaming an entry changes the directory's mtime
+    return (st.st_mtime_ns, st.st_ctime_ns)
+
+
+def renderHtml(path, entryList):
+    # entryList: list<(name,is-directory,size,mtime)>, size and mtime can be None
+    title = html.escape("Index of %s" % (path))
+    buf = '<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>%s</title></head>\n<body>\n<h1>%s</h1>\n<pre>\n' % (title, title)
+    if path != "/":
+        buf += '<a href="../">../</a>\n'
+    for name, bDir, size, mtime in entryList:
+        if bDir:
+            name += "/"
+        buf += '<a href="%s">%s</a>%s' % (urllib.parse.quote(os.fsencode(name)), html.escape(name), " " * max(1, 51 - len(name)))
+        buf += "%s " % (time.strftime("%Y-%m-%d %H:%M", time.gmtime(mtime)) if mtime is not None else " " * 16)
+        buf += "%s\n" % ("-" if bDir or size is None else str(size)).rjust(16)
+    buf += "</pre>\n</body>\n</html>\n"
+    return buf.encode("utf-8", "surrogateescape")
+
+
+class ListingFile:
+
+    """
+    Reads a listing file, raises OSError or ValueError if it does not exist or is invalid.
+    """
+
+    def __init__(self, filename):
+        self.f = open(filename, "rb")
+        try:
+            buf = self.f.read(_HEADER.size)
+            if len(buf) != _HEADER.size:
+                raise ValueError("invalid listing file")
+            magic, self.count, mtimeNs, ctimeNs, self.htmlOffset, self.htmlSize = _HEADER.unpack(buf)
+            if magic != _MAGIC:
+                raise ValueError("invalid listing file")
+            self.dirKey = (mtimeNs, ctimeNs)
+            self._entryOffset = _HEADER.size + _OFFSET.size * (self.count + 1)
+        except BaseException:
+            self.f.close()
+            raise
+
+    def close(self):
+        self.f.close()
+
+    def getEntries(self, offset, limit):
+        # returns list<(name,is-directory,is-symlink,size,mtime)>
+        first = min(offset, self.count)
+        last = min(offset + limit, self.count)
+        if first >= last:
+            return []
+        buf = os.pread(self.f.fileno(), _OFFSET.size * (last - first + 1), _HEADER.size + _OFFSET.size * first)
+        begin = _OFFSET.unpack_from(buf, 0)[0]
+        end = _OFFSET.unpack_from(buf, len(buf) - _OFFSET.size)[0]
+        buf = os.pread(self.f.fileno(), end - begin, self._entryOffset + begin)
+        if len(buf) != end - begin:
+            raise ValueError("invalid listing file")
+
+        ret = []
+        pos = 0
+        while pos < len(buf):
+            flags, size, mtime, nameLen = _ENTRY.unpack_from(buf, pos)
+            pos += _ENTRY.size
+            name = os.fsdecode(buf[pos:pos + nameLen])
+            pos += nameLen
+            ret.append((name, bool(flags & _FLAG_DIR), bool(flags & _FLAG_SYMLINK), size, mtime))
+        return ret
+
+
+class ListingGenerator:
+
+    """
+    Generates listing files for a directory tree. Directories whose (mtime, ctime) and whose
+    sub-directories' mtime are unchanged keep their listing files, the others are scanned
+    again. Listing files are replaced atomically, listing files of removed directories are
+    deleted. Symlinked directories are listed but not followed.
+    Files modified in place are not noticed until their directory changes, see McDiskUsageCollector.
+    """
+
+    def __init__(self, dataDir, listingDir, urlPrefix):
+        self.dataDir = dataDir
+        self.listingDir = listingDir
+        self.urlPrefix = urlPrefix                      # URL path of the top directory, ends with "/"
+
+    def run(self, stopFunc):
+        # returns (directory-count,scanned-directory-count), returns None if stopped
+        fileSet = set()
+        scanCount = 0
+        os.makedirs(self.listingDir, exist_ok=True)
+
+        stack = [("", os.stat(self.dataDir))]
+        while len(stack) > 0:
+            if stopFunc():
+                return None
+            relPath, st = stack.pop()
+            fn = getListingFile(self.listingDir, relPath)
+            fileSet.add(fn)
+            subDirList, bScanned = self._updateDir(relPath, st, fn)
+            stack += subDirList
+            if bScanned:
+                scanCount += 1
+
+        # remove listing files of the directories which no longer exist
+        for dn in os.listdir(self.listingDir):
+            for fn in os.listdir(os.path.join(self.listingDir, dn)):
+                if os.path.join(self.listingDir, dn, fn) not in fileSet:
+                    os.unlink(os.path.join(self.listingDir, dn, fn))
+
+        return (len(fileSet), scanCount)
+
+    def _updateDir(self, relPath, st, fn):
+        # returns (list<(sub-directory-relative-path,stat)>,scanned)
+        dirPath = os.path.join(self.dataDir, relPath)
+
+        # unchanged if the directory and its sub-directories' mtime are not changed
+        # sub-directory's mtime is shown in the listing but changing it does not change the directory's mtime
+        try:
+            lf = ListingFile(fn)
+        except (OSError, ValueError):
+            lf = None
+        if lf is not None:
+            try:
+                if lf.dirKey == getDirKey(st):
+                    ret = []
+                    for name, bDir, bSymlink, size, mtime in lf.getEntries(0, lf.count):
+                        if bDir and not bSymlink:
+                            subSt = os.stat(os.path.join(dirPath, name), follow_symlinks=False)
+                            if int(subSt.st_mtime) != mtime or not stat.S_ISDIR(subSt.st_mode):
+                                break
+                            ret.append((os.path.join(relPath, name), subSt))
+                    else:
+                        return (ret, False)
+            except (OSError, ValueError):
+                pass
+            finally:
+                lf.close()
+
+        # scan the directory
+        entryList = []
+        ret = []
+        try:
+            with os.scandir(dirPath) as it:
+                for entry in it:
+                    try:
+                        entrySt = entry.stat()
+                        bSymlink = entry.is_symlink()
+                    except FileNotFoundError:
+                        continue                        # broken symlink, or removed
+                    bDir = stat.S_ISDIR(entrySt.st_mode)
+                    entryList.append((entry.name, bDir, bSymlink, entrySt.st_size, int(entrySt.st_mtime)))
+                    if bDir and not bSymlink:
+                        ret.append((os.path.join(relPath, entry.name), entrySt))
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            if os.path.exists(fn):
+                os.unlink(fn)                           # served by httpd.py as it does without listing
+            return ([], True)
+        entryList.sort()
+
+        self._writeListingFile(fn, getDirKey(st), self.urlPrefix + "".join([x + "/" for x in relPath.split("/") if x != ""]), entryList)
+        return (ret, True)
+
+    def _writeListingFile(self, fn, dirKey, path, entryList):
+        offsetBuf = bytearray()
+        entryBuf = bytearray()
+        for name, bDir, bSymlink, size, mtime in entryList:
+            offsetBuf += _OFFSET.pack(len(entryBuf))
+            bName = os.fsencode(name)
+            entryBuf += _ENTRY.pack((_FLAG_DIR if bDir else 0) | (_FLAG_SYMLINK if bSymlink else 0), size, mtime, len(bName))
+            entryBuf += bName
+        offsetBuf += _OFFSET.pack(len(entryBuf))
+        htmlBuf = renderHtml(path, [(x[0], x[1], x[3], x[4]) for x in entryList])
+        htmlOffset = _HEADER.size + len(offsetBuf) + len(entryBuf)
+
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with atomicwrites.atomic_write(fn, mode="wb", overwrite=True) as f:
+            f.write(_HEADER.pack(_MAGIC, len(entryList), dirKey[0], dirKey[1], htmlOffset, len(htmlBuf)))
+            f.write(offsetBuf)
+            f.write(entryBuf)
+            f.write(htmlBuf)
@@ -0,0 +1,576 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import sys
+import http
+import json
+import stat
+import time
+import signal
+import socket
+import fnmatch
+import asyncio
+import logging
+import collections
+import mimetypes
+import email.utils
+import urllib.parse
+import logging.handlers
+import dirlisting
+
+
+KEEP_ALIVE_TIMEOUT = 60             # seconds, idle time allowed between requests
+HEADER_TIMEOUT = 30                 # seconds
+MAX_HEADER_COUNT = 100
+FADVISE_MIN_SIZE = 1024 * 1024      # files smaller than this are most likely read in one go anyway
+JSON_LISTING_DEFAULT_LIMIT = 1000
+JSON_LISTING_MAX_LIMIT = 10000
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Request:
+
+    def __init__(self, method, target, version, headerDict):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headerDict = headerDict                # header names are in lower case
+        self.requestLine = "%s %s %s" % (method, target, version)
+
+    def isKeepAlive(self):
+        value = self.headerDict.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return "keep-alive" in value
+        else:
+            return "close" not in value
+
+
+class FileInfo:
+
+    """
+    Response metadata of a regular file, or a part of it, with its ETag, Last-Modified and the
+    other per-file headers encoded in advance. content is not None if the file is cached.
+    """
+
+    def __init__(self, st, contentType, offset=0, size=None):
+        self.statKey = (st.st_ino, st.st_mtime_ns, st.st_size)
+        self.mtime = st.st_mtime
+        self.offset = offset
+        self.size = st.st_size if size is None else size
+        self.etag = '"%x-%x"' % (st.st_mtime_ns, st.st_size)
+        self.lastModified = email.utils.formatdate(st.st_mtime, usegmt=True)
+        self.head = ("ETag: %s\r\nLast-Modified: %s\r\nAccept-Ranges: bytes\r\n" % (self.etag, self.lastModified)).encode("iso-8859-1")
+        self.contentType = contentType
+        self.content = None
+        self.checkTime = None
+
+
+class FileCache:
+
+    """
+    Size-bounded LRU cache of small hot files, keyed by (mirror-site-id, relative-path).
+    A cached file is served without touching the disk, the whole cache of a mirror site
+    is dropped when the config file says the mirror site is updated.
+
+    A file is cached only if it is not changed while being read (same inode, size and mtime
+    before and after, all the bytes read), so a torn file is never served from the cache.
+    """
+
+    def __init__(self, maxSize, maxFileSize, filePatternList, revalidateInterval):
+        self._maxSize = maxSize
+        self._maxFileSize = min(maxFileSize, maxSize)
+        self._filePatternList = filePatternList
+        self._revalidateInterval = revalidateInterval
+        self._entryDict = collections.OrderedDict()     # dict<(mirror-id,path),FileInfo>, from least to most recently used
+        self._size = 0
+
+    def isCacheable(self, filename):
+        return any([fnmatch.fnmatchcase(filename, x) for x in self._filePatternList])
+
+    def get(self, key, realPath):
+        info = self._entryDict.get(key)
+        if info is None:
+            return None
+        if self._revalidateInterval > 0 and time.monotonic() - info.checkTime >= self._revalidateInterval:
+            try:
+                st = os.stat(realPath)
+            except OSError:
+                st = None
+            if st is None or (st.st_ino, st.st_mtime_ns, st.st_size) != info.statKey:
+                self._remove(key)
+                return None
+            info.checkTime = time.monotonic()
+        self._entryDict.move_to_end(key)
+        return info
+
+    def load(self, key, f, info):
+        # fills info.content and caches it if the file is small enough and not changed while being read
+        if info.size > self._maxFileSize:
+            return
+        content = f.read(info.size + 1)
+        st = os.fstat(f.fileno())
+        if len(content) != info.size or (st.st_ino, st.st_mtime_ns, st.st_size) != info.statKey:
+            return
+
+        info.content = content
+        info.checkTime = time.monotonic()
+        if key in self._entryDict:
+            self._remove(key)
+        self._entryDict[key] = info
+        self._size += info.size
+        while self._size > self._maxSize:
+            self._remove(next(iter(self._entryDict)))
+
+    def dropMirrorSite(self, mirrorSiteId):
+        for key in [x for x in self._entryDict if x[0] == mirrorSiteId]:
+            self._remove(key)
+
+    def _remove(self, key):
+        self._size -= self._entryDict.pop(key).size
+
+
+class Server:
+
+    """
+    Virtual root directory:
+      |---- virtual-site-directory -> /var/cache/mirrors/SITE/storage-file
+              |---- ...
+      |---- virtual-site-directory -> /var/cache/mirrors/SITE/storage-file
+              |---- ...
+      |---- ...
+
+    File content is sent by os.sendfile() (through loop.sendfile()), it never enters user space,
+    except for the files cached by FileCache.
+    Only GET and HEAD are supported, with single range requests and conditional requests.
+
+    Directory listings are precomputed by the advertiser, see dirlisting.py. A listing is served
+    only if it matches the directory's current (mtime, ctime), otherwise the directory is listed
+    on the fly. Appending "?format=json&offset=N&limit=N" to a directory URL gets the listing
+    in JSON, entries are sorted by name.
+    """
+
+    def __init__(self, sock, accessLog, fileCache):
+        self._sock = sock
+        self._accessLog = accessLog
+        self._fileCache = fileCache
+        self._dateCache = (0, "")
+
+    async def run(self):
+        server = await asyncio.start_server(self._handleConnection, sock=self._sock)
+        async with server:
+            await server.serve_forever()
+
+    async def _handleConnection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        peerIp = peer[0] if peer is not None else "-"
+        try:
+            while True:
+                try:
+                    req = await self._readRequest(reader)
+                except BadRequest:
+                    await self._sendSimpleResponse(writer, None, peerIp, 400, False)
+                    break
+                if req is None:
+                    break
+                if not await self._handleRequest(writer, req, peerIp):
+                    break
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            # ValueError: request line or header line is too long
+            pass
+        finally:
+            writer.close()
+
+    async def _readRequest(self, reader):
+        # returns None if the connection is closed by client between requests
+        line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+        if line in [b"\r\n", b"\n"]:
+            line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)       # allowed by RFC 7230 section 3.5
+        if line == b"":
+            return None
+
+        tl = line.decode("iso-8859-1").rstrip("\r\n").split(" ")
+        if len(tl) != 3 or tl[2] not in ["HTTP/1.0", "HTTP/1.1"]:
+            raise BadRequest()
+
+        headerDict = dict()
+        for i in range(0, MAX_HEADER_COUNT + 1):
+            line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+            if line == b"":
+                return None
+            if line in [b"\r\n", b"\n"]:
+                break
+            key, sep, value = line.decode("iso-8859-1").partition(":")
+            if sep == "" or key.strip() != key:
+                raise BadRequest()
+            headerDict[key.lower()] = value.strip()
+        else:
+            raise BadRequest()
+
+        return Request(tl[0], tl[1], tl[2], headerDict)
+
+    async def _handleRequest(self, writer, req, peerIp):
+        # returns False if the connection should be closed
+        bKeepAlive = req.isKeepAlive()
+
+        if req.method not in ["GET", "HEAD"]:
+            await self._sendSimpleResponse(writer, req, peerIp, 405, bKeepAlive, [("Allow", "GET, HEAD")])
+            return bKeepAlive
+        if "transfer-encoding" in req.headerDict or req.headerDict.get("content-length", "0") != "0":
+            await self._sendSimpleResponse(writer, req, peerIp, 413, False)        # we don't read request body
+            return False
+
+        # parse path
+        target = urllib.parse.urlsplit(req.target)
+        path = os.fsdecode(urllib.parse.unquote_to_bytes(target.path))
+        if not path.startswith("/") or "\0" in path:
+            await self._sendSimpleResponse(writer, req, peerIp, 400, bKeepAlive)
+            return bKeepAlive
+        partList = [x for x in path.split("/") if x not in ["", "."]]
+        if ".." in partList:
+            await self._sendSimpleResponse(writer, req, peerIp, 404, bKeepAlive)
+            return bKeepAlive
+        bTrailingSlash = path.endswith("/")
+
+        # parse query, only directory listing uses it
+        listingQuery = None                                     # (offset,limit) if listing in JSON is requested
+        queryDict = urllib.parse.parse_qs(target.query)
+        if queryDict.get("format") == ["json"]:
+            try:
+                listingQuery = (int(queryDict.get("offset", ["0"])[0]), int(queryDict.get("limit", [str(JSON_LISTING_DEFAULT_LIMIT)])[0]))
+            except ValueError:
+                listingQuery = (-1, -1)
+            if listingQuery[0] < 0 or not (0 < listingQuery[1] <= JSON_LISTING_MAX_LIMIT):
+                await self._sendSimpleResponse(writer, req, peerIp, 400, bKeepAlive)
+                return bKeepAlive
+
+        # virtual root directory
+        if len(partList) == 0:
+            entryList = [(x, True, None, None) for x in sorted(cfg["dirmap"].keys())]
+            await self._sendListing(writer, req, peerIp, bKeepAlive, "/", entryList, listingQuery)
+            return bKeepAlive
+
+        # real file or directory
+        if partList[0] not in cfg["dirmap"]:
+            await self._sendSimpleResponse(writer, req, peerIp, 404, bKeepAlive)
+            return bKeepAlive
+        realPath = os.path.join(cfg["dirmap"][partList[0]], *partList[1:])
+        cacheKey = None
+        if self._fileCache is not None and not bTrailingSlash and len(partList) > 1 and self._fileCache.isCacheable(partList[-1]):
+            cacheKey = (partList[0], "/".join(partList[1:]))
+            info = self._fileCache.get(cacheKey, realPath)
+            if info is not None:
+                await self._sendFile(writer, req, peerIp, bKeepAlive, info, None)
+                return bKeepAlive
+        try:
+            f = open(realPath, "rb")
+        except IsADirectoryError:
+            if not bTrailingSlash:
+                location = urllib.parse.quote(os.fsencode(path + "/"))
+                await self._sendSimpleResponse(writer, req, peerIp, 301, bKeepAlive, [("Location", location)])
+            else:
+                await self._sendDirectory(writer, req, peerIp, bKeepAlive, path, partList, realPath, listingQuery)
+            return bKeepAlive
+        except (FileNotFoundError, NotADirectoryError):
+            await self._sendSimpleResponse(writer, req, peerIp, 404, bKeepAlive)
+            return bKeepAlive
+        except PermissionError:
+            await self._sendSimpleResponse(writer, req, peerIp, 403, bKeepAlive)
+            return bKeepAlive
+
+        with f:
+            st = os.fstat(f.fileno())
+            if bTrailingSlash or not stat.S_ISREG(st.st_mode):
+                await self._sendSimpleResponse(writer, req, peerIp, 404, bKeepAlive)
+                return bKeepAlive
+            info = FileInfo(st, self._getContentType(realPath))
+            if cacheKey is not None:
+                self._fileCache.load(cacheKey, f, info)
+            await self._sendFile(writer, req, peerIp, bKeepAlive, info, f)
+            return bKeepAlive
+
+    async def _sendFile(self, writer, req, peerIp, bKeepAlive, info, f):
+        # content is sent from info.content if the file is cached, f can be None in this case
+        # conditional request
+        if self._isNotModified(req, info.etag, info.mtime):
+            await self._sendSimpleResponse(writer, req, peerIp, 304, bKeepAlive, [], info.head)
+            return
+
+        # range request
+        headerList = []
+        status, offset, count = 200, 0, info.size
+        if "range" in req.headerDict and req.method == "GET" and self._isIfRangeMatched(req, info.etag, info.lastModified):
+            r = self._parseRange(req.headerDict["range"], info.size)
+            if r is False:
+                await self._sendSimpleResponse(writer, req, peerIp, 416, bKeepAlive, [("Content-Range", "bytes */%d" % (info.size))], info.head)
+                return
+            if r is not None:
+                status, offset, count = 206, r[0], r[1] - r[0] + 1
+                headerList.append(("Content-Range", "bytes %d-%d/%d" % (r[0], r[1], info.size)))
+
+        headerList.append(("Content-Type", info.contentType))
+        headerList.append(("Content-Length", str(count)))
+        writer.write(self._buildHead(req, status, bKeepAlive, headerList, info.head))
+        if req.method == "GET" and count > 0 and info.content is not None:
+            writer.write(memoryview(info.content)[offset:offset + count])
+            await writer.drain()
+            self._log(req, peerIp, status, count)
+        elif req.method == "GET" and count > 0:
+            if count >= FADVISE_MIN_SIZE:
+                os.posix_fadvise(f.fileno(), info.offset + offset, count, os.POSIX_FADV_SEQUENTIAL)
+            await writer.drain()
+            await asyncio.get_running_loop().sendfile(writer.transport, f, info.offset + offset, count)
+            self._log(req, peerIp, status, count)
+        else:
+            await writer.drain()
+            self._log(req, peerIp, status, None)
+
+    async def _sendDirectory(self, writer, req, peerIp, bKeepAlive, path, partList, realPath, listingQuery):
+        lf = self._openListingFile(partList, realPath)
+        if lf is not None:
+            try:
+                if listingQuery is None:
+                    info = FileInfo(os.fstat(lf.f.fileno()), "text/html; charset=utf-8", lf.htmlOffset, lf.htmlSize)
+                    await self._sendFile(writer, req, peerIp, bKeepAlive, info, lf.f)
+                else:
+                    entryList = [(x[0], x[1], x[3], x[4]) for x in lf.getEntries(listingQuery[0], listingQuery[1])]
+                    await self._sendJsonListing(writer, req, peerIp, bKeepAlive, path, lf.count, listingQuery[0], entryList)
+            finally:
+                lf.close()
+            return
+
+        entryList = []
+        try:
+            with os.scandir(realPath) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                        entryList.append((entry.name, stat.S_ISDIR(st.st_mode), st.st_size, st.st_mtime))
+                    except FileNotFoundError:
+                        pass                                    # broken symlink, or removed
+        except PermissionError:
+            await self._sendSimpleResponse(writer, req, peerIp, 403, bKeepAlive)
+            return
+        entryList.sort()
+        await self._sendListing(writer, req, peerIp, bKeepAlive, path, entryList, listingQuery)
+
+    async def _sendListing(self, writer, req, peerIp, bKeepAlive, path, entryList, listingQuery):
+        # entryList: list<(name,is-directory,size,mtime)>
+        if listingQuery is None:
+            await self._sendBody(writer, req, peerIp, bKeepAlive, "text/html; charset=utf-8", dirlisting.renderHtml(path, entryList))
+        else:
+            offset, limit = listingQuery
+            await self._sendJsonListing(writer, req, peerIp, bKeepAlive, path, len(entryList), offset, entryList[offset:offset + limit])
+
+    async def _sendJsonListing(self, writer, req, peerIp, bKeepAlive, path, total, offset, entryList):
+        # entryList: list<(name,is-directory,size,mtime)>, a page of the listing starting from offset
+        dataObj = {
+            "path": path,
+            "total": total,
+            "offset": offset,
+            "entries": [],
+        }
+        for name, bDir, size, mtime in entryList:
+            dataObj["entries"].append({
+                "name": name,
+                "type": "directory" if bDir else "file",
+                "size": None if bDir else size,
+                "mtime": int(mtime) if mtime is not None else None,
+            })
+        await self._sendBody(writer, req, peerIp, bKeepAlive, "application/json", json.dumps(dataObj).encode("utf-8"))
+
+    async def _sendBody(self, writer, req, peerIp, bKeepAlive, contentType, body):
+        headerList = [
+            ("Content-Type", contentType),
+            ("Content-Length", str(len(body))),
+        ]
+        writer.write(self._buildHead(req, 200, bKeepAlive, headerList))
+        if req.method == "GET":
+            writer.write(body)
+        await writer.drain()
+        self._log(req, peerIp, 200, len(body) if req.method == "GET" else None)
+
+    async def _sendSimpleResponse(self, writer, req, peerIp, status, bKeepAlive, headerList=[], encodedHeaders=b""):
+        if status >= 400:
+            body = ("%d %s\n" % (status, http.HTTPStatus(status).phrase)).encode("iso-8859-1")
+            headerList = headerList + [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))]
+        else:
+            body = b""
+            if status != 304:
+                headerList = headerList + [("Content-Length", "0")]
+        bBody = (req is None or req.method != "HEAD")
+        writer.write(self._buildHead(req, status, bKeepAlive, headerList, encodedHeaders))
+        if bBody:
+            writer.write(body)
+        await writer.drain()
+        self._log(req, peerIp, status, len(body) if bBody else None)
+
+    def _buildHead(self, req, status, bKeepAlive, headerList, encodedHeaders=b""):
+        # encodedHeaders are header lines encoded in advance, each ends with CRLF
+        buf = "HTTP/1.1 %d %s\r\n" % (status, http.HTTPStatus(status).phrase)
+        buf += "Date: %s\r\n" % (self._getDate())
+        for key, value in headerList:
+            buf += "%s: %s\r\n" % (key, value)
+        if not bKeepAlive:
+            buf += "Connection: close\r\n"
+        elif req.version == "HTTP/1.0":
+            buf += "Connection: keep-alive\r\n"
+        return buf.encode("iso-8859-1") + encodedHeaders + b"\r\n"
+
+    def _openListingFile(self, partList, realPath):
+        # returns None if the directory has no precomputed listing or its listing is out of date
+        # mirror site is absent in cfg["listing"] while it is being updated or its listings are being generated, because
+        # changes of entry sizes and mtimes don't change the directory's key, see ListingGenerator
+        listingDir = cfg["listing"].get(partList[0])
+        if listingDir is None:
+            return None
+        try:
+            lf = dirlisting.ListingFile(dirlisting.getListingFile(listingDir, "/".join(partList[1:])))
+        except (OSError, ValueError):
+            return None
+        try:
+            if lf.dirKey == dirlisting.getDirKey(os.stat(realPath)):
+                return lf
+        except OSError:
+            pass
+        lf.close()
+        return None
+
+    def _isNotModified(self, req, etag, mtime):
+        # If-None-Match takes precedence over If-Modified-Since, see RFC 7232 section 6
+        if "if-none-match" in req.headerDict:
+            value = req.headerDict["if-none-match"]
+            if value == "*":
+                return True
+            return etag in [x.strip().replace("W/", "", 1) for x in value.split(",")]
+        if "if-modified-since" in req.headerDict:
+            try:
+                return int(mtime) <= email.utils.parsedate_to_datetime(req.headerDict["if-modified-since"]).timestamp()
+            except (TypeError, ValueError):
+                return False                                    # invalid date is ignored
+        return False
+
+    def _isIfRangeMatched(self, req, etag, lastModified):
+        # range request is served as normal request if If-Range does not match, strong comparison is required
+        value = req.headerDict.get("if-range")
+        if value is None:
+            return True
+        return value == etag or value == lastModified
+
+    def _parseRange(self, value, size):
+        # returns (first-byte,last-byte), returns None if the Range header should be ignored, returns False if the range is not satisfiable
+        # multiple ranges are not supported, they are ignored as RFC 7233 allows
+        if not value.startswith("bytes="):
+            return None
+        tl = value[len("bytes="):].split(",")
+        if len(tl) != 1:
+            return None
+        first, sep, last = tl[0].strip().partition("-")
+        if sep == "" or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+            return None
+        if first == "":
+            if last == "":
+                return None
+            n = int(last)                                       # suffix range: the last n bytes
+            if n == 0 or size == 0:
+                return False
+            return (max(0, size - n), size - 1)
+        first = int(first)
+        last = size - 1 if last == "" else int(last)
+        if first >= size:
+            return False
+        if last < first:
+            return None
+        return (first, min(last, size - 1))
+
+    def _getContentType(self, filename):
+        mimeType, encoding = mimetypes.guess_type(filename, strict=False)
+        if mimeType is None or encoding is not None:
+            # don't let the client decompress *.tar.gz, *.xz, etc
+            return "application/octet-stream"
+        return mimeType
+
+    def _getDate(self):
+        t = int(time.time())
+        if self._dateCache[0] != t:
+            self._dateCache = (t, email.utils.formatdate(t, usegmt=True))
+        return self._dateCache[1]
+
+    def _log(self, req, peerIp, status, byteCount):
+        # apache combined log format
+        if req is not None:
+            requestLine, referer, userAgent = req.requestLine, req.headerDict.get("referer", "-"), req.headerDict.get("user-agent", "-")
+        else:
+            requestLine, referer, userAgent = "-", "-", "-"
+        tm = time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime())
+        self._accessLog.info('%s - - [%s] "%s" %d %s "%s" "%s"' % (peerIp, tm, requestLine, status, byteCount if byteCount is not None else "-", referer, userAgent))
+
+
+def refreshCfgFromCfgFile():
+    with open(cfgFile, "r") as f:
+        buf = f.read()
+        if buf == "":
+            raise Exception("no content in config file")
+        dataObj = json.loads(buf)
+
+        if "logDir" not in dataObj:
+            raise Exception("no \"logDir\" in config file")
+        if "dirmap" not in dataObj:
+            raise Exception("no \"dirmap\" in config file")
+        for key, value in dataObj["dirmap"].items():
+            if not os.path.isabs(value) or value.endswith("/"):
+                raise Exception("value of \"%s\" in \"dirmap\" is invalid" % (key))
+
+        if "generation" not in dataObj:
+            raise Exception("no \"generation\" in config file")
+        if "cache" not in dataObj:
+            raise Exception("no \"cache\" in config file")
+        if "listing" not in dataObj:
+            raise Exception("no \"listing\" in config file")
+
+        # drop cache of the mirror sites which are updated, changed or removed
+        # we run in the event loop, so no request sees a partially dropped cache
+        if fileCache is not None:
+            for key in cfg["dirmap"]:
+                if dataObj["dirmap"].get(key) != cfg["dirmap"][key] or dataObj["generation"].get(key) != cfg["generation"].get(key):
+                    fileCache.dropMirrorSite(key)
+
+        if "logDir" not in cfg:
+            cfg["logDir"] = dataObj["logDir"]                       # cfg["logDir"] is not changable
+        if "cache" not in cfg:
+            cfg["cache"] = dataObj["cache"]                         # cfg["cache"] is not changable
+        cfg["dirmap"] = dataObj["dirmap"]
+        cfg["generation"] = dataObj["generation"]
+        cfg["listing"] = dataObj["listing"]
+
+
+def runServer(fd, workerIndex):
+    global fileCache
+
+    log = logging.getLogger("access")
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    log.addHandler(logging.handlers.RotatingFileHandler(os.path.join(cfg["logDir"], "access-%d.log" % (workerIndex)), 10 * 1024 * 1024, 2))
+
+    # listening socket inherited from the daemon
+    sock = socket.socket(fileno=fd)
+
+    if cfg["cache"]["size"] > 0:
+        fileCache = FileCache(cfg["cache"]["size"], cfg["cache"]["maxFileSize"], cfg["cache"]["filePatterns"], cfg["cache"]["revalidateInterval"])
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.add_signal_handler(signal.SIGUSR1, refreshCfgFromCfgFile)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGUSR1])           # blocked by parent, reload request may be pending
+    loop.run_until_complete(Server(sock, log, fileCache).run())
+
+
+if __name__ == "__main__":
+    cfgFile = sys.argv[1]
+    cfg = dict()
+    fileCache = None
+    refreshCfgFromCfgFile()
+    runServer(int(sys.argv[2]), int(sys.argv[3]))
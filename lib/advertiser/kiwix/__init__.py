@@ -19,14 +19,16 @@ class Advertiser:
         self._tmpDir = param["temp-directory"]
         self._libraryFile = os.path.join(self._tmpDir, "library.xml")
         self._listenIp = param["listen-ip"]
+        self._portAllocator = param["port-allocator"]
         self._mirrorSiteDict = param["mirror-sites"]
 
         self._port = None
         self._proc = None
         self._advertisedMirrorSiteIdList = []
         try:
+            self._port = self._portAllocator.reserve_port()
             self._generateLibraryXml()
-            self._port = McUtil.getFreeSocketPort("tcp")
+            self._portAllocator.unreserve_port()
             self._proc = self._startProc()
             McUtil.waitSocketPortForProc("tcp", self._listenIp, self._port, self._proc)
             logging.info("Advertiser (kiwix) started, listening on port %d." % (self._port))
@@ -40,9 +42,29 @@ class Advertiser:
             self._proc.wait()
             self._proc = None
         if self._port is not None:
+            self._portAllocator.unreserve_port()
             self._port = None
         McUtil.forceDelete(self._libraryFile)
 
+    def add_mirror_site(self, mirror_site_id, param):
+        assert mirror_site_id not in self._mirrorSiteDict
+        self._mirrorSiteDict[mirror_site_id] = param
+
+    def remove_mirror_site(self, mirror_site_id):
+        if mirror_site_id in self._advertisedMirrorSiteIdList:
+            self._advertisedMirrorSiteIdList.remove(mirror_site_id)
+
+            # restart kiwix-serve, same as advertise_mirror_site()
+            self._proc.terminate()
+            self._proc.wait()
+            self._generateLibraryXml()
+            self._proc = self._startProc()
+            McUtil.waitSocketPortForProc("tcp", self._listenIp, self._port, self._proc)
+        del self._mirrorSiteDict[mirror_site_id]
+
+    def get_port(self):
+        return self._port
+
     def get_access_info(self, mirror_site_id):
         assert mirror_site_id in self._mirrorSiteDict
         return {
@@ -51,8 +73,11 @@ class Advertiser:
         }
 
     def advertise_mirror_site(self, mirror_site_id):
-        assert mirror_site_id in self._mirrorSiteDict
-        self._advertisedMirrorSiteIdList.append(mirror_site_id)
+        self.advertise_mirror_sites([mirror_site_id])
+
+    def advertise_mirror_sites(self, mirror_site_id_list):
+        assert all([x in self._mirrorSiteDict for x in mirror_site_id_list])
+        self._advertisedMirrorSiteIdList += mirror_site_id_list
 
         # restart kiwix-serve
         # ugly, kiwix-serve does not support reload library.xml by signal
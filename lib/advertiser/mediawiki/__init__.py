@@ -16,6 +16,15 @@ class Advertiser:
     def dispose(self):
         pass
 
+    def add_mirror_site(self, mirror_site_id, param):
+        pass
+
+    def remove_mirror_site(self, mirror_site_id):
+        pass
+
+    def get_port(self):
+        return None
+
     def get_access_info(self, mirror_site_id):
         return {
             "url": "",
@@ -24,3 +33,6 @@ class Advertiser:
 
     def advertise_mirror_site(self, mirror_site_id):
         pass
+
+    def advertise_mirror_sites(self, mirror_site_id_list):
+        pass
@@ -22,14 +22,16 @@ class Advertiser:
         self._lockFile = os.path.join(self._tmpDir, "rsyncd.lock")
         self._logFile = os.path.join(param["log-directory"], "rsyncd.log")
         self._listenIp = param["listen-ip"]
+        self._portAllocator = param["port-allocator"]
         self._mirrorSiteDict = param["mirror-sites"]
 
         self._port = None
         self._proc = None
         self._advertisedMirrorSiteIdList = []
         try:
-            self._port = McUtil.getFreeSocketPort("tcp")
+            self._port = self._portAllocator.reserve_port()
             self._generateCfgFile()
+            self._portAllocator.unreserve_port()
             self._proc = subprocess.Popen(["/usr/bin/rsync", "-v", "--daemon", "--no-detach", "--config=%s" % (self._cfgFile)], cwd=self._tmpDir)
             McUtil.waitSocketPortForProc("tcp", self._listenIp, self._port, self._proc)
             logging.info("Advertiser (rsync) started, listening on port %d." % (self._port))
@@ -43,8 +45,22 @@ class Advertiser:
             self._proc.wait()
             self._proc = None
         if self._port is not None:
+            self._portAllocator.unreserve_port()
             self._port = None
 
+    def add_mirror_site(self, mirror_site_id, param):
+        assert mirror_site_id not in self._mirrorSiteDict
+        self._mirrorSiteDict[mirror_site_id] = param
+
+    def remove_mirror_site(self, mirror_site_id):
+        if mirror_site_id in self._advertisedMirrorSiteIdList:
+            self._advertisedMirrorSiteIdList.remove(mirror_site_id)
+            self._generateCfgFile()
+        del self._mirrorSiteDict[mirror_site_id]
+
+    def get_port(self):
+        return self._port
+
     def get_access_info(self, mirror_site_id):
         assert mirror_site_id in self._mirrorSiteDict
         return {
@@ -53,8 +69,11 @@ class Advertiser:
         }
 
     def advertise_mirror_site(self, mirror_site_id):
-        assert mirror_site_id in self._mirrorSiteDict
-        self._advertisedMirrorSiteIdList.append(mirror_site_id)
+        self.advertise_mirror_sites([mirror_site_id])
+
+    def advertise_mirror_sites(self, mirror_site_id_list):
+        assert all([x in self._mirrorSiteDict for x in mirror_site_id_list])
+        self._advertisedMirrorSiteIdList += mirror_site_id_list
         self._generateCfgFile()             # rsync picks the new cfg-file when new connection comes in
 
     def _generateCfgFile(self):
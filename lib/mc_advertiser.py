@@ -26,9 +26,13 @@ class McMainAdvertiser:
             if True:
                 self._app = aiohttp.web.Application(loop=self.param.mainloop)
                 self._app.router.add_route("GET", "/api/mirrors", self._apiMirrorsHandler)
+                self._app.router.add_route("GET", "/api/network-usage", self._apiNetworkUsageHandler)
+                self._app.router.add_route("GET", "/api/disk-usage", self._apiDiskUsageHandler)
+                self._app.router.add_route("GET", "/api/mirror/{id}/disk-usage", self._apiMirrorDiskUsageHandler)
+                self._app.router.add_route("GET", "/api/mirror/{id}/telemetry", self._apiMirrorTelemetryHandler)
                 self._app.router.add_route("GET", "/", self._indexHandler)
             if True:
-                self._app.router.add_route("POST", "/api/mirror/{id}/update-now", self._apiMirrorsHandler)
+                self._app.router.add_route("POST", "/api/mirror/{id}/update-now", self._apiMirrorUpdateNow)
             if True:
                 self._log = logging.getLogger("aiohttp")
                 self._log.propagate = False
@@ -73,6 +77,92 @@ class McMainAdvertiser:
     async def _apiMirrorsHandler(self, request):
         return aiohttp.web.json_response(self.__getMirrorSiteDict())
 
+    async def _apiNetworkUsageHandler(self, request):
+        ret = {
+            "total": {
+                "rx": 0,
+                "tx": 0,
+            },
+            "plugins": dict(),
+        }
+        for pluginName, (rx, tx) in self.param.updater.getNetworkUsage().items():
+            ret["plugins"][pluginName] = {
+                "rx": rx,
+                "tx": tx,
+            }
+            ret["total"]["rx"] += rx
+            ret["total"]["tx"] += tx
+        return aiohttp.web.json_response(ret)
+
+    async def _apiDiskUsageHandler(self, request):
+        ret = {
+            "total": {
+                "bytes": 0,
+                "files": 0,
+            },
+            "storages": dict(),
+            "plugins": dict(),
+            "mirrors": dict(),
+        }
+        for msId, msObj in self.param.mirrorSiteDict.items():
+            ret["mirrors"][msId] = self.__getMirrorSiteDiskUsage(msId)
+            for st, value in ret["mirrors"][msId]["storages"].items():
+                for key, name in [("storages", st), ("plugins", msObj.pluginName)]:
+                    if name not in ret[key]:
+                        ret[key][name] = {
+                            "bytes": 0,
+                            "files": 0,
+                        }
+                    ret[key][name]["bytes"] += value["bytes"]
+                    ret[key][name]["files"] += value["files"]
+            ret["total"]["bytes"] += ret["mirrors"][msId]["bytes"]
+            ret["total"]["files"] += ret["mirrors"][msId]["files"]
+        return aiohttp.web.json_response(ret)
+
+    async def _apiMirrorDiskUsageHandler(self, request):
+        mirrorSiteId = request.match_info["id"]
+        if self.param.mirrorSiteDict.get(mirrorSiteId) is None:
+            return aiohttp.web.json_response({"message": "mirror site not found"}, status=404)
+
+        try:
+            n = int(request.query.get("history", "100"))
+        except ValueError:
+            return aiohttp.web.json_response({"message": "invalid history count"}, status=400)
+
+        ret = self.__getMirrorSiteDiskUsage(mirrorSiteId)
+        ret["history"] = []
+        for t, storageDict in self.param.diskUsageCollector.getHistory(mirrorSiteId, max(0, n)):
+            ret["history"].append({
+                "time": t,
+                "storages": {k: {"bytes": v[0], "files": v[1]} for k, v in storageDict.items()},
+            })
+        return aiohttp.web.json_response(ret)
+
+    async def _apiMirrorTelemetryHandler(self, request):
+        mirrorSiteId = request.match_info["id"]
+        if self.param.mirrorSiteDict.get(mirrorSiteId) is None:
+            return aiohttp.web.json_response({"message": "mirror site not found"}, status=404)
+
+        telemetry = self.param.updater.getMirrorSiteTelemetry(mirrorSiteId)
+        ret = {
+            "running": telemetry["running"],
+            "usage": telemetry["usage"],
+            "interval": telemetry["interval"],
+            "samples": [],
+        }
+        for t, cpuTime, rss, ioRead, ioWrite, fds, rx, tx in telemetry["sample_list"]:
+            ret["samples"].append({
+                "time": t,
+                "cpu-time": round(cpuTime, 2),
+                "rss": rss,
+                "io-read": ioRead,
+                "io-write": ioWrite,
+                "fds": fds,
+                "network-rx": rx,
+                "network-tx": tx,
+            })
+        return aiohttp.web.json_response(ret)
+
     async def _apiMirrorUpdateNow(self, request):
         mirrorSiteId = request.match_info["id"]
         try:
@@ -82,14 +172,34 @@ class McMainAdvertiser:
             if not self.param.updater.isMirrorSiteInitialized(mirrorSiteId):
                 raise _WebException("mirror site has not been initialized")
 
+            if self.param.mirrorSiteDict[mirrorSiteId].updaterExe is None:
+                raise _WebException("mirror site has no updater")
+
             s = self.param.updater.getMirrorSiteUpdateState(mirrorSiteId)["update_status"]
-            if s in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_MAINTAINING]:
+            if s in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_MAINTAINING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_PAUSED]:
                 raise _WebException("mirror site is updating")
 
-            self.updateMirrorSiteNow(mirrorSiteId)
+            if not self.param.updater.updateMirrorSiteNow(mirrorSiteId):
+                return aiohttp.web.json_response({"message": "serving load is high, update is deferred"}, status=202)
             return aiohttp.web.Response()
         except _WebException as e:
-            return aiohttp.web.json_response({"message": e.message}, status=400)
+            return aiohttp.web.json_response({"message": str(e)}, status=400)
+
+    def __getMirrorSiteDiskUsage(self, mirrorSiteId):
+        ret = {
+            "bytes": 0,
+            "files": 0,
+            "storages": dict(),
+        }
+        for st, (size, count, scanTime) in self.param.diskUsageCollector.getUsage(mirrorSiteId).items():
+            ret["storages"][st] = {
+                "bytes": size,
+                "files": count,
+                "scan-time": scanTime,
+            }
+            ret["bytes"] += size
+            ret["files"] += count
+        return ret
 
     def __getMirrorSiteDict(self):
         ret = dict()
@@ -103,12 +213,21 @@ class McMainAdvertiser:
                 updateState["next_update_time"] = ""
             else:
                 updateState["next_update_time"] = updateState["next_update_time"].strftime("%Y-%m-%d %H:%M")
+            if updateState.get("update_eta") is None:
+                updateState["update_eta"] = -1                 # not updating, or can't be estimated
 
             ret[msId] = {
                 "update-status": updateState["update_status"],
                 "last-update-time": updateState["last_update_time"],
                 "next-update-time": updateState["next_update_time"],
                 "update-progress": updateState.get("update_progress", -1),
+                "update-eta": updateState["update_eta"],
+                "update-network-rx": updateState.get("update_network_rx", -1),
+                "update-network-tx": updateState.get("update_network_tx", -1),
+                "network-rx": updateState["network_rx"],
+                "network-tx": updateState["network_tx"],
+                "update-queue-depth": updateState["update_queue_depth"],
+                "update-queue-wait": updateState.get("update_queue_wait", -1),
                 "help": {
                     "title": "",
                     "filename": "",
@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import re
+import errno
+import signal
+import logging
+from gi.repository import GLib
+
+
+class McCgroupManager:
+
+    """
+    Places initializer, updater and maintainer processes in cgroup v2 leaves
+    under the daemon's own cgroup (systemd needs "Delegate=yes"):
+        <daemon-cgroup>/daemon                  the daemon itself
+        <daemon-cgroup>/updaters                limits shared by all the runs
+        <daemon-cgroup>/updaters/<run-name>     one leaf for each run, with per mirror site limits
+    So that they can't starve the serving processes of CPU, disk IO and page
+    cache. Weights only compete among siblings, so the global limits are
+    applied on "updaters" against "daemon", the leaves are for accounting,
+    freezing and per mirror site limits.
+
+    It must be created as root, the hierarchy is set up and then chowned to
+    the daemon user, like systemd does for delegation to a User= service.
+    Everything works without cgroups if the hierarchy is not usable, which is
+    reported once by logStatus().
+    """
+
+    CONTROLLER_LIST = ["cpu", "io", "memory"]
+
+    # limit name -> cgroup file
+    LIMIT_FILE_DICT = {
+        "cpu-weight": "cpu.weight",             # 1~10000, default 100
+        "io-weight": "io.weight",               # 1~10000, default 100
+        "io-max": "io.max",                     # list of "MAJ:MIN rbps=N wbps=N riops=N wiops=N"
+        "memory-high": "memory.high",           # bytes, K/M/G suffix is allowed
+        "memory-max": "memory.max",             # bytes, K/M/G suffix is allowed
+    }
+
+    def __init__(self, uid, gid, limitDict):
+        self.rootDir = None
+        self.updatersDir = None
+        self.rmdirRetryDict = dict()            # dict<path,retry-count>
+        self.errorMessage = None
+        self.missingControllerList = []
+
+        try:
+            self._setup(uid, gid, limitDict)
+        except Exception as e:
+            self.rootDir = None
+            self.updatersDir = None
+            self.errorMessage = str(e)
+
+    def logStatus(self):
+        # logging is not initialized yet when we are created
+        if self.updatersDir is None:
+            logging.error("cgroup v2 is not available, resource limits, freezing and per-run accounting of initializers, updaters and maintainers are disabled (%s)." % (self.errorMessage))
+        elif len(self.missingControllerList) > 0:
+            logging.warning("cgroup controllers %s are not available, related resource limits are ignored." % (",".join(self.missingControllerList)))
+
+    def dispose(self):
+        if self.updatersDir is None:
+            return
+        for fn in os.listdir(self.updatersDir):
+            path = os.path.join(self.updatersDir, fn)
+            if os.path.isdir(path):
+                self._killAndRemove(path)
+
+    def isAvailable(self):
+        return self.updatersDir is not None
+
+    def createRunGroup(self, name, limitDict):
+        # returns path of the new cgroup, or None if cgroup is not available
+        if self.updatersDir is None:
+            return None
+
+        path = os.path.join(self.updatersDir, name)
+        if os.path.exists(path):
+            self._killAndRemove(path)           # left by a crashed run
+        os.mkdir(path)
+        try:
+            self._writeLimits(path, limitDict)
+        except Exception:
+            os.rmdir(path)
+            raise
+        return path
+
+    def getJoinCommand(self, path, cmd):
+        # returns a command which moves itself into the cgroup and then executes cmd
+        # the daemon has threads, so joining in preexec_fn (python code between fork and exec) is not safe,
+        # and joining after spawning lets the processes forked before that escape
+        return ["/bin/sh", "-c", 'echo $$ > "$1" && shift && exec "$@"', "cgroup-join", os.path.join(path, "cgroup.procs")] + cmd
+
+    def getGroupId(self, path):
+        # cgroup v2 id is the inode number of the cgroup directory, it is used by sock_diag to filter sockets
+        return os.stat(path).st_ino
+
+    def getPidList(self, path):
+        # returns empty list if the cgroup does not exist any more
+        try:
+            return [int(x) for x in self._readFile(os.path.join(path, "cgroup.procs")).split()]
+        except FileNotFoundError:
+            return []
+
+    def freezeRunGroup(self, path, bFreeze):
+        # returns False if cgroup freezer is not supported (linux < 5.2)
+        freezeFile = os.path.join(path, "cgroup.freeze")
+        if not os.path.exists(freezeFile):
+            return False
+        self._writeFile(freezeFile, "1" if bFreeze else "0")
+        return True
+
+    def destroyRunGroup(self, path):
+        # processes left in the cgroup are killed, removal is retried if the cgroup is still busy
+        self._killAndRemove(path)
+
+    @staticmethod
+    def parseLimitDict(limitDict, errPrefix):
+        # limit values come from json or xml, so they may be strings
+        ret = dict()
+        for key, value in limitDict.items():
+            if key not in McCgroupManager.LIMIT_FILE_DICT:
+                raise Exception("%s: invalid resource limit \"%s\"" % (errPrefix, key))
+            if key in ["cpu-weight", "io-weight"]:
+                value = int(value)
+                if not (1 <= value <= 10000):
+                    raise Exception("%s: resource limit \"%s\" must be in range [1,10000]" % (errPrefix, key))
+            elif key in ["memory-high", "memory-max"]:
+                m = re.fullmatch("([0-9]+)([KMG]?)", str(value))
+                if m is None:
+                    raise Exception("%s: invalid value of resource limit \"%s\"" % (errPrefix, key))
+                value = int(m.group(1)) * {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[m.group(2)]
+            elif key == "io-max":
+                if isinstance(value, str):
+                    value = [value]
+                for line in value:
+                    if re.fullmatch("[0-9]+:[0-9]+( +(rbps|wbps|riops|wiops)=([0-9]+|max))+", line) is None:
+                        raise Exception("%s: invalid value of resource limit \"%s\"" % (errPrefix, key))
+            else:
+                assert False
+            ret[key] = value
+        return ret
+
+    def _setup(self, uid, gid, limitDict):
+        if not os.path.exists("/sys/fs/cgroup/cgroup.controllers"):
+            raise Exception("cgroup v2 is not mounted on /sys/fs/cgroup")
+
+        # our own cgroup, it is the only line in /proc/self/cgroup for cgroup v2
+        with open("/proc/self/cgroup") as f:
+            for line in f.read().split("\n"):
+                if line.startswith("0::"):
+                    self.rootDir = os.path.join("/sys/fs/cgroup", line[3:].lstrip("/"))
+                    break
+            else:
+                raise Exception("can not find our own cgroup")
+
+        # processes can't live in a non-leaf cgroup which has controllers enabled, so move ourself into a leaf first
+        daemonDir = os.path.join(self.rootDir, "daemon")
+        if os.path.basename(self.rootDir) != "daemon":
+            if not os.path.exists(daemonDir):
+                os.mkdir(daemonDir)
+            for pid in self._readFile(os.path.join(self.rootDir, "cgroup.procs")).split():
+                try:
+                    self._writeFile(os.path.join(daemonDir, "cgroup.procs"), pid)
+                except ProcessLookupError:
+                    pass
+        else:
+            self.rootDir = os.path.dirname(self.rootDir)        # restarted in the same cgroup
+            daemonDir = os.path.join(self.rootDir, "daemon")
+
+        # enable controllers for the sub-tree
+        available = self._readFile(os.path.join(self.rootDir, "cgroup.controllers")).split()
+        ctrlList = [x for x in self.CONTROLLER_LIST if x in available]
+        self._writeFile(os.path.join(self.rootDir, "cgroup.subtree_control"), " ".join(["+" + x for x in ctrlList]))
+
+        updatersDir = os.path.join(self.rootDir, "updaters")
+        if os.path.exists(updatersDir):
+            self.updatersDir = updatersDir
+            self.dispose()                      # left by the previous daemon
+            self.updatersDir = None
+        else:
+            os.mkdir(updatersDir)
+        self._writeFile(os.path.join(updatersDir, "cgroup.subtree_control"), " ".join(["+" + x for x in ctrlList]))
+        self.missingControllerList = [x for x in self.CONTROLLER_LIST if x not in ctrlList]
+        self._writeLimits(updatersDir, limitDict)
+
+        # moving a process needs write access to cgroup.procs of the common ancestor, creating run leaves needs write access to "updaters"
+        for dn in [self.rootDir, daemonDir, updatersDir]:
+            os.chown(dn, uid, gid)
+            for fn in ["cgroup.procs", "cgroup.threads", "cgroup.subtree_control"]:
+                os.chown(os.path.join(dn, fn), uid, gid)
+
+        self.updatersDir = updatersDir
+
+    def _writeLimits(self, path, limitDict):
+        for key, value in limitDict.items():
+            if value is None:
+                continue
+            if key.split("-")[0] in self.missingControllerList:
+                continue
+            if key == "io-max":
+                for line in value:
+                    self._writeFile(os.path.join(path, self.LIMIT_FILE_DICT[key]), line)
+            elif key == "io-weight":
+                self._writeFile(os.path.join(path, self.LIMIT_FILE_DICT[key]), "default %d" % (value))
+            else:
+                self._writeFile(os.path.join(path, self.LIMIT_FILE_DICT[key]), str(value))
+
+    def _killAndRemove(self, path):
+        if not os.path.exists(path):
+            return
+        killFile = os.path.join(path, "cgroup.kill")
+        if os.path.exists(killFile):
+            self._writeFile(killFile, "1")
+        else:
+            for pid in self._readFile(os.path.join(path, "cgroup.procs")).split():
+                try:
+                    os.kill(int(pid), signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        self._tryRemove(path)
+
+    def _tryRemove(self, path):
+        # a cgroup can only be removed after all its processes are reaped
+        try:
+            os.rmdir(path)
+            self.rmdirRetryDict.pop(path, None)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                self.rmdirRetryDict.pop(path, None)
+            elif e.errno == errno.EBUSY:
+                count = self.rmdirRetryDict.get(path, 0)
+                if count < 10:
+                    self.rmdirRetryDict[path] = count + 1
+                    GLib.timeout_add_seconds(1, self._retryRemoveCallback, path)
+                else:
+                    del self.rmdirRetryDict[path]
+                    logging.warning("Failed to remove cgroup \"%s\"." % (path))
+            else:
+                raise
+
+    def _retryRemoveCallback(self, path):
+        if path in self.rmdirRetryDict:
+            self._tryRemove(path)
+        return False
+
+    def _readFile(self, filename):
+        with open(filename) as f:
+            return f.read()
+
+    def _writeFile(self, filename, content):
+        with open(filename, "w") as f:
+            f.write(content)
@@ -4,6 +4,7 @@
 import os
 import sys
 import json
+import time
 import prctl
 import signal
 import shutil
@@ -17,9 +18,12 @@ from mc_util import DropPriviledge
 from mc_util import StdoutRedirector
 from mc_util import AvahiServiceRegister
 from mc_param import McConst
+from mc_cgroup import McCgroupManager
 from mc_plugin import McPluginManager
+from mc_port_allocator import McPortAllocator
 from mc_advertiser import McMainAdvertiser
 from mc_updater import McMirrorSiteUpdater
+from mc_disk_usage import McDiskUsageCollector
 
 
 class McDaemon:
@@ -28,6 +32,8 @@ class McDaemon:
         self.param = param
 
     def run(self):
+        if McConst.uid is None or McConst.gid is None:
+            raise Exception("user \"%s\" or group \"%s\" does not exist" % (McConst.user, McConst.group))
         self._loadMainCfg()
         try:
             # create directories
@@ -37,6 +43,9 @@ class McDaemon:
             McUtil.prepareTransientDir(McConst.runDir, McConst.uid, McConst.gid, 0o755)
             McUtil.prepareTransientDir(McConst.tmpDir, McConst.uid, McConst.gid, 0o755)
 
+            # cgroup hierarchy is set up as root and then delegated to us
+            self.param.cgroupManager = McCgroupManager(McConst.uid, McConst.gid, self.param.mainCfg["updaterResourceLimits"])
+
             with DropPriviledge(McConst.uid, McConst.gid, caps=[prctl.CAP_NET_BIND_SERVICE]):
                 try:
                     # initialize logging
@@ -46,6 +55,7 @@ class McDaemon:
                     logging.getLogger().addHandler(logging.StreamHandler(sys.stderr))
                     logging.getLogger().setLevel(logging.INFO)
                     logging.info("Program begins.")
+                    self.param.cgroupManager.logStatus()
 
                     # create mainloop
                     asyncio.set_event_loop_policy(asyncio_glib.GLibEventLoopPolicy())
@@ -55,19 +65,31 @@ class McDaemon:
                     McUtil.writePidFile(McConst.pidFile)
 
                     # load plugin, storage, advertiser
+                    startTime = time.monotonic()
+                    t = time.monotonic()
                     self.param.pluginManager = McPluginManager(self.param)
                     self.param.pluginManager.loadEnabledPlugins()
-                    logging.info("Mirror site plugins loaded: %s" % (",".join(sorted(self.param.pluginManager.getEnabledPluginNameList()))))
-                    self.param.pluginManager.loadStorageObjects()           # log by itself
-                    self.param.pluginManager.loadAdvertiserObjects()        # log by itself
+                    logging.info("Mirror site plugins loaded in %.2f seconds: %s" % (time.monotonic() - t, ",".join(sorted(self.param.pluginManager.getEnabledPluginNameList()))))
+                    t = time.monotonic()
+                    self.param.portAllocator = McPortAllocator(self.param.listenIp, McConst.portMapFile)
+                    self.param.pluginManager.loadStorageAndAdvertiserObjects()      # log by itself
+                    logging.info("Storages and advertisers loaded in %.2f seconds." % (time.monotonic() - t))
 
                     # main advertiser
+                    t = time.monotonic()
                     self.param.globalAdvertiser = McMainAdvertiser(self.param)
-                    logging.info("Mirror site main advertiser initialized.")
+                    logging.info("Mirror site main advertiser initialized in %.2f seconds." % (time.monotonic() - t))
+
+                    # disk usage collector
+                    t = time.monotonic()
+                    self.param.diskUsageCollector = McDiskUsageCollector(self.param)
+                    logging.info("Mirror site disk usage collector initialized in %.2f seconds." % (time.monotonic() - t))
 
                     # updater
+                    t = time.monotonic()
                     self.param.updater = McMirrorSiteUpdater(self.param)
-                    logging.info("Mirror site updater initialized.")
+                    logging.info("Mirror site updater initialized in %.2f seconds." % (time.monotonic() - t))
+                    logging.info("%d mirror sites started in %.2f seconds." % (len(self.param.mirrorSiteDict), time.monotonic() - startTime))
 
                     # register serivce
                     if McConst.avahiSupport:
@@ -88,21 +110,29 @@ class McDaemon:
                     logging.info("Mainloop begins.")
                     GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGINT, self._sigHandlerINT, None)
                     GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGTERM, self._sigHandlerTERM, None)
+                    GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGHUP, self._sigHandlerHUP, None)
                     self.param.mainloop.run_forever()
                     logging.info("Mainloop exits.")
                 finally:
+                    if self.param.pluginManager is not None:
+                        self.param.pluginManager.dispose()
                     if self.param.pserversClientObj is not None:
                         self.param.pserversClientObj.stop()
                     if self.param.avahiObj is not None:
                         self.param.avahiObj.stop()
                     if self.param.updater is not None:
                         self.param.updater.dispose()
+                    self.param.cgroupManager.dispose()
+                    if self.param.diskUsageCollector is not None:
+                        self.param.diskUsageCollector.dispose()
                     if self.param.globalAdvertiser is not None:
                         self.param.globalAdvertiser.dispose()
                     for obj in self.param.advertiserDict.values():
                         obj.dispose()
                     for obj in self.param.storageDict.values():
                         obj.dispose()
+                    if self.param.portAllocator is not None:
+                        self.param.portAllocator.dispose()
                     logging.shutdown()
         finally:
             shutil.rmtree(McConst.tmpDir)
@@ -122,7 +152,60 @@ class McDaemon:
         if "mainPort" in dataObj:
             self.param.mainPort = dataObj["mainPort"]
         if "preferedUpdatePeriodList" in dataObj:
+            for item in dataObj["preferedUpdatePeriodList"]:
+                if "start" not in item or "time" not in item:
+                    raise Exception("invalid item in \"preferedUpdatePeriodList\" section in main config file")
             self.param.mainCfg["preferedUpdatePeriodList"] = dataObj["preferedUpdatePeriodList"]
+        if "scheduleJitter" in dataObj:
+            if not isinstance(dataObj["scheduleJitter"], int) or dataObj["scheduleJitter"] < 0:
+                raise Exception("invalid \"scheduleJitter\" in main config file")
+            self.param.mainCfg["scheduleJitter"] = dataObj["scheduleJitter"]
+        if "catchUpPolicy" in dataObj:
+            if dataObj["catchUpPolicy"] not in ["skip", "coalesce", "spread"]:
+                raise Exception("invalid \"catchUpPolicy\" in main config file")
+            self.param.mainCfg["catchUpPolicy"] = dataObj["catchUpPolicy"]
+        if "updateConcurrencyLimit" in dataObj:
+            for key, value in dataObj["updateConcurrencyLimit"].items():
+                if key not in self.param.mainCfg["updateConcurrencyLimit"]:
+                    raise Exception("invalid key \"%s\" in \"updateConcurrencyLimit\" section in main config file" % (key))
+                if key == "global":
+                    bValid = value is None or (isinstance(value, int) and value > 0)                        # None means no limit
+                else:
+                    bValid = isinstance(value, dict) and all([isinstance(k, str) and isinstance(v, int) and v > 0 for k, v in value.items()])
+                if not bValid:
+                    raise Exception("invalid value of \"%s\" in \"updateConcurrencyLimit\" section in main config file" % (key))
+                self.param.mainCfg["updateConcurrencyLimit"][key] = value
+        if "updaterResourceLimits" in dataObj:
+            self.param.mainCfg["updaterResourceLimits"].update(McCgroupManager.parseLimitDict(dataObj["updaterResourceLimits"], "\"updaterResourceLimits\" section in main config file"))
+        for section in ["retryBackoff", "circuitBreaker", "diskUsageScan"]:
+            if section in dataObj:
+                for key, value in dataObj[section].items():
+                    if key not in self.param.mainCfg[section]:
+                        raise Exception("invalid key \"%s\" in \"%s\" section in main config file" % (key, section))
+                    if not isinstance(value, int) or value <= 0:
+                        raise Exception("invalid value of \"%s\" in \"%s\" section in main config file" % (key, section))
+                    self.param.mainCfg[section][key] = value
+        if "loadShedding" in dataObj:
+            cfg = self.param.mainCfg["loadShedding"]
+            for key, value in dataObj["loadShedding"].items():
+                if key not in cfg:
+                    raise Exception("invalid key \"%s\" in \"loadShedding\" section in main config file" % (key))
+                if key == "interfaces":
+                    if not isinstance(value, list) or not all([isinstance(x, str) for x in value]):
+                        raise Exception("invalid value of \"interfaces\" in \"loadShedding\" section in main config file")
+                elif not isinstance(value, int) or value <= 0:
+                    raise Exception("invalid value of \"%s\" in \"loadShedding\" section in main config file" % (key))
+                cfg[key] = value
+            for name in ["bandwidth", "connection"]:
+                if cfg[name + "High"] is None and cfg[name + "Low"] is None:
+                    continue
+                if cfg[name + "High"] is None or cfg[name + "Low"] is None or cfg[name + "Low"] > cfg[name + "High"]:
+                    raise Exception("\"%sHigh\" and \"%sLow\" in \"loadShedding\" section in main config file must be specified together, and the former must not be less than the latter" % (name, name))
+        if "advertiserConfig" in dataObj:
+            for key, value in dataObj["advertiserConfig"].items():
+                if not isinstance(value, dict):
+                    raise Exception("invalid value of \"%s\" in \"advertiserConfig\" section in main config file" % (key))
+            self.param.mainCfg["advertiserConfig"] = dataObj["advertiserConfig"]
         if "country" in dataObj:
             self.param.mainCfg["country"] = dataObj["country"]
         if "location" in dataObj:
@@ -143,3 +226,11 @@ class McDaemon:
         logging.info("SIGTERM received.")
         self.param.mainloop.call_soon_threadsafe(self.param.mainloop.stop)
         return True
+
+    def _sigHandlerHUP(self, signum):
+        logging.info("SIGHUP received, reloading mirror site plugins.")
+        try:
+            self.param.pluginManager.reloadEnabledPlugins()
+        except Exception:
+            logging.error("Reloading mirror site plugins failed.", exc_info=True)
+        return True
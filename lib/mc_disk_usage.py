@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import time
+import logging
+import threading
+import concurrent.futures
+from gi.repository import GLib
+from mc_util import RecordLogFile
+
+
+class McDiskUsageCollector:
+
+    """
+    Collects disk usage of the data directories of all the mirror sites in a background thread.
+    Directories are scanned in parallel by a thread pool, the files directly in a directory are
+    summed up and cached together with the sub-directory list, keyed by (mtime, ctime) of the
+    directory. Creating, removing or renaming an entry changes the directory's mtime, so an
+    unchanged directory costs one stat() instead of a scandir() and a stat() for each file.
+    Files modified in place are not noticed until their directory changes, mirror updaters
+    (rsync, wget, etc.) write to a temporary file and rename it, so this is rarely a problem.
+    Results are recorded in "<master-dir>/DISK_USAGE_HISTORY.jsonl".
+    """
+
+    MAX_RECORD_COUNT = 2000
+
+    def __init__(self, param):
+        self.param = param
+        self.interval = self.param.mainCfg["diskUsageScan"]["interval"]
+        self.threadCount = self.param.mainCfg["diskUsageScan"]["threads"]
+
+        self.usageDict = dict()                         # dict<mirror-id,dict<storage-name,(bytes,file-count,scan-time)>>
+        self.historyDict = dict()                       # dict<mirror-id,RecordLogFile>
+        for msObj in self.param.mirrorSiteDict.values():
+            self._addMirrorSite(msObj)
+
+        # members shared with the scan thread, protected by self.cond
+        self.cond = threading.Condition()
+        self.queue = []                                 # list<mirror-id>
+        self.bStop = False
+
+        # members only used by the scan thread
+        self.cacheDict = dict()                         # dict<data-directory,dict<directory,((mtime,ctime),bytes,file-count,list<sub-directory>)>>
+
+        self.thread = threading.Thread(target=self._threadFunc, name="disk-usage")
+        self.thread.start()
+        self.requestScanAll()
+        self.timer = GLib.timeout_add_seconds(self.interval, self._timerCallback)
+
+    def dispose(self):
+        GLib.source_remove(self.timer)
+        with self.cond:
+            self.bStop = True
+            self.cond.notify()
+        self.thread.join()
+
+    def addMirrorSite(self, mirrorSite):
+        self._addMirrorSite(mirrorSite)
+        self.requestScan(mirrorSite.id)
+
+    def removeMirrorSite(self, mirrorSiteId):
+        # a scan in progress is dropped when it finishes
+        del self.usageDict[mirrorSiteId]
+        del self.historyDict[mirrorSiteId]
+        with self.cond:
+            if mirrorSiteId in self.queue:
+                self.queue.remove(mirrorSiteId)
+
+    def requestScan(self, mirrorSiteId):
+        with self.cond:
+            if mirrorSiteId not in self.queue:
+                self.queue.append(mirrorSiteId)
+                self.cond.notify()
+
+    def requestScanAll(self):
+        for msId in sorted(self.param.mirrorSiteDict.keys()):
+            self.requestScan(msId)
+
+    def getUsage(self, mirrorSiteId):
+        # returns dict<storage-name,(bytes,file-count,scan-time)>, storages not scanned yet are absent
+        return self.usageDict[mirrorSiteId]
+
+    def getHistory(self, mirrorSiteId, n):
+        # returns list<(time,dict<storage-name,(bytes,file-count)>)>, list order: from old to new
+        ret = []
+        for record in self.historyDict[mirrorSiteId].getLast(n):
+            ret.append((record["time"], {k: (v["bytes"], v["files"]) for k, v in record["storage"].items()}))
+        return ret
+
+    def _addMirrorSite(self, mirrorSite):
+        msId = mirrorSite.id
+        self.usageDict[msId] = dict()
+        self.historyDict[msId] = RecordLogFile(os.path.join(mirrorSite.masterDir, "DISK_USAGE_HISTORY.jsonl"), lambda x: x["time"], self.MAX_RECORD_COUNT)
+        if not self.historyDict[msId].exists():
+            self.historyDict[msId].create()
+        for record in self.historyDict[msId].getLast(1):
+            for st, value in record["storage"].items():
+                self.usageDict[msId][st] = (value["bytes"], value["files"], record["time"])
+
+    def _timerCallback(self):
+        self.requestScanAll()
+        return True
+
+    def _scanFinished(self, mirrorSiteId, resultDict):
+        # called in main thread
+        if self.bStop:
+            return False
+        if mirrorSiteId not in self.usageDict:
+            return False                                # removed during scanning
+        curTime = time.time()
+        record = {
+            "time": curTime,
+            "storage": dict(),
+        }
+        for st, (size, count) in resultDict.items():
+            self.usageDict[mirrorSiteId][st] = (size, count, curTime)
+            record["storage"][st] = {
+                "bytes": size,
+                "files": count,
+            }
+        self.historyDict[mirrorSiteId].append(record)
+        return False
+
+    def _threadFunc(self):
+        with concurrent.futures.ThreadPoolExecutor(self.threadCount) as executor:
+            while True:
+                with self.cond:
+                    while not self.bStop and len(self.queue) == 0:
+                        self.cond.wait()
+                    if self.bStop:
+                        return
+                    msId = self.queue.pop(0)
+
+                try:
+                    msObj = self.param.mirrorSiteDict.get(msId)
+                    if msObj is None:
+                        continue                        # removed after requested
+                    resultDict = dict()
+                    for st, (dummy, dataDir) in msObj.storageDict.items():
+                        t = time.monotonic()
+                        ret = self._scanTree(executor, dataDir)
+                        if ret is None:
+                            return                      # stopped
+                        size, count, dirCount, scanCount = ret
+                        resultDict[st] = (size, count)
+                        logging.info("Mirror site \"%s\" disk usage of storage \"%s\" scanned, %d of %d directories changed, %.1f seconds." % (msId, st, scanCount, dirCount, time.monotonic() - t))
+                    GLib.idle_add(self._scanFinished, msId, resultDict)
+                except Exception:
+                    logging.error("Mirror site \"%s\" disk usage scan failed." % (msId), exc_info=True)
+
+    def _scanTree(self, executor, dataDir):
+        # returns (bytes,file-count,directory-count,scanned-directory-count), returns None if stopped
+        oldCache = self.cacheDict.get(dataDir, dict())
+        newCache = dict()
+        size, count, scanCount = 0, 0, 0
+
+        pendingSet = set()
+        if os.path.isdir(dataDir):
+            pendingSet.add(executor.submit(self._scanDir, dataDir, oldCache.get(dataDir)))
+        while len(pendingSet) > 0:
+            if self.bStop:
+                for f in pendingSet:
+                    f.cancel()
+                return None
+            doneSet, pendingSet = concurrent.futures.wait(pendingSet, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in doneSet:
+                path, entry, bScanned = f.result()
+                if entry is None:
+                    continue                            # removed during scanning
+                newCache[path] = entry
+                size += entry[1]
+                count += entry[2]
+                if bScanned:
+                    scanCount += 1
+                for subDir in entry[3]:
+                    pendingSet.add(executor.submit(self._scanDir, subDir, oldCache.get(subDir)))
+
+        self.cacheDict[dataDir] = newCache              # directories not seen any more are dropped
+        return (size, count, len(newCache), scanCount)
+
+    def _scanDir(self, path, oldEntry):
+        # called in the thread pool, returns (path,cache-entry,scanned)
+        try:
+            st = os.stat(path, follow_symlinks=False)
+            key = (st.st_mtime_ns, st.st_ctime_ns)
+            if oldEntry is not None and oldEntry[0] == key:
+                return (path, oldEntry, False)
+
+            size, count, subDirList = st.st_blocks * 512, 0, []
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subDirList.append(entry.path)
+                            else:
+                                size += entry.stat(follow_symlinks=False).st_blocks * 512
+                                count += 1
+                        except FileNotFoundError:
+                            pass                        # removed during scanning
+            except PermissionError:
+                logging.warning("Directory \"%s\" is not readable, its disk usage is not counted." % (path))
+            return (path, (key, size, count, subDirList), True)
+        except (FileNotFoundError, NotADirectoryError):
+            return (path, None, True)
@@ -25,13 +25,19 @@ class McConst:
 
     user = "mirrors"
     group = "mirrors"
-    uid = pwd.getpwnam(user).pw_uid
-    gid = grp.getgrnam(group).gr_gid
+    try:
+        uid = pwd.getpwnam(user).pw_uid
+        gid = grp.getgrnam(group).gr_gid
+    except KeyError:
+        uid = None                      # only the daemon needs them, tools in scripts/ run without the user
+        gid = None
 
     mainCfgFile = os.path.join(etcDir, "main.conf")
     pluginCfgFileGlobPattern = os.path.join(etcDir, "plugin-*.conf")
     pidFile = os.path.join(runDir, "mirrors.pid")
     apiServerFile = os.path.join(runDir, "api.socket")
+    pluginMetadataCacheFile = os.path.join(cacheDir, "plugin-metadata.cache")
+    portMapFile = os.path.join(varDir, "port-map.json")
 
     avahiSupport = True
     avahiServiceName = "_mirrors._tcp"
@@ -47,6 +53,40 @@ class McParam:
 
         self.mainCfg = {
             "preferedUpdatePeriodList": [],     # { "start": CRON-EXPRESSION, "time": HOURS }
+            "scheduleJitter": 600,              # SECONDS
+            "catchUpPolicy": "spread",          # "skip" or "coalesce" or "spread"
+            "updateConcurrencyLimit": {         # { "global": NUMBER, "storage": { STORAGE-NAME: NUMBER }, "plugin": { PLUGIN-NAME: NUMBER } }
+                "global": 8,
+                "storage": dict(),
+                "plugin": dict(),
+            },
+            "retryBackoff": {                   # { "base": SECONDS, "cap": SECONDS }
+                "base": 60,
+                "cap": 6 * 60 * 60,
+            },
+            "circuitBreaker": {                 # { "threshold": NUMBER, "cooldown": SECONDS, "maxCooldown": SECONDS }
+                "threshold": 5,
+                "cooldown": 10 * 60,
+                "maxCooldown": 24 * 60 * 60,
+            },
+            "updaterResourceLimits": {          # { "cpu-weight": NUMBER, "io-weight": NUMBER, "io-max": [ "MAJ:MIN rbps=N wbps=N" ], "memory-high": BYTES, "memory-max": BYTES }
+                "cpu-weight": 50,
+                "io-weight": 50,
+            },
+            "loadShedding": {                   # { "interval": SECONDS, "resumeDelay": SECONDS, "interfaces": [ NAME ], "bandwidthHigh": BYTES-PER-SECOND, "bandwidthLow": BYTES-PER-SECOND, "connectionHigh": NUMBER, "connectionLow": NUMBER }
+                "interval": 5,
+                "resumeDelay": 60,
+                "interfaces": None,             # None means all the interfaces except loopback
+                "bandwidthHigh": None,          # None means not watched
+                "bandwidthLow": None,
+                "connectionHigh": None,         # None means not watched
+                "connectionLow": None,
+            },
+            "diskUsageScan": {                  # { "interval": SECONDS, "threads": NUMBER }
+                "interval": 6 * 60 * 60,
+                "threads": 4,
+            },
+            "advertiserConfig": dict(),         # { ADVERTISER-NAME: { KEY: VALUE } }, checked by the advertiser
             "country": "CN",
             "location": "",
             "pserver-domain-name": None,
@@ -55,10 +95,13 @@ class McParam:
         # objects
         self.mainloop = None
         self.pluginManager = None
+        self.portAllocator = None
+        self.cgroupManager = None
         self.mirrorSiteDict = dict()
         self.storageDict = dict()
         self.advertiserDict = dict()
         self.globalAdvertiser = None
         self.updater = None
+        self.diskUsageCollector = None
         self.avahiObj = None
         self.pserversClientObj = None
@@ -3,18 +3,42 @@
 
 import os
 import re
+import sys
 import glob
 import json
+import time
+import logging
+import threading
 import lxml.etree
+import concurrent.futures
 from datetime import timedelta
+from gi.repository import GLib
 from mc_util import McUtil
 from mc_param import McConst
+from mc_scheduler import CronExpr
+from mc_cgroup import McCgroupManager
 
 
 class McPluginManager:
 
     def __init__(self, param):
         self.param = param
+        self.pendingReloadDict = dict()                         # dict<mirror-id,McMirrorSite>, mirror sites waiting for their old definition to be removed, value is None if not re-added
+        self.storageNameList = None                             # memoized when loading plugins
+        self.advertiserNameList = None                          # same as above
+
+        # reloading in progress, new storage and advertiser objects are being created in self.reloadThread
+        self.reloadThread = None
+        self.reloadResult = None                                # (dict<storage-name,object>,dict<advertiser-name,object>,exc_info), set by self.reloadThread
+        self.bReloadAgain = False
+        self.deferredReloadList = []                            # list<mirror-id>, mirror sites removed from updater during reloading
+
+    def dispose(self):
+        # objects created by an unfinished reloading are disposed
+        if self.reloadThread is not None:
+            self.reloadThread.join()
+            self.reloadThread = None
+            self._disposeObjects(self.reloadResult[0], self.reloadResult[1])
 
     def getEnabledPluginNameList(self):
         ret = []
@@ -27,52 +51,197 @@ class McPluginManager:
         return ret
 
     def loadEnabledPlugins(self):
-        for pluginName in self.getEnabledPluginNameList():
-            with open(os.path.join(McConst.etcDir, "plugin-%s.conf" % (pluginName)), "r") as f:
-                buf = f.read()
-                if buf != "":
-                    pluginCfg = json.loads(buf)
-                else:
-                    pluginCfg = dict()
-            self._loadOnePlugin(pluginName, os.path.join(McConst.pluginsDir, pluginName), pluginCfg)
+        self.param.mirrorSiteDict.update(self._loadEnabledPlugins())
+
+    def reloadEnabledPlugins(self):
+        # only the added, removed and changed mirror sites are touched, nothing is changed if the new configuration is invalid
+        # the running initializer or updater of a removed or changed mirror site is allowed to finish first
+        # new storage and advertiser objects are created in a thread, starting a database server does not block the main loop
+        if self.reloadThread is not None:
+            self.bReloadAgain = True
+            logging.info("Reloading of mirror site plugins is in progress, it will be done again after that.")
+            return
+
+        newDict = self._loadEnabledPlugins()
+
+        addList, removeList, changeList, pendingList = [], [], [], []
+        for msId in sorted(set(newDict.keys()) | set(self.param.mirrorSiteDict.keys())):
+            if msId in self.pendingReloadDict:
+                pendingList.append(msId)
+            elif msId not in self.param.mirrorSiteDict:
+                addList.append(msId)
+            elif msId not in newDict:
+                removeList.append(msId)
+            elif newDict[msId].fingerprint != self.param.mirrorSiteDict[msId].fingerprint:
+                changeList.append(msId)
+        addMsList = [newDict[x] for x in addList]
+        laterMsList = [newDict[x] for x in changeList + pendingList if x in newDict]      # added after their old definitions are removed
+        self._checkReloadable(addMsList, [self.param.mirrorSiteDict[x] for x in removeList + changeList], laterMsList)
+
+        # objects needed by the mirror sites which are added later are created now, with no mirror site
+        storageNameList = sorted(set([x for ms in addMsList + laterMsList for x in ms.storageDict]) - set(self.param.storageDict.keys()))
+        advertiserNameList = sorted(set([x for ms in addMsList + laterMsList for x in ms.advertiserDict]) - set(self.param.advertiserDict.keys()))
+        existStorageDict = dict(self.param.storageDict)
+
+        def _threadFunc():
+            try:
+                self.reloadResult = self._loadObjects(addMsList, storageNameList, advertiserNameList, existStorageDict) + (None,)
+            except Exception:
+                self.reloadResult = (dict(), dict(), sys.exc_info())
+            GLib.idle_add(self._reloadObjectsLoaded, addMsList, removeList, changeList, pendingList, newDict)
+
+        self.reloadThread = threading.Thread(target=_threadFunc, name="plugin-reload")
+        self.reloadThread.start()
+
+    def _reloadObjectsLoaded(self, addMsList, removeList, changeList, pendingList, newDict):
+        # called in main thread, the mirror site state has not been changed since reloadEnabledPlugins()
+        if self.reloadThread is None:
+            return False                                        # disposed
+        self.reloadThread.join()
+        self.reloadThread = None
+        storageDict, advertiserDict, excInfo = self.reloadResult
+        self.reloadResult = None
+
+        try:
+            if excInfo is not None:
+                raise excInfo[1].with_traceback(excInfo[2])
+            try:
+                self._addMirrorSites(addMsList, storageDict, advertiserDict)
+            except Exception:
+                self._disposeObjects(storageDict, advertiserDict)
+                raise
+            for ms in addMsList:
+                logging.info("Mirror site \"%s\" added." % (ms.id))
+
+            for msId in pendingList:
+                self.pendingReloadDict[msId] = newDict.get(msId)
+            for msId in removeList + changeList:
+                self.pendingReloadDict[msId] = newDict.get(msId)
+                self.param.updater.removeMirrorSite(msId, lambda x=msId: self._reloadMirrorSite(x))
+            logging.info("Mirror site plugins reloaded, %d added, %d removed, %d changed." % (len(addMsList), len(removeList), len(changeList)))
+        except Exception:
+            logging.error("Reloading mirror site plugins failed.", exc_info=True)
+        finally:
+            deferredList = self.deferredReloadList
+            self.deferredReloadList = []
+            for msId in deferredList:
+                self._reloadMirrorSite(msId)
+            self._disposeUnusedObjects()
+
+        if self.bReloadAgain:
+            self.bReloadAgain = False
+            try:
+                self.reloadEnabledPlugins()
+            except Exception:
+                logging.error("Reloading mirror site plugins failed.", exc_info=True)
+        return False
 
     def getStorageNameList(self):
+        if self.storageNameList is not None:
+            return self.storageNameList
         ret = os.listdir(McConst.storageDir)
         ret = [x for x in ret if os.path.isdir(os.path.join(McConst.storageDir, x))]
         return ret
 
-    def loadStorageObjects(self):
-        tDict = dict()                                          # {storage-name: [mirror-site-id]}
-        for msId, msObj in self.param.mirrorSiteDict.items():
-            for st in msObj.storageDict:
-                if st not in tDict:
-                    tDict[st] = []
-                tDict[st].append(msId)
-
-        storageNameList = sorted(list(tDict.keys()))            # [storage-name]
-        if "file" in storageNameList:
-            # always load the simplest file storage object first
-            storageNameList.remove("file")
-            storageNameList.insert(0, "file")
-
-        for st in storageNameList:
-            self.param.storageDict[st] = self._loadOneStorageObject(st, tDict[st])
-
     def getAdvertiserNameList(self):
+        if self.advertiserNameList is not None:
+            return self.advertiserNameList
         return os.listdir(McConst.advertiserDir)
 
-    def loadAdvertiserObjects(self):
-        tDict = dict()                                          # {advertiser-name: [mirror-site-id]}
-        for msId, msObj in self.param.mirrorSiteDict.items():
-            for name in msObj.advertiserDict:
-                if name not in tDict:
-                    tDict[name] = []
-                tDict[name].append(msId)
+    def loadStorageAndAdvertiserObjects(self):
+        msList = list(self.param.mirrorSiteDict.values())
+        storageNameList = sorted(set([x for ms in msList for x in ms.storageDict]))
+        advertiserNameList = sorted(set([x for ms in msList for x in ms.advertiserDict]))
+        storageDict, advertiserDict = self._loadObjects(msList, storageNameList, advertiserNameList, dict())
+        self.param.storageDict.update(storageDict)
+        self.param.advertiserDict.update(advertiserDict)
+
+    def _loadObjects(self, msList, storageNameList, advertiserNameList, existStorageDict):
+        # creates the specified storage and advertiser objects with all the mirror sites in msList that use them
+        # all of them are started concurrently, an advertiser only waits for the storages it needs parameters from
+        # returns (dict<storage-name,object>,dict<advertiser-name,object>), objects created are disposed if anything fails
+        # called in main thread or in a reloading thread, so nothing in self.param is changed here
+        storageDict = dict()
+        advertiserDict = dict()
+
+        def _loadStorage(st):
+            t = time.monotonic()
+            storageDict[st] = self._loadOneStorageObject(st, [x for x in msList if st in x.storageDict])
+            logging.info("Storage \"%s\" loaded in %.2f seconds." % (st, time.monotonic() - t))
+
+        def _loadAdvertiser(name):
+            mod = getattr(__import__("advertiser.%s" % (name)), name)
+            depList = mod.Advertiser.get_properties().get("storage-dependencies", [])
+            advMsList = [x for x in msList if name in x.advertiserDict]
+            depStorageDict = dict(existStorageDict)
+            for st in sorted(set([x for ms in advMsList for x in ms.storageDict])):
+                if st in depList and st in storageFutureDict:
+                    storageFutureDict[st].result()
+                    depStorageDict[st] = storageDict[st]
+            t = time.monotonic()
+            advertiserDict[name] = self._loadOneAdvertiserObject(name, advMsList, depStorageDict)
+            logging.info("Advertiser \"%s\" loaded in %.2f seconds." % (name, time.monotonic() - t))
+
+        # every task has its own thread, so that waiting advertisers don't block storages
+        storageFutureDict = dict()
+        advertiserFutureDict = dict()
+        with concurrent.futures.ThreadPoolExecutor(max(1, len(storageNameList) + len(advertiserNameList))) as executor:
+            for st in storageNameList:
+                storageFutureDict[st] = executor.submit(_loadStorage, st)
+            for name in advertiserNameList:
+                advertiserFutureDict[name] = executor.submit(_loadAdvertiser, name)
+        try:
+            for f in list(storageFutureDict.values()) + list(advertiserFutureDict.values()):
+                f.result()
+        except Exception:
+            self._disposeObjects(storageDict, advertiserDict)
+            raise
+        return (storageDict, advertiserDict)
+
+    def _loadEnabledPlugins(self):
+        # returns dict<mirror-id,McMirrorSite>
+        # plugins are loaded in a thread pool, most of the time is spent on parsing metadata.xml and creating directories
+        # parsed metadata.xml is cached, they are rarely changed
+        t = time.monotonic()
+        self.storageNameList = self.getStorageNameList()
+        self.advertiserNameList = self.getAdvertiserNameList()
+        try:
+            pluginList = []                                     # list<(plugin-name,plugin-directory,plugin-config)>
+            for pluginName in sorted(self.getEnabledPluginNameList()):
+                with open(os.path.join(McConst.etcDir, "plugin-%s.conf" % (pluginName)), "r") as f:
+                    buf = f.read()
+                    if buf != "":
+                        pluginCfg = json.loads(buf)
+                    else:
+                        pluginCfg = dict()
+                pluginList.append((pluginName, os.path.join(McConst.pluginsDir, pluginName), pluginCfg))
+
+            cache = _MetadataCache(McConst.pluginMetadataCacheFile)
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                resultList = list(executor.map(lambda x: self._loadOnePlugin(x[0], x[1], x[2], cache), pluginList))
+        finally:
+            self.storageNameList = None
+            self.advertiserNameList = None
+
+        ret = dict()
+        cachedCount = 0
+        for (pluginName, path, pluginCfg), (msList, metadataFile, key, definitionList, bCached) in zip(pluginList, resultList):
+            for ms in msList:
+                if ms.id in ret:
+                    raise Exception("metadata.xml for plugin %s contains duplicate mirror-site %s" % (pluginName, ms.id))
+                ret[ms.id] = ms
+            cache.put(metadataFile, key, definitionList)
+            if bCached:
+                cachedCount += 1
+        self._checkDependencies(ret)
+        cache.save()
+
+        logging.info("Plugin metadata of %d plugins loaded (%d from cache) in %.2f seconds." % (len(pluginList), cachedCount, time.monotonic() - t))
+        return ret
 
-        for name in sorted(list(tDict.keys())):
-            self.param.advertiserDict[name] = self._loadOneAdvertiserObject(name, tDict[name])
+    def _loadOnePlugin(self, name, path, cfgDict, cache):
+        # called in thread pool, returns (list<McMirrorSite>,metadata-file,cache-key,list<definition>,from-cache)
 
-    def _loadOnePlugin(self, name, path, cfgDict):
         # get metadata.xml file
         metadata_file = os.path.join(path, "metadata.xml")
         if not os.path.exists(metadata_file):
@@ -82,36 +251,179 @@ class McPluginManager:
         if not os.access(metadata_file, os.R_OK):
             raise Exception("metadata.xml for plugin %s is invalid" % (name))
 
-        # check metadata.xml file content
-        # FIXME
-        rootElem = lxml.etree.parse(metadata_file).getroot()
-        # if True:
-        #     dtd = libxml2.parseDTD(None, constants.PATH_PLUGIN_DTD_FILE)
-        #     ctxt = libxml2.newValidCtxt()
-        #     messages = []
-        #     ctxt.setValidityErrorHandler(lambda item, msgs: msgs.append(item), None, messages)
-        #     if tree.validateDtd(ctxt, dtd) != 1:
-        #         msg = ""
-        #         for i in messages:
-        #             msg += i
-        #         raise exceptions.IncorrectPluginMetaFile(metadata_file, msg)
+        # use cached definitions if metadata.xml is not changed
+        st = os.stat(metadata_file)
+        key = [st.st_mtime_ns, st.st_size]
+        definitionList = cache.get(metadata_file, key)
+        bCached = (definitionList is not None)
+
+        if not bCached:
+            # check metadata.xml file content
+            # FIXME
+            rootElem = lxml.etree.parse(metadata_file).getroot()
+            # if True:
+            #     dtd = libxml2.parseDTD(None, constants.PATH_PLUGIN_DTD_FILE)
+            #     ctxt = libxml2.newValidCtxt()
+            #     messages = []
+            #     ctxt.setValidityErrorHandler(lambda item, msgs: msgs.append(item), None, messages)
+            #     if tree.validateDtd(ctxt, dtd) != 1:
+            #         msg = ""
+            #         for i in messages:
+            #             msg += i
+            #         raise exceptions.IncorrectPluginMetaFile(metadata_file, msg)
+
+            if rootElem.tag == "mirror-site":
+                elemList = [rootElem]
+            elif rootElem.tag in ["mirror-sites", "plugin"]:                # FIXME: "plugin" is deprecated
+                elemList = rootElem.xpath("./mirror-site")
+            else:
+                raise Exception("metadata.xml content for plugin %s is invalid" % (name))
+            definitionList = [McMirrorSite.parseMetadata(x) for x in elemList]
 
         # create McMirrorSite objects
-        if rootElem.tag == "mirror-site":
-            msId = rootElem.get("id")
-            if msId in self.param.mirrorSiteDict:
-                raise Exception("metadata.xml for plugin %s contains duplicate mirror-site %s" % (name, msId))
-            self.param.mirrorSiteDict[msId] = McMirrorSite(self.param, path, rootElem, cfgDict)
-        elif rootElem.tag in ["mirror-sites", "plugin"]:                    # FIXME: "plugin" is deprecated
-            for child in rootElem.xpath("./mirror-site"):
-                msId = child.get("id")
-                if msId in self.param.mirrorSiteDict:
-                    raise Exception("metadata.xml for plugin %s contains duplicate mirror-site %s" % (name, msId))
-                self.param.mirrorSiteDict[msId] = McMirrorSite(self.param, path, child, cfgDict)
+        msList = [McMirrorSite(self.param, path, x, cfgDict) for x in definitionList]
+        return (msList, metadata_file, key, definitionList, bCached)
+
+    def _checkDependencies(self, mirrorSiteDict):
+        for msId, msObj in mirrorSiteDict.items():
+            for depId in msObj.dependsOnList:
+                if depId not in mirrorSiteDict:
+                    raise Exception("mirror site %s depends on non-existent mirror site %s" % (msId, depId))
+
+        # depth first search, a mirror site in the current path being visited again means a cycle
+        visitedSet = set()
+        pathList = []
+
+        def _visit(msId):
+            if msId in pathList:
+                cycle = pathList[pathList.index(msId):] + [msId]
+                raise Exception("mirror sites have cyclic dependency: %s" % (" -> ".join(cycle)))
+            if msId in visitedSet:
+                return
+            pathList.append(msId)
+            for depId in mirrorSiteDict[msId].dependsOnList:
+                _visit(depId)
+            pathList.pop()
+            visitedSet.add(msId)
+
+        for msId in sorted(mirrorSiteDict.keys()):
+            _visit(msId)
+
+    def _checkReloadable(self, addMsList, removeMsList, laterMsList):
+        # checked against the storage and advertiser classes, before anything is changed
+        # objects which are not loaded yet are created with all the added mirror sites, so add_mirror_site() is only needed for
+        # mirror sites added to loaded objects, and for mirror sites added after their old definitions are removed
+        checkList = []                                          # list<(mirror-site,method-name)>
+        checkList += [(x, "remove_mirror_site") for x in removeMsList]
+        checkList += [(x, "add_mirror_site") for x in laterMsList]
+        for ms in addMsList:
+            if any([x in self.param.storageDict for x in ms.storageDict]) or any([x in self.param.advertiserDict for x in ms.advertiserDict]):
+                checkList.append((ms, "add_mirror_site"))
+
+        for ms, methodName in checkList:
+            for st in ms.storageDict:
+                if methodName == "add_mirror_site" and st not in self.param.storageDict and ms in addMsList:
+                    continue
+                if not hasattr(getattr(__import__("storage.%s" % (st)), st).Storage, methodName):
+                    raise Exception("mirror site %s: storage %s does not support reloading, restart is needed" % (ms.id, st))
+            for name in ms.advertiserDict:
+                if methodName == "add_mirror_site" and name not in self.param.advertiserDict and ms in addMsList:
+                    continue
+                if not hasattr(getattr(__import__("advertiser.%s" % (name)), name).Advertiser, methodName):
+                    raise Exception("mirror site %s: advertiser %s does not support reloading, restart is needed" % (ms.id, name))
+
+    def _reloadMirrorSite(self, mirrorSiteId):
+        # called after the old definition is removed from updater
+        if self.reloadThread is not None:
+            self.deferredReloadList.append(mirrorSiteId)        # state is not changed during reloading
+            return
+        newMs = self.pendingReloadDict.pop(mirrorSiteId)
+        self._removeMirrorSite(mirrorSiteId)
+        if newMs is not None:
+            try:
+                self._addMirrorSites([newMs], dict(), dict())
+                logging.info("Mirror site \"%s\" reloaded." % (mirrorSiteId))
+            except Exception:
+                logging.error("Mirror site \"%s\" removed, adding its new definition failed." % (mirrorSiteId), exc_info=True)
         else:
-            raise Exception("metadata.xml content for plugin %s is invalid" % (name))
-
-    def _loadOneStorageObject(self, name, mirrorSiteIdList):
+            logging.info("Mirror site \"%s\" removed." % (mirrorSiteId))
+        self._disposeUnusedObjects()
+
+    def _addMirrorSites(self, msList, newStorageDict, newAdvertiserDict):
+        # new objects have been created with the mirror sites, loaded objects get them by add_mirror_site()
+        # everything is rolled back if anything fails, new objects are not disposed
+        doneList = []                                           # list<(object,mirror-id)>
+        try:
+            for ms in msList:
+                self.param.mirrorSiteDict[ms.id] = ms
+            for ms in msList:
+                for st in ms.storageDict:
+                    if st not in newStorageDict:
+                        obj = self.param.storageDict[st]
+                        obj.add_mirror_site(ms.id, self._getStorageParamForMirrorSite(st, ms))
+                        doneList.append((obj, ms.id))
+            self.param.storageDict.update(newStorageDict)
+            for ms in msList:
+                for name in ms.advertiserDict:
+                    if name not in newAdvertiserDict:
+                        obj = self.param.advertiserDict[name]
+                        depList = obj.get_properties().get("storage-dependencies", [])
+                        obj.add_mirror_site(ms.id, self._getAdvertiserParamForMirrorSite(name, depList, ms, self.param.storageDict))
+                        doneList.append((obj, ms.id))
+            self.param.advertiserDict.update(newAdvertiserDict)
+        except Exception:
+            for obj, msId in reversed(doneList):
+                try:
+                    obj.remove_mirror_site(msId)
+                except Exception:
+                    logging.error("Failed to roll back mirror site \"%s\"." % (msId), exc_info=True)
+            for name, obj in newAdvertiserDict.items():
+                if self.param.advertiserDict.get(name) is obj:
+                    del self.param.advertiserDict[name]
+            for st, obj in newStorageDict.items():
+                if self.param.storageDict.get(st) is obj:
+                    del self.param.storageDict[st]
+            for ms in msList:
+                del self.param.mirrorSiteDict[ms.id]
+            raise
+
+        for ms in msList:
+            self.param.diskUsageCollector.addMirrorSite(ms)
+            self.param.updater.addMirrorSite(ms)
+
+    def _removeMirrorSite(self, mirrorSiteId):
+        # mirror site has been removed from updater
+        mirrorSite = self.param.mirrorSiteDict[mirrorSiteId]
+        self.param.diskUsageCollector.removeMirrorSite(mirrorSiteId)
+        for name in mirrorSite.advertiserDict:
+            self.param.advertiserDict[name].remove_mirror_site(mirrorSiteId)
+        for st in mirrorSite.storageDict:
+            self.param.storageDict[st].remove_mirror_site(mirrorSiteId)
+        del self.param.mirrorSiteDict[mirrorSiteId]
+
+    def _disposeUnusedObjects(self):
+        # objects needed by the mirror sites waiting to be re-added are kept
+        msList = list(self.param.mirrorSiteDict.values()) + [x for x in self.pendingReloadDict.values() if x is not None]
+        unusedAdvertiserDict = dict()
+        unusedStorageDict = dict()
+        nameSet = set([x for ms in msList for x in ms.advertiserDict])
+        for name in sorted(set(self.param.advertiserDict.keys()) - nameSet):
+            unusedAdvertiserDict[name] = self.param.advertiserDict.pop(name)
+        stSet = set([x for ms in msList for x in ms.storageDict])
+        for st in sorted(set(self.param.storageDict.keys()) - stSet):
+            unusedStorageDict[st] = self.param.storageDict.pop(st)
+        self._disposeObjects(unusedStorageDict, unusedAdvertiserDict)
+
+    def _disposeObjects(self, storageDict, advertiserDict):
+        # advertisers first, they use storages
+        for name, obj in sorted(advertiserDict.items()):
+            obj.dispose()
+            logging.info("Advertiser \"%s\" disposed." % (name))
+        for st, obj in sorted(storageDict.items()):
+            obj.dispose()
+            logging.info("Storage \"%s\" disposed." % (st))
+
+    def _loadOneStorageObject(self, name, msList):
         mod = __import__("storage.%s" % (name))
         mod = getattr(mod, name)
 
@@ -124,13 +436,10 @@ class McPluginManager:
         if mod.Storage.get_properties().get("with-integrated-advertiser", False):
             param.update({
                 "listen-ip": self.param.listenIp,
+                "port-allocator": self.param.portAllocator.getNamespace("storage-%s" % (name)),
             })
-        for msId in mirrorSiteIdList:
-            param["mirror-sites"][msId] = {
-                "config-xml": self.param.mirrorSiteDict[msId].storageDict[name][0],
-                "state-directory": self.param.mirrorSiteDict[msId].pluginStateDir,
-                "data-directory": self.param.mirrorSiteDict[msId].getDataDirForStorage(name),
-            }
+        for ms in msList:
+            param["mirror-sites"][ms.id] = self._getStorageParamForMirrorSite(name, ms)
 
         # prepare directories
         McUtil.ensureDir(param["temp-directory"])
@@ -139,26 +448,21 @@ class McPluginManager:
         # create object
         return mod.Storage(param)
 
-    def _loadOneAdvertiserObject(self, name, mirrorSiteIdList):
+    def _loadOneAdvertiserObject(self, name, msList, storageDict):
         mod = __import__("advertiser.%s" % (name))
         mod = getattr(mod, name)
 
         # prepare advertiser initialization parameter
         param = {
             "listen-ip": self.param.listenIp,
+            "port-allocator": self.param.portAllocator.getNamespace("advertiser-%s" % (name)),
             "temp-directory": os.path.join(McConst.tmpDir, "advertiser-%s" % (name)),
             "log-directory": os.path.join(McConst.logDir, "advertiser-%s" % (name)),
+            "config": self.param.mainCfg["advertiserConfig"].get(name, dict()),
             "mirror-sites": dict(),
         }
-        for msId in mirrorSiteIdList:
-            param["mirror-sites"][msId] = {
-                "config-xml": self.param.mirrorSiteDict[msId].advertiserDict[name][0],
-                "state-directory": self.param.mirrorSiteDict[msId].pluginStateDir,
-                "storage-param": dict()
-            }
-            for st in self.param.mirrorSiteDict[msId].storageDict:
-                if st in mod.Advertiser.get_properties().get("storage-dependencies", []):
-                    param["mirror-sites"][msId]["storage-param"][st] = self.param.storageDict[st].get_param(msId)
+        for ms in msList:
+            param["mirror-sites"][ms.id] = self._getAdvertiserParamForMirrorSite(name, mod.Advertiser.get_properties().get("storage-dependencies", []), ms, storageDict)
 
         # prepare directories
         McUtil.ensureDir(param["temp-directory"])
@@ -167,14 +471,38 @@ class McPluginManager:
         # create object
         return mod.Advertiser(param)
 
+    def _getStorageParamForMirrorSite(self, name, mirrorSite):
+        return {
+            "config-xml": mirrorSite.storageDict[name][0],
+            "state-directory": mirrorSite.pluginStateDir,
+            "data-directory": mirrorSite.getDataDirForStorage(name),
+        }
+
+    def _getAdvertiserParamForMirrorSite(self, name, storageDependencyList, mirrorSite, storageDict):
+        ret = {
+            "config-xml": mirrorSite.advertiserDict[name][0],
+            "state-directory": mirrorSite.pluginStateDir,
+            "cache-directory": mirrorSite.getCacheDirForAdvertiser(name),
+            "storage-param": dict()
+        }
+        for st in mirrorSite.storageDict:
+            if st in storageDependencyList:
+                ret["storage-param"][st] = storageDict[st].get_param(mirrorSite.id)
+        return ret
+
 
 class McMirrorSite:
 
-    def __init__(self, param, pluginDir, rootElem, cfgDict):
+    def __init__(self, param, pluginDir, definition, cfgDict):
+        # definition is returned by McMirrorSite.parseMetadata()
         self.param = param
-        self.id = rootElem.get("id")
+        self.id = definition["id"]
+        self.pluginName = os.path.basename(pluginDir)
         self.cfgDict = cfgDict
 
+        # for finding out changed mirror sites when reloading
+        self.fingerprint = (pluginDir, definition["xml"], json.dumps(cfgDict, sort_keys=True))
+
         # persist mode
         self.bPersist = cfgDict.get("persist", False)
 
@@ -183,9 +511,8 @@ class McMirrorSite:
             self.masterDir = os.path.join(McConst.varDir, self.id)
         else:
             self.masterDir = os.path.join(McConst.cacheDir, self.id)
-        McUtil.ensureDir(self.masterDir)
 
-        # state directory (plugin can use it)
+        # state directory (plugin can use it), master directory is created with it
         self.pluginStateDir = os.path.join(self.masterDir, "state")
         McUtil.ensureDir(self.pluginStateDir)
 
@@ -196,79 +523,181 @@ class McMirrorSite:
 
         # storage
         self.storageDict = dict()                       # {name:(config-xml,data-directory)}
-        for child in rootElem.xpath("./storage"):
-            st = child.get("type")
+        for st, xmlStr in definition["storage"]:
             if st not in self.param.pluginManager.getStorageNameList():
                 raise Exception("mirror site %s: invalid storage type %s" % (self.id, st))
             # record outer xml
-            self.storageDict[st] = (lxml.etree.tostring(child, encoding="unicode"), self.getDataDirForStorage(st))
+            self.storageDict[st] = (xmlStr, self.getDataDirForStorage(st))
             # create data directory
             McUtil.ensureDir(self.getDataDirForStorage(st))
 
         # advertiser
         self.advertiserDict = dict()                 # {name:(config-xml)}
-        for child in rootElem.xpath("./advertiser"):
-            st = child.get("type")
+        for st, xmlStr in definition["advertiser"]:
             if st not in self.param.pluginManager.getAdvertiserNameList():
                 raise Exception("mirror site %s: invalid advertiser type %s" % (self.id, st))
             # record outer xml
-            self.advertiserDict[st] = (lxml.etree.tostring(child, encoding="unicode"))
+            self.advertiserDict[st] = (xmlStr)
 
         # initializer
         self.initializerExe = None
-        if True:
-            slist = rootElem.xpath("./initializer")
-            if len(slist) > 0:
-                self.initializerExe = slist[0].xpath("./executable")[0].text
-                self.initializerExe = os.path.join(pluginDir, self.initializerExe)
+        if definition["initializer"] is not None:
+            self.initializerExe = os.path.join(pluginDir, definition["initializer"])
 
         # updater
         self.updaterExe = None
         self.schedType = None              # "interval" or "cronexpr"
         self.schedInterval = None          # timedelta
         self.schedCronExpr = None          # string
+        self.schedJitter = None            # seconds, None means using the global value
         self.updateRetryType = None        # "interval" or "cronexpr"
         self.updateRetryInterval = None    # timedelta
         self.updateRetryCronExpr = None    # string
-        if True:
-            slist = rootElem.xpath("./updater")
-            if len(slist) > 0:
-                self.updaterExe = slist[0].xpath("./executable")[0].text
-                self.updaterExe = os.path.join(pluginDir, self.updaterExe)
-
-                tag = slist[0].xpath("./schedule")[0]
-                self.schedType = tag.get("type")
-                if self.schedType == "interval":
-                    self.schedInterval = self._parseInterval(tag.text)
-                elif self.schedType == "cronexpr":
-                    self.schedCronExpr = self._parseCronExpr(tag.text)
-                else:
-                    raise Exception("mirror site %s: invalid schedule type %s" % (self.id, self.schedType))
-
-                if len(slist[0].xpath("./retry-after-failure")) > 0:
-                    tag = slist[0].xpath("./retry-after-failure")[0]
-                    self.updateRetryType = tag.get("type")
-                    if self.updateRetryType == "interval":
-                        self.updateRetryInterval = self._parseInterval(tag.text)
-                    elif self.updateRetryType == "cronexpr":
-                        if self.schedType == "interval":
-                            raise Exception("mirror site %s: invalid retry-after-update type %s" % (self.id, self.updateRetryType))
-                        self.updateRetryCronExpr = self._parseCronExpr(tag.text)
-                    else:
-                        raise Exception("mirror site %s: invalid retry-after-update type %s" % (self.id, self.updateRetryType))
+        if definition["updater"] is not None:
+            self.updaterExe = os.path.join(pluginDir, definition["updater"]["executable"])
+
+            self.schedType = definition["updater"]["schedule-type"]
+            if self.schedType == "interval":
+                self.schedInterval = self._parseInterval(definition["updater"]["schedule"])
+            elif self.schedType == "cronexpr":
+                self.schedCronExpr = definition["updater"]["schedule"]
+            else:
+                assert False
+
+            if "schedule-jitter" in cfgDict:
+                if not isinstance(cfgDict["schedule-jitter"], int) or cfgDict["schedule-jitter"] < 0:
+                    raise Exception("mirror site %s: invalid schedule-jitter" % (self.id))
+                self.schedJitter = cfgDict["schedule-jitter"]
+
+            self.updateRetryType = definition["updater"]["retry-type"]
+            if self.updateRetryType is None:
+                pass
+            elif self.updateRetryType == "interval":
+                self.updateRetryInterval = self._parseInterval(definition["updater"]["retry"])
+            elif self.updateRetryType == "cronexpr":
+                self.updateRetryCronExpr = definition["updater"]["retry"]
+            else:
+                assert False
+
+        # mirror sites whose content this mirror site is derived from
+        # it is updated after any of them is updated successfully, and is not updated while any of them is not ready
+        self.dependsOnList = list(definition["depends-on"])
 
         # maintainer
         self.maintainerExe = None
-        if True:
-            slist = rootElem.xpath("./maintainer")
-            if len(slist) > 0:
-                self.maintainerExe = slist[0].xpath(".//executable")[0].text
-                self.maintainerExe = os.path.join(pluginDir, self.maintainerExe)
+        if definition["maintainer"] is not None:
+            self.maintainerExe = os.path.join(pluginDir, definition["maintainer"])
+
+        # seconds between SIGTERM and SIGKILL when stopping initializer, updater and maintainer
+        self.stopTimeout = 30
+        if "stop-timeout" in cfgDict:
+            if not isinstance(cfgDict["stop-timeout"], int) or cfgDict["stop-timeout"] <= 0:
+                raise Exception("mirror site %s: invalid stop-timeout" % (self.id))
+            self.stopTimeout = cfgDict["stop-timeout"]
+
+        # resource limits for initializer, updater and maintainer, plugin config overrides plugin metadata
+        self.resourceLimitDict = dict(definition["resource-limits"])
+        if "resource-limits" in cfgDict:
+            self.resourceLimitDict.update(McCgroupManager.parseLimitDict(cfgDict["resource-limits"], "mirror site %s" % (self.id)))
+
+    @staticmethod
+    def parseMetadata(rootElem):
+        # returns the definition of a mirror site parsed from its <mirror-site> element
+        # everything that only depends on metadata.xml is checked here, the returned value can be serialized to json
+        msId = rootElem.get("id")
+        ret = {
+            "id": msId,
+            "xml": lxml.etree.tostring(rootElem, encoding="unicode"),
+            "storage": [],                  # list<(type,outer-xml)>
+            "advertiser": [],               # list<(type,outer-xml)>
+            "initializer": None,            # executable
+            "updater": None,                # {"executable":..., "schedule-type":..., "schedule":..., "retry-type":..., "retry":...}
+            "depends-on": [],
+            "maintainer": None,             # executable
+            "resource-limits": dict(),
+        }
+
+        # storage
+        for child in rootElem.xpath("./storage"):
+            ret["storage"].append((child.get("type"), lxml.etree.tostring(child, encoding="unicode")))
+
+        # advertiser
+        for child in rootElem.xpath("./advertiser"):
+            ret["advertiser"].append((child.get("type"), lxml.etree.tostring(child, encoding="unicode")))
+
+        # initializer
+        slist = rootElem.xpath("./initializer")
+        if len(slist) > 0:
+            ret["initializer"] = slist[0].xpath("./executable")[0].text
+
+        # updater
+        slist = rootElem.xpath("./updater")
+        if len(slist) > 0:
+            ret["updater"] = {
+                "executable": slist[0].xpath("./executable")[0].text,
+                "schedule-type": None,
+                "schedule": None,
+                "retry-type": None,
+                "retry": None,
+            }
+
+            tag = slist[0].xpath("./schedule")[0]
+            ret["updater"]["schedule-type"] = tag.get("type")
+            ret["updater"]["schedule"] = tag.text
+            if tag.get("type") == "interval":
+                McMirrorSite._parseInterval(tag.text)
+            elif tag.get("type") == "cronexpr":
+                McMirrorSite._checkCronExpr(msId, tag.text)
+            else:
+                raise Exception("mirror site %s: invalid schedule type %s" % (msId, tag.get("type")))
+
+            if len(slist[0].xpath("./retry-after-failure")) > 0:
+                tag = slist[0].xpath("./retry-after-failure")[0]
+                ret["updater"]["retry-type"] = tag.get("type")
+                ret["updater"]["retry"] = tag.text
+                if tag.get("type") == "interval":
+                    McMirrorSite._parseInterval(tag.text)
+                elif tag.get("type") == "cronexpr":
+                    if ret["updater"]["schedule-type"] == "interval":
+                        raise Exception("mirror site %s: invalid retry-after-update type %s" % (msId, tag.get("type")))
+                    McMirrorSite._checkCronExpr(msId, tag.text)
+                else:
+                    raise Exception("mirror site %s: invalid retry-after-update type %s" % (msId, tag.get("type")))
+
+        # depends-on
+        for child in rootElem.xpath("./depends-on"):
+            if child.text is None or child.text.strip() == "":
+                raise Exception("mirror site %s: invalid depends-on" % (msId))
+            if child.text.strip() not in ret["depends-on"]:
+                ret["depends-on"].append(child.text.strip())
+
+        # maintainer
+        slist = rootElem.xpath("./maintainer")
+        if len(slist) > 0:
+            ret["maintainer"] = slist[0].xpath(".//executable")[0].text
+
+        # resource limits
+        slist = rootElem.xpath("./resource-limits")
+        if len(slist) > 0:
+            tmpDict = dict()
+            for child in slist[0]:
+                if child.tag == "io-max":
+                    tmpDict.setdefault(child.tag, []).append(child.text)
+                else:
+                    tmpDict[child.tag] = child.text
+            ret["resource-limits"] = McCgroupManager.parseLimitDict(tmpDict, "mirror site %s" % (msId))
+
+        return ret
 
     def getDataDirForStorage(self, storageName):
         return os.path.join(self.masterDir, "storage-%s" % (storageName))
 
-    def _parseInterval(self, intervalStr):
+    def getCacheDirForAdvertiser(self, advertiserName):
+        # created by the advertiser if it needs one
+        return os.path.join(self.masterDir, "advertiser-%s" % (advertiserName))
+
+    @staticmethod
+    def _parseInterval(intervalStr):
         m = re.match("([0-9]+)(h|d|w|m)", intervalStr)
         if m is None:
             raise Exception("invalid interval %s" % (intervalStr))
@@ -284,6 +713,54 @@ class McMirrorSite:
         else:
             assert False
 
-    def _parseCronExpr(self, cronExprStr):
-        # FIXME: should add checking
-        return cronExprStr
+    @staticmethod
+    def _checkCronExpr(mirrorSiteId, cronExprStr):
+        try:
+            CronExpr(cronExprStr)
+        except ValueError as e:
+            raise Exception("mirror site %s: %s" % (mirrorSiteId, e))
+
+
+class _MetadataCache:
+
+    """
+    Mirror site definitions parsed from metadata.xml, keyed by (mtime, size) of the
+    file. Only the entries used by the last loading are saved.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.oldDict = dict()                   # dict<metadata-file,[cache-key,list<definition>]>
+        self.newDict = dict()                   # same as above
+        try:
+            with open(self.filename, "r") as f:
+                dataObj = json.load(f)
+            if dataObj.get("version") == self.VERSION:
+                self.oldDict = dataObj["plugins"]
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logging.warning("Plugin metadata cache \"%s\" is invalid, ignored." % (self.filename))
+
+    def get(self, metadataFile, key):
+        # returns None if not cached or changed
+        item = self.oldDict.get(metadataFile)
+        if item is None or item[0] != key:
+            return None
+        return item[1]
+
+    def put(self, metadataFile, key, definitionList):
+        self.newDict[metadataFile] = [key, definitionList]
+
+    def save(self):
+        if self.newDict == self.oldDict:
+            return
+        try:
+            tmpFile = self.filename + ".tmp"
+            with open(tmpFile, "w") as f:
+                json.dump({"version": self.VERSION, "plugins": self.newDict}, f)
+            os.rename(tmpFile, self.filename)
+        except OSError as e:
+            logging.warning("Failed to save plugin metadata cache \"%s\" (%s)." % (self.filename, e))
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import json
+import socket
+import logging
+import threading
+import atomicwrites
+
+
+class McPortAllocator:
+
+    """
+    Allocates the listening ports of storages and advertisers. The port of each name is recorded
+    in a port map file, so that the same port is used after the daemon restarts.
+    A new port is picked by the kernel (bind to port 0), no scanning is needed.
+
+    Servers which accept an inherited listening socket get a socket bound and listened by us,
+    connections are queued by the kernel before the server is ready, and no one else can take
+    the port. Other servers bind by themselves, their port is reserved by a bound socket until
+    they are about to be started.
+    """
+
+    def __init__(self, listenIp, filename):
+        self.listenIp = listenIp
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.portDict = dict()                  # dict<name,port>
+        self.reserveDict = dict()               # dict<name,socket>
+
+        try:
+            if os.path.exists(self.filename):
+                with open(self.filename) as f:
+                    self.portDict = {k: int(v) for k, v in json.load(f).items()}
+        except Exception as e:
+            self.portDict = dict()
+            logging.warning("Port map file \"%s\" is invalid, all ports are re-allocated (%s)." % (self.filename, e))
+
+    def dispose(self):
+        with self.lock:
+            for sock in self.reserveDict.values():
+                sock.close()
+            self.reserveDict = dict()
+
+    def getNamespace(self, prefix):
+        return _PortNamespace(self, prefix)
+
+    def getListenSocket(self, name):
+        # the returned socket is owned by the caller, it should be closed after being passed to the server
+        with self.lock:
+            sock = self._bind(name)
+            try:
+                sock.listen(socket.SOMAXCONN)
+            except Exception:
+                sock.close()
+                raise
+            return sock
+
+    def getListenSocketList(self, name, count):
+        # all the sockets listen on the same port with SO_REUSEPORT, the kernel distributes connections among them
+        with self.lock:
+            ret = [self._bind(name, True)]
+            try:
+                port = ret[0].getsockname()[1]
+                while len(ret) < count:
+                    ret.append(self._createSocket(port, True))
+                for sock in ret:
+                    sock.listen(socket.SOMAXCONN)
+            except Exception:
+                for sock in ret:
+                    sock.close()
+                raise
+            return ret
+
+    def reservePort(self, name):
+        # unreserve() should be called right before the server is started
+        with self.lock:
+            if name not in self.reserveDict:
+                self.reserveDict[name] = self._bind(name)
+            return self.reserveDict[name].getsockname()[1]
+
+    def unreserve(self, name):
+        with self.lock:
+            sock = self.reserveDict.pop(name, None)
+            if sock is not None:
+                sock.close()
+
+    def _bind(self, name, bReusePort=False):
+        port = self.portDict.get(name)
+        if port is not None:
+            try:
+                return self._createSocket(port, bReusePort)
+            except OSError:
+                logging.warning("Port %d of \"%s\" is in use, a new port is allocated." % (port, name))
+
+        # don't take a port recorded for another name, its owner may not have been started yet
+        usedSet = set(self.portDict.values())
+        for i in range(0, 100):
+            sock = self._createSocket(0, bReusePort)
+            port = sock.getsockname()[1]
+            if port not in usedSet:
+                break
+            sock.close()
+        else:
+            raise Exception("no valid port")
+
+        self.portDict[name] = port
+        self._save()
+        return sock
+
+    def _createSocket(self, port, bReusePort=False):
+        sock = socket.socket(socket.AF_INET6 if ":" in self.listenIp else socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)         # connections of the previous run may be in TIME_WAIT
+            if bReusePort:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((self.listenIp, port))
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def _save(self):
+        try:
+            with atomicwrites.atomic_write(self.filename, overwrite=True) as f:
+                json.dump(self.portDict, f, indent=4, sort_keys=True)
+        except OSError as e:
+            logging.warning("Failed to save port map file \"%s\" (%s)." % (self.filename, e))
+
+
+class _PortNamespace:
+
+    """
+    The port allocator seen by a storage or advertiser, names are prefixed by the object's name.
+    Objects which need only one port can use the default name.
+    """
+
+    def __init__(self, parent, prefix):
+        self._parent = parent
+        self._prefix = prefix
+
+    def get_listen_socket(self, name=""):
+        return self._parent.getListenSocket(self._fullName(name))
+
+    def get_listen_sockets(self, count, name=""):
+        return self._parent.getListenSocketList(self._fullName(name), count)
+
+    def reserve_port(self, name=""):
+        return self._parent.reservePort(self._fullName(name))
+
+    def unreserve_port(self, name=""):
+        self._parent.unreserve(self._fullName(name))
+
+    def _fullName(self, name):
+        return self._prefix if name == "" else "%s/%s" % (self._prefix, name)
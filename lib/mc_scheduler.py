@@ -0,0 +1,491 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import math
+import heapq
+import bisect
+import hashlib
+from datetime import time
+from datetime import datetime
+from datetime import timedelta
+
+
+class McScheduler:
+
+    """
+    Job scheduling engine, it knows nothing about the main loop.
+    Subclass must implement _addTimer() and _removeTimer(), and may override
+    _now() to run the engine with a virtual clock.
+
+    Jobs are kept in a binary heap ordered by next schedule time. The heap uses
+    lazy deletion: changing the next schedule time of a job pushes a new heap
+    item and makes the old one stale, stale items are dropped when they reach
+    the top of the heap. So adding, pausing and triggering a job cost O(log n),
+    and each wakeup only touches the jobs that are due.
+
+    Each job gets a deterministic offset derived from the hash of its job id,
+    the offset is in [0, min(jitter, schedule-period)). Interval jobs use the
+    offset for their first schedule, cron jobs use it for every schedule, so
+    jobs sharing the same cron expression don't fire at the same time. Jobs
+    which have never run, interval or cron, are scheduled immediately, delayed
+    by their offset only.
+
+    Catch-up policy decides what to do with the schedules missed while the
+    daemon was down, the number of missed schedules is recorded for each job:
+      "skip":     wait for the next regular schedule
+      "coalesce": run once as soon as possible, delayed by the job offset
+      "spread":   run once, the catch-up runs are spread over a whole schedule period
+
+    Interval jobs and cron jobs whose next schedule time falls outside of the
+    prefered update periods are deferred to the start of the next prefered
+    update period, as long as the deferral is not longer than the job's own
+    schedule period, so that a mirror site never becomes twice as stale.
+    """
+
+    CATCH_UP_SKIP = "skip"
+    CATCH_UP_COALESCE = "coalesce"
+    CATCH_UP_SPREAD = "spread"
+
+    def __init__(self, preferedUpdatePeriodList, jitter=0, catchUpPolicy=CATCH_UP_COALESCE):
+        self.jobDict = dict()                   # dict<id,(type,param,callback)>
+        self.jobInfoDict = dict()               # dict<id,[lastSchedDatetime,nextSchedDatetime]>
+        self.jobSeqDict = dict()                # dict<id,seq>
+        self.jobMissedCountDict = dict()        # dict<id,count>
+        self.jobDurationFuncDict = dict()       # dict<id,func>
+        self.jobHeap = []                       # list<(nextSchedDatetime,seq,id)>, items not matching jobSeqDict are stale
+        self.seq = 0
+        self.nextDatetime = datetime.max        # fire time of the current timer
+        self.timer = None
+
+        self.periodList = []                    # list<(CronExpr,duration)>
+        for item in preferedUpdatePeriodList:
+            self.periodList.append((CronExpr(item["start"]), timedelta(hours=item["time"])))
+
+        assert catchUpPolicy in [self.CATCH_UP_SKIP, self.CATCH_UP_COALESCE, self.CATCH_UP_SPREAD]
+        self.jitter = timedelta(seconds=jitter)
+        self.catchUpPolicy = catchUpPolicy
+
+    def dispose(self):
+        if self.timer is not None:
+            self._removeTimer(self.timer)
+            self.timer = None
+        self.nextDatetime = datetime.max
+        self.jobHeap = []
+        self.jobMissedCountDict = dict()
+        self.jobDurationFuncDict = dict()
+        self.jobSeqDict = dict()
+        self.jobInfoDict = dict()
+        self.jobDict = dict()
+
+    def addCronJob(self, jobId, lastSchedDatetime, cronExpr, jobCallback, jitter=None, durationFunc=None):
+        # jitter is in seconds, None means using the global value
+        # durationFunc returns the predicted job duration as timedelta, or None if unknown
+        assert jobId not in self.jobDict
+        now = self._now()
+
+        # the job offset is re-applied to every schedule
+        cronObj = CronExpr(cronExpr)
+        period = self.__cronGetPeriod(cronObj, now)
+        offset = self.__getJobOffset(jobId, period, jitter)
+        self.jobDict[jobId] = ("cron", (cronObj, offset), jobCallback)
+        self.jobInfoDict[jobId] = [lastSchedDatetime, None]
+        self.jobMissedCountDict[jobId] = 0
+        self.jobDurationFuncDict[jobId] = durationFunc
+
+        if lastSchedDatetime is None:
+            # never run, no need to wait for the first cron schedule
+            nextDatetime = now + offset
+        else:
+            nextDatetime = self.__cronGetNextDatetime(jobId, now)
+            count = cronObj.countBetween(lastSchedDatetime - offset, now - offset)
+            if count > 0:
+                # some schedules are missed
+                self.jobMissedCountDict[jobId] = count
+                if self.catchUpPolicy != self.CATCH_UP_SKIP:
+                    nextDatetime = min(self.__getCatchUpDatetime(jobId, now, offset, period), nextDatetime)
+
+        self._setJobNextSchedDatetime(jobId, nextDatetime)
+        self._updateTimer()
+
+    def addIntervalJob(self, jobId, lastSchedDatetime, interval, jobCallback, jitter=None, durationFunc=None):
+        # jitter is in seconds, None means using the global value
+        # durationFunc returns the predicted job duration as timedelta, or None if unknown
+        assert jobId not in self.jobDict
+        now = self._now()
+
+        # the job offset is only applied to the first schedule, the later schedules keep the spacing
+        offset = self.__getJobOffset(jobId, interval, jitter)
+        self.jobDict[jobId] = ("interval", interval, jobCallback)
+        self.jobInfoDict[jobId] = [lastSchedDatetime, None]
+        self.jobMissedCountDict[jobId] = 0
+        self.jobDurationFuncDict[jobId] = durationFunc
+
+        if lastSchedDatetime is None:
+            nextDatetime = now + offset
+        elif lastSchedDatetime + interval > now:
+            nextDatetime = self.__intervalGetNextDatetime(jobId, now, lastSchedDatetime)
+        else:
+            # some schedules are missed
+            count = (now - lastSchedDatetime) // interval
+            self.jobMissedCountDict[jobId] = count
+            if self.catchUpPolicy == self.CATCH_UP_SKIP:
+                nextDatetime = self.__intervalGetNextDatetime(jobId, now, lastSchedDatetime + interval * count)
+            else:
+                nextDatetime = self.__deferToPreferedPeriod(jobId, self.__getCatchUpDatetime(jobId, now, offset, interval), interval)
+
+        self._setJobNextSchedDatetime(jobId, nextDatetime)
+        self._updateTimer()
+
+    def pauseJobUntil(self, jobId, untilDatetime):
+        assert jobId in self.jobDict
+        if untilDatetime > self.jobInfoDict[jobId][1]:
+            self._setJobNextSchedDatetime(jobId, untilDatetime)
+            self._updateTimer()
+
+    def triggerJobAt(self, jobId, triggerDatetime):
+        assert jobId in self.jobDict
+        if triggerDatetime < self.jobInfoDict[jobId][1]:
+            self._setJobNextSchedDatetime(jobId, triggerDatetime)
+            self._updateTimer()
+            return True
+        else:
+            return False
+
+    def triggerJobNow(self, jobId):
+        assert jobId in self.jobDict
+        self._execJob(jobId, self._now())
+        self._updateTimer()
+
+    def removeJob(self, jobId):
+        assert jobId in self.jobDict
+        del self.jobDurationFuncDict[jobId]
+        del self.jobMissedCountDict[jobId]
+        del self.jobSeqDict[jobId]              # heap items of this job become stale
+        del self.jobInfoDict[jobId]
+        del self.jobDict[jobId]
+        self._updateTimer()
+
+    def getJobLastSchedDatetime(self, jobId):
+        assert jobId in self.jobDict
+        return self.jobInfoDict[jobId][0]
+
+    def getJobNextSchedDatetime(self, jobId):
+        assert jobId in self.jobDict
+        return self.jobInfoDict[jobId][1]
+
+    def getJobMissedCount(self, jobId):
+        assert jobId in self.jobDict
+        return self.jobMissedCountDict[jobId]
+
+    def _now(self):
+        return datetime.now()
+
+    def _addTimer(self, seconds, func):
+        # returns timer object, func returns False
+        raise NotImplementedError()
+
+    def _removeTimer(self, timer):
+        raise NotImplementedError()
+
+    def _jobCallback(self):
+        self.timer = None
+        self.nextDatetime = datetime.max
+        now = self._now()
+
+        # pop all the due jobs, jobs sharing the same fire time are executed in one batch
+        batch = []
+        while len(self.jobHeap) > 0 and self.jobHeap[0][0] <= now:
+            item = heapq.heappop(self.jobHeap)
+            if self.jobSeqDict.get(item[2]) == item[1]:
+                batch.append(item)
+
+        # execute jobs
+        for schedDatetime, seq, jobId in batch:
+            if self.jobSeqDict.get(jobId) != seq:
+                continue                        # job is changed by the previous job's callback
+            self._execJob(jobId, schedDatetime)
+
+        # recalculate timeout
+        self._updateTimer()
+
+        return False
+
+    def _execJob(self, jobId, curDatetime):
+        # execute job
+        self.jobDict[jobId][2](curDatetime)
+        if jobId not in self.jobDict:
+            return                              # job is removed by its callback
+
+        # record last sched time
+        self.jobInfoDict[jobId][0] = curDatetime
+
+        # calculate next sched time
+        # schedules between curDatetime and now are missed if we are woken up too late
+        now = max(self._now(), curDatetime)
+        if self.jobDict[jobId][0] == "cron":
+            cronObj, offset = self.jobDict[jobId][1]
+            self.jobMissedCountDict[jobId] += cronObj.countBetween(curDatetime - offset, now - offset)
+            self._setJobNextSchedDatetime(jobId, self.__cronGetNextDatetime(jobId, now))
+        elif self.jobDict[jobId][0] == "interval":
+            interval = self.jobDict[jobId][1]
+            self.jobMissedCountDict[jobId] += (now - curDatetime) // interval
+            self._setJobNextSchedDatetime(jobId, self.__intervalGetNextDatetime(jobId, now, curDatetime))
+        else:
+            assert False
+
+    def _setJobNextSchedDatetime(self, jobId, nextDatetime):
+        self.seq += 1
+        self.jobSeqDict[jobId] = self.seq
+        self.jobInfoDict[jobId][1] = nextDatetime
+        heapq.heappush(self.jobHeap, (nextDatetime, self.seq, jobId))
+
+        # rebuild the heap when there are too many stale items
+        if len(self.jobHeap) > len(self.jobSeqDict) * 2 + 64:
+            self.jobHeap = [(self.jobInfoDict[x][1], self.jobSeqDict[x], x) for x in self.jobSeqDict]
+            heapq.heapify(self.jobHeap)
+
+    def _updateTimer(self):
+        # drop stale items on heap top
+        while len(self.jobHeap) > 0 and self.jobSeqDict.get(self.jobHeap[0][2]) != self.jobHeap[0][1]:
+            heapq.heappop(self.jobHeap)
+
+        if len(self.jobHeap) > 0:
+            nextDatetime = self.jobHeap[0][0]
+        else:
+            nextDatetime = datetime.max
+        if nextDatetime == self.nextDatetime:
+            return
+
+        if self.timer is not None:
+            self._removeTimer(self.timer)
+            self.timer = None
+        self.nextDatetime = nextDatetime
+        if nextDatetime != datetime.max:
+            interval = math.ceil((nextDatetime - self._now()).total_seconds())
+            interval = max(interval, 1)
+            self.timer = self._addTimer(interval, self._jobCallback)
+
+    def __getJobOffset(self, jobId, period, jitter):
+        if jitter is None:
+            jitter = self.jitter
+        else:
+            jitter = timedelta(seconds=jitter)
+        return min(jitter, period) * self.__getJobHashFraction(jobId)
+
+    def __getJobHashFraction(self, jobId):
+        # returns a deterministic value in [0, 1)
+        h = hashlib.md5(str(jobId).encode("utf-8")).digest()
+        return int.from_bytes(h[:4], "big") / 2 ** 32
+
+    def __getCatchUpDatetime(self, jobId, curDatetime, offset, period):
+        if self.catchUpPolicy == self.CATCH_UP_COALESCE:
+            return curDatetime + offset
+        elif self.catchUpPolicy == self.CATCH_UP_SPREAD:
+            return curDatetime + period * self.__getJobHashFraction(jobId)
+        else:
+            assert False
+
+    def __cronGetPeriod(self, cronObj, curDatetime):
+        first = cronObj.getNext(curDatetime)
+        return cronObj.getNext(first) - first
+
+    def __cronGetNextDatetime(self, jobId, curDatetime):
+        cronObj, offset = self.jobDict[jobId][1]
+        ret = cronObj.getNext(curDatetime - offset)
+        return self.__deferToPreferedPeriod(jobId, ret + offset, self.__cronGetPeriod(cronObj, ret))
+
+    def __intervalGetNextDatetime(self, jobId, curDatetime, lastSchedTime):
+        interval = self.jobDict[jobId][1]
+        if lastSchedTime is None:
+            return curDatetime
+        else:
+            ret = max(lastSchedTime + interval, curDatetime)
+            return self.__deferToPreferedPeriod(jobId, ret, interval)
+
+    def __deferToPreferedPeriod(self, jobId, schedDatetime, maxDelay):
+        # prefered update period is [start, start + duration)
+        # a job is not started in a period which it can not finish in, if it fits in the next one
+        jobDuration = None
+        if self.jobDurationFuncDict[jobId] is not None and len(self.periodList) > 0:
+            jobDuration = self.jobDurationFuncDict[jobId]()
+
+        nextStart = None
+        for cronObj, duration in self.periodList:
+            start = cronObj.getNext(schedDatetime - duration)
+            if start <= schedDatetime:
+                if jobDuration is None or jobDuration > duration or schedDatetime + jobDuration <= start + duration:
+                    return schedDatetime
+                start = cronObj.getNext(start)
+            if nextStart is None or start < nextStart:
+                nextStart = start
+
+        if nextStart is None:
+            return schedDatetime                    # no prefered update period
+        if nextStart - schedDatetime > maxDelay:
+            return schedDatetime                    # deferring makes the mirror site too stale
+        return nextStart
+
+
+class CronExpr:
+
+    """
+    Compiled cron expression: "MINUTE HOUR DAY-OF-MONTH MONTH DAY-OF-WEEK".
+    Supports "*", "a-b", "*/n", "a-b/n", lists, month and week day names,
+    and the @yearly, @monthly, @weekly, @daily, @hourly aliases.
+    Like vixie cron, when both day-of-month and day-of-week are restricted,
+    a day matches if either of them matches.
+
+    getNext() jumps field by field to the first fire time after an arbitrary
+    instant, countBetween() counts the fire times in a range day by day, so
+    neither of them walks through the fire times one by one.
+    """
+
+    _aliasDict = {
+        "@yearly": "0 0 1 1 *",
+        "@annually": "0 0 1 1 *",
+        "@monthly": "0 0 1 * *",
+        "@weekly": "0 0 * * 0",
+        "@daily": "0 0 * * *",
+        "@midnight": "0 0 * * *",
+        "@hourly": "0 * * * *",
+    }
+
+    _monthNameList = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+    _weekdayNameList = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+    _maxSearchDays = 366 * 8            # enough for "0 0 29 2 *" on all kinds of leap year gaps
+
+    def __init__(self, exprStr):
+        self.exprStr = exprStr
+
+        fieldList = self._aliasDict.get(exprStr.strip().lower(), exprStr).split()
+        if len(fieldList) != 5:
+            raise ValueError("invalid cron expression \"%s\"" % (exprStr))
+
+        self.minuteList = sorted(self._parseField(fieldList[0], 0, 59, None))
+        self.hourList = sorted(self._parseField(fieldList[1], 0, 23, None))
+        self.hourSet = set(self.hourList)
+        self.domSet = self._parseField(fieldList[2], 1, 31, None)
+        self.monthSet = self._parseField(fieldList[3], 1, 12, self._monthNameList)
+        self.dowSet = set([x % 7 for x in self._parseField(fieldList[4], 0, 7, self._weekdayNameList)])     # 7 is also sunday
+        self.bDomStar = fieldList[2].startswith("*")
+        self.bDowStar = fieldList[4].startswith("*")
+
+        # check if it fires at all, for example "0 0 31 2 *" never fires
+        for month in self.monthSet:
+            if self.bDomStar or not self.bDowStar or min(self.domSet) <= [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month - 1]:
+                break
+        else:
+            raise ValueError("cron expression \"%s\" never fires" % (exprStr))
+
+    def getNext(self, curDatetime):
+        # returns the first fire time that is later than curDatetime
+        t = curDatetime.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = t.date()
+        tm = time(t.hour, t.minute)
+        for i in range(0, self._maxSearchDays):
+            if day.month not in self.monthSet:
+                # jump to the first day of next month
+                day = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+                tm = time(0, 0)
+                continue
+            if self._isDayMatched(day):
+                ret = self._getFirstTimeInDay(tm)
+                if ret is not None:
+                    return datetime.combine(day, ret)
+            day += timedelta(days=1)
+            tm = time(0, 0)
+        raise ValueError("cron expression \"%s\" never fires" % (self.exprStr))
+
+    def countBetween(self, startDatetime, endDatetime):
+        # returns the number of fire times in (startDatetime, endDatetime]
+        a = startDatetime.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        b = endDatetime.replace(second=0, microsecond=0)
+        if a > b:
+            return 0
+
+        aTime = time(a.hour, a.minute)
+        bTime = time(b.hour, b.minute)
+        if a.date() == b.date():
+            if self._isDayMatched(a.date()):
+                return self._countNotLaterThan(bTime) - self._countEarlierThan(aTime)
+            return 0
+
+        perDay = len(self.hourList) * len(self.minuteList)
+        ret = 0
+        if self._isDayMatched(a.date()):
+            ret += perDay - self._countEarlierThan(aTime)
+        day = a.date() + timedelta(days=1)
+        while day < b.date():
+            if day.month not in self.monthSet:
+                day = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+                continue
+            if self._isDayMatched(day):
+                ret += perDay
+            day += timedelta(days=1)
+        if self._isDayMatched(b.date()):
+            ret += self._countNotLaterThan(bTime)
+        return ret
+
+    def _isDayMatched(self, day):
+        if day.month not in self.monthSet:
+            return False
+        bDom = day.day in self.domSet
+        bDow = day.isoweekday() % 7 in self.dowSet
+        if self.bDomStar or self.bDowStar:
+            return bDom and bDow
+        else:
+            return bDom or bDow
+
+    def _getFirstTimeInDay(self, tm):
+        # returns the first fire time in a matched day that is not earlier than tm
+        i = bisect.bisect_left(self.hourList, tm.hour)
+        if i < len(self.hourList) and self.hourList[i] == tm.hour:
+            j = bisect.bisect_left(self.minuteList, tm.minute)
+            if j < len(self.minuteList):
+                return time(tm.hour, self.minuteList[j])
+            i += 1
+        if i < len(self.hourList):
+            return time(self.hourList[i], self.minuteList[0])
+        return None
+
+    def _countEarlierThan(self, tm):
+        ret = bisect.bisect_left(self.hourList, tm.hour) * len(self.minuteList)
+        if tm.hour in self.hourSet:
+            ret += bisect.bisect_left(self.minuteList, tm.minute)
+        return ret
+
+    def _countNotLaterThan(self, tm):
+        ret = bisect.bisect_left(self.hourList, tm.hour) * len(self.minuteList)
+        if tm.hour in self.hourSet:
+            ret += bisect.bisect_right(self.minuteList, tm.minute)
+        return ret
+
+    def _parseField(self, fieldStr, minValue, maxValue, nameList):
+        ret = set()
+        for item in fieldStr.lower().split(","):
+            if "/" in item:
+                rangeStr, stepStr = item.split("/", 1)
+                step = int(stepStr)
+                if step <= 0:
+                    raise ValueError("invalid cron field \"%s\"" % (fieldStr))
+            else:
+                rangeStr, step = item, 1
+
+            if rangeStr == "*":
+                first, last = minValue, maxValue
+            elif "-" in rangeStr:
+                first, last = [self._parseValue(x, minValue, nameList) for x in rangeStr.split("-", 1)]
+            else:
+                first = self._parseValue(rangeStr, minValue, nameList)
+                last = maxValue if "/" in item else first
+
+            if not (minValue <= first <= last <= maxValue):
+                raise ValueError("invalid cron field \"%s\"" % (fieldStr))
+            ret.update(range(first, last + 1, step))
+        return ret
+
+    def _parseValue(self, valueStr, minValue, nameList):
+        if nameList is not None and valueStr in nameList:
+            return nameList.index(valueStr) + (1 if minValue == 1 else 0)
+        return int(valueStr)
@@ -3,21 +3,31 @@
 
 import os
 import re
-import math
 import json
 import fcntl
+import time
+import errno
+import heapq
+import psutil
+import random
+import signal
 import logging
+import threading
 import subprocess
 import statistics
+import collections
 from datetime import datetime
-from croniter import croniter
-from collections import OrderedDict
+from datetime import timedelta
 from gi.repository import GLib
 from mc_util import McUtil
 from mc_util import DynObject
 from mc_util import RotatingFile
+from mc_util import RecordLogFile
+from mc_util import ChildSupervisor
 from mc_util import UnixDomainSocketApiServer
 from mc_param import McConst
+from mc_scheduler import McScheduler
+from mc_scheduler import CronExpr
 
 
 class McMirrorSiteUpdater:
@@ -29,21 +39,47 @@ class McMirrorSiteUpdater:
     MIRROR_SITE_UPDATE_STATUS_UPDATING = 4
     MIRROR_SITE_UPDATE_STATUS_UPDATE_FAIL = 5
     MIRROR_SITE_UPDATE_STATUS_MAINTAINING = 6
+    MIRROR_SITE_UPDATE_STATUS_PAUSED = 7               # initializing or updating, paused by load shedding
 
     MIRROR_SITE_RESTART_INTERVAL = 60
+    MIRROR_SITE_STOP_GRACE_TIME = 5
 
     def __init__(self, param):
         self.param = param
         self.invoker = _IdleInvoker()
-        self.scheduler = _Scheduler()
+        self.scheduler = _Scheduler(self.param.mainCfg["preferedUpdatePeriodList"], self.param.mainCfg["scheduleJitter"], self.param.mainCfg["catchUpPolicy"])
+        self.admission = _AdmissionQueue(self.param.mainCfg["updateConcurrencyLimit"], self.invoker)
+        self.breaker = _CircuitBreaker(self.param.mainCfg["circuitBreaker"], self.invoker)
+        self.advertiseDebouncer = _AdvertiseDebouncer(self.param)
+        self.supervisor = ChildSupervisor()
+        self.cgroupManager = self.param.cgroupManager
+        self.sampler = _ProcessSampler(self.cgroupManager)
         self.apiServer = _ApiServer()
 
         self.updaterDict = dict()                                       # dict<mirror-id,updater-object>
+        self.shedder = _LoadShedder(self.param.mainCfg["loadShedding"], self.param, self.scheduler, self.updaterDict, self.invoker)
+        self.dependentDict = dict()                                     # dict<mirror-id,list<mirror-id>>
+        for ms in self.param.mirrorSiteDict.values():
+            for depId in ms.dependsOnList:
+                self.dependentDict.setdefault(depId, []).append(ms.id)
         for ms in self.param.mirrorSiteDict.values():
             self.updaterDict[ms.id] = _OneMirrorSiteUpdater(self, ms)
 
     def dispose(self):
-        self.apiServer.dispose()
+        # no new initializer, updater or maintainer is started from now on
+        # supervisor.waitAll() runs the main loop, so the callbacks which are already queued are made no-op
+        for updater in self.updaterDict.values():
+            updater.cancelPending()
+        self.admission.dispose()
+        self.breaker.dispose()
+        self.advertiseDebouncer.dispose()
+        self.shedder.dispose()
+
+        # stop all the initializers, updaters and maintainers concurrently
+        # api server and scheduler are still needed when the exit callbacks are called
+        startTime = time.monotonic()
+        count = self.supervisor.getCount()
+        timeout = 0
         for updater in self.updaterDict.values():
             if updater.status == self.MIRROR_SITE_UPDATE_STATUS_INITING:
                 updater.initStop()
@@ -51,8 +87,18 @@ class McMirrorSiteUpdater:
                 updater.updateStop()
             elif updater.status == self.MIRROR_SITE_UPDATE_STATUS_MAINTAINING:
                 updater.maintainStop()
-        # FIXME, should use g_main_context_iteration to wait all the updaters to stop
+            else:
+                continue
+            timeout = max(timeout, updater.mirrorSite.stopTimeout)
+        left = self.supervisor.waitAll(timeout + self.MIRROR_SITE_STOP_GRACE_TIME)
+        if left > 0:
+            logging.warning("%d of %d processes are not reaped when shutting down, SIGKILL sent." % (left, count))
+        if count > 0:
+            logging.info("%d processes stopped in %.1f seconds." % (count - left, time.monotonic() - startTime))
+
         self.scheduler.dispose()
+        self.sampler.dispose()
+        self.apiServer.dispose()
         self.invoker.dispose()
 
     def isMirrorSiteInitialized(self, mirrorSiteId):
@@ -62,6 +108,8 @@ class McMirrorSiteUpdater:
         updater = self.updaterDict[mirrorSiteId]
         ret = dict()
         ret["update_status"] = updater.status
+        if updater.status in [self.MIRROR_SITE_UPDATE_STATUS_INITING, self.MIRROR_SITE_UPDATE_STATUS_UPDATING] and updater.bPaused:
+            ret["update_status"] = self.MIRROR_SITE_UPDATE_STATUS_PAUSED
         if mirrorSiteId in self.scheduler.jobDict:
             ret["last_update_time"] = self.scheduler.jobInfoDict[mirrorSiteId][0]
             ret["next_update_time"] = self.scheduler.jobInfoDict[mirrorSiteId][1]
@@ -70,11 +118,77 @@ class McMirrorSiteUpdater:
             ret["next_update_time"] = None
         if updater.status in [self.MIRROR_SITE_UPDATE_STATUS_INITING, self.MIRROR_SITE_UPDATE_STATUS_UPDATING]:
             ret["update_progress"] = updater.progress
+            ret["update_eta"] = updater.getEta()
+        ret["network_rx"], ret["network_tx"] = updater.updateHistory.getNetworkTotal()
+        if self.sampler.hasRun(mirrorSiteId) and updater.status in [self.MIRROR_SITE_UPDATE_STATUS_INITING, self.MIRROR_SITE_UPDATE_STATUS_UPDATING]:
+            ret["update_network_rx"], ret["update_network_tx"] = self.sampler.getRunTraffic(mirrorSiteId)
+            ret["network_rx"] += ret["update_network_rx"]
+            ret["network_tx"] += ret["update_network_tx"]
+        ret["update_queue_depth"] = self.admission.getQueueDepth()
+        if self.admission.isWaiting(mirrorSiteId):
+            ret["update_queue_wait"] = self.admission.getWaitSeconds(mirrorSiteId)
+        return ret
+
+    def getNetworkUsage(self):
+        # returns dict<plugin-name,(bytes-received,bytes-sent)>, including the running initializers and updaters
+        ret = dict()
+        for mirrorSiteId, updater in self.updaterDict.items():
+            state = self.getMirrorSiteUpdateState(mirrorSiteId)
+            rx, tx = ret.get(updater.mirrorSite.pluginName, (0, 0))
+            ret[updater.mirrorSite.pluginName] = (rx + state["network_rx"], tx + state["network_tx"])
+        return ret
+
+    def getMirrorSiteTelemetry(self, mirrorSiteId):
+        # returns resource usage of the current run, or the last run if the mirror site is not running
+        updater = self.updaterDict[mirrorSiteId]
+        ret = dict()
+        ret["running"] = self.sampler.hasRun(mirrorSiteId)
+        if ret["running"]:
+            ret["usage"] = self.sampler.getRunUsage(mirrorSiteId)
+        else:
+            obj = updater.updateHistory.getLastUpdateInfo()
+            ret["usage"] = obj.usage if obj is not None else None
+        ret["interval"] = _ProcessSampler.INTERVAL
+        ret["sample_list"] = self.sampler.getSampleList(mirrorSiteId)
         return ret
 
     def updateMirrorSiteNow(self, mirrorSiteId):
-        assert self.updaterDict[mirrorSiteId].status in [self.MIRROR_SITE_UPDATE_STATUS_IDLE, self.MIRROR_SITE_UPDATE_STATUS_UPDATE_FAIL]
-        self.scheduler.triggerJobNow(mirrorSiteId)
+        # returns False if the update is deferred because serving load is high, it is started when the load becomes low
+        updater = self.updaterDict[mirrorSiteId]
+        assert updater.status in [self.MIRROR_SITE_UPDATE_STATUS_IDLE, self.MIRROR_SITE_UPDATE_STATUS_UPDATE_FAIL]
+        return updater.updateNow()
+
+    def addMirrorSite(self, mirrorSite):
+        assert mirrorSite.id not in self.updaterDict
+        for depId in mirrorSite.dependsOnList:
+            self.dependentDict.setdefault(depId, []).append(mirrorSite.id)
+        self.updaterDict[mirrorSite.id] = _OneMirrorSiteUpdater(self, mirrorSite)
+
+        # dependents held while the old definition was being removed
+        for msId in self.dependentDict.get(mirrorSite.id, []):
+            self.updaterDict[msId]._checkDependencyPending()
+
+    def removeMirrorSite(self, mirrorSiteId, callback):
+        # running initializer or updater is allowed to finish, running maintainer is stopped
+        # callback is called after the mirror site is removed
+        updater = self.updaterDict[mirrorSiteId]
+        assert updater.removeCallback is None
+        updater.removeCallback = lambda: self._removeUpdater(mirrorSiteId, callback)
+        if updater.status in [self.MIRROR_SITE_UPDATE_STATUS_INITING, self.MIRROR_SITE_UPDATE_STATUS_UPDATING]:
+            logging.info("Mirror site \"%s\" will be removed after the running initializer or updater exits." % (mirrorSiteId))
+        elif updater.status == self.MIRROR_SITE_UPDATE_STATUS_MAINTAINING:
+            updater.maintainStop()
+        else:
+            updater._checkRemovePending()
+
+    def _removeUpdater(self, mirrorSiteId, callback):
+        updater = self.updaterDict.pop(mirrorSiteId)
+        updater.dispose()
+        for depId in updater.mirrorSite.dependsOnList:
+            self.dependentDict[depId].remove(mirrorSiteId)
+            if len(self.dependentDict[depId]) == 0:
+                del self.dependentDict[depId]
+        callback()
 
 
 class _OneMirrorSiteUpdater:
@@ -83,31 +197,82 @@ class _OneMirrorSiteUpdater:
         self.param = parent.param
         self.invoker = parent.invoker
         self.scheduler = parent.scheduler
+        self.admission = parent.admission
+        self.breaker = parent.breaker
+        self.advertiseDebouncer = parent.advertiseDebouncer
+        self.shedder = parent.shedder
+        self.supervisor = parent.supervisor
+        self.cgroupManager = parent.cgroupManager
+        self.sampler = parent.sampler
         self.apiServer = parent.apiServer
+        self.updaterDict = parent.updaterDict
+        self.dependentDict = parent.dependentDict
         self.mirrorSite = mirrorSite
 
         self.updateHistory = _UpdateHistory(os.path.join(self.mirrorSite.masterDir, "UPDATE_HISTORY"),
                                             self.mirrorSite.initializerExe is not None)
 
+        self.upstreamId = None                  # reported by plugin, kept across runs
+        self.failureCount = 0                   # number of consecutive failures
+        self.bDependencyPending = False         # an update is needed for the mirror sites it depends on
+        self.bManualRequest = False             # the update is requested by user
+        self.removeCallback = None              # not None if the mirror site is being removed
+        self.bDisposed = False
+
         if not self.updateHistory.isInitialized():
             self.status = McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INIT
-            self.invoker.addCallback(self.initStart)
+            self.invoker.addCallback(self._initRequest)
         else:
             self.status = McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_IDLE
             obj = self.updateHistory.getLastUpdateInfo()
             if obj is not None:
+                self.upstreamId = obj.upstreamId
                 self._postInit(obj.endTime)
             else:
                 self._postInit(None)
 
+    def dispose(self):
+        # no initializer, updater or maintainer is running, callbacks which are already queued do nothing from now on
+        assert self.status not in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_MAINTAINING]
+        self.cancelPending()
+        if self.mirrorSite.id in self.scheduler.jobDict:
+            self.scheduler.removeJob(self.mirrorSite.id)
+        self.admission.cancel(self.mirrorSite.id)
+        self.breaker.removeWaiter(self.mirrorSite.id)
+        self.advertiseDebouncer.cancel(self.mirrorSite.id)
+        self.shedder.removeMirrorSite(self.mirrorSite.id)
+
+    def cancelPending(self):
+        # nothing is started by the queued callbacks and timers from now on, running processes are not touched
+        self.bDisposed = True
+        if hasattr(self, "reInitHandler"):
+            GLib.source_remove(self.reInitHandler)
+            del self.reInitHandler
+        if hasattr(self, "reMaintainHandler"):
+            GLib.source_remove(self.reMaintainHandler)
+            del self.reMaintainHandler
+
+    def updateNow(self):
+        # see McMirrorSiteUpdater.updateMirrorSiteNow()
+        if not self.admission.isWaiting(self.mirrorSite.id):
+            self.bManualRequest = True                      # circuit breaker is bypassed, the job is executed synchronously
+            try:
+                self.scheduler.triggerJobNow(self.mirrorSite.id)
+            finally:
+                self.bManualRequest = False
+        self.admission.promote(self.mirrorSite.id, _AdmissionQueue.PRIORITY_MANUAL)       # manual update jumps the queue
+        return not self.shedder.hasWaiter(self.mirrorSite.id)
+
     def initStart(self):
         assert self.status in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INIT, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INIT_FAIL]
 
         try:
             self.status = McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING
             self._createVars()
+            self.bDependencyPending = False
             self.proc = self._createProc()
-            self.pidWatch = GLib.child_watch_add(self.proc.pid, self.initExitCallback)
+            self.supervisor.watch(self.proc, self.initExitCallback)
+            self.sampler.addRun(self.mirrorSite.id, self.proc.pid, self.cgroupPath)
             self.stdoutWatch = GLib.io_add_watch(self.proc.stdout, GLib.IO_IN, self._stdoutCallback)
             self.logger = RotatingFile(self.mirrorSite.mainUpdaterLogFile, McConst.rotateLogFileSize, McConst.rotateLogFileCount)
             logging.info("Mirror site \"%s\" initialization starts." % (self.mirrorSite.id))
@@ -120,11 +285,14 @@ class _OneMirrorSiteUpdater:
     def initStop(self):
         assert self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING
         self.bStop = True
-        McUtil.procTerminate(self.proc)
+        if self.bPaused:
+            self.resume()                       # stopped process can't handle SIGTERM
+        self.supervisor.terminate(self.proc.pid, self.mirrorSite.stopTimeout)
 
     def initProgressCallback(self, progress):
         assert self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING
         if progress > self.progress:
+            self._updateProgressRate(progress)
             self.progress = progress
             logging.info("Mirror site \"%s\" initialization progress %d%%." % (self.mirrorSite.id, self.progress))
         elif progress == self.progress:
@@ -155,25 +323,34 @@ class _OneMirrorSiteUpdater:
             GLib.spawn_check_exit_status(status)
             # child process returns ok
             bStop = self.bStop
-            self.updateHistory.initFinished(curDt)
+            rx, tx = self.sampler.getRunTraffic(self.mirrorSite.id)
+            self.updateHistory.initFinished(curDt, self.upstreamId, rx, tx, self.sampler.getRunUsage(self.mirrorSite.id))
+            self.failureCount = 0
+            self.breaker.recordSuccess(self._getUpstreamKey())
             self._clearVars()
             self.status = McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_IDLE
             logging.info("Mirror site \"%s\" initialization finished." % (self.mirrorSite.id))
+            self.param.diskUsageCollector.requestScan(self.mirrorSite.id)
             if not bStop:
                 self._postInit(curDt)
+                self._notifyDependents(True)
         except GLib.Error as e:
             # child process returns failure
             bStop = self.bStop
             holdFor = self.holdFor
+            if not bStop:
+                self.failureCount += 1
+                self.breaker.recordFailure(self._getUpstreamKey(), self.mirrorSite.id)
             self._clearVars()
             self.status = McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INIT_FAIL
             if holdFor is None:
-                logging.error("Mirror site \"%s\" initialization failed (code: %d), re-initialize in %d seconds." % (self.mirrorSite.id, e.code, McMirrorSiteUpdater.MIRROR_SITE_RESTART_INTERVAL))
-                holdFor = McMirrorSiteUpdater.MIRROR_SITE_RESTART_INTERVAL
+                holdFor = self._getBackoffSeconds(self.param.mainCfg["retryBackoff"]["base"])
+                logging.error("Mirror site \"%s\" initialization failed (code: %d), re-initialize in %d seconds." % (self.mirrorSite.id, e.code, holdFor))
             else:
                 logging.error("Mirror site \"%s\" initialization failed (code: %d), hold for %d seconds before re-initialization." % (self.mirrorSite.id, e.code, holdFor))
             if not bStop:
                 self.reInitHandler = GLib.timeout_add_seconds(holdFor, self._reInitCallback)
+        self._checkRemovePending()
 
     def updateStart(self, schedDatetime):
         assert self.status in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_IDLE, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATE_FAIL]
@@ -186,11 +363,14 @@ class _OneMirrorSiteUpdater:
             self.status = McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING
             self._createVars()
             self.schedDatetime = schedDatetime
+            self.bDependencyPending = False
             self.proc = self._createProc()
-            self.pidWatch = GLib.child_watch_add(self.proc.pid, self.updateExitCallback)
+            self.supervisor.watch(self.proc, self.updateExitCallback)
+            self.sampler.addRun(self.mirrorSite.id, self.proc.pid, self.cgroupPath)
             self.stdoutWatch = GLib.io_add_watch(self.proc.stdout, GLib.IO_IN, self._stdoutCallback)
             self.logger = RotatingFile(self.mirrorSite.mainUpdaterLogFile, McConst.rotateLogFileSize, McConst.rotateLogFileCount)
             logging.info("Mirror site \"%s\" update triggered on \"%s\"." % (self.mirrorSite.id, self.schedDatetime.strftime("%Y-%m-%d %H:%M")))
+            self._notifyAdvertisers()
         except Exception:
             self._clearVars()
             self.status = McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATE_FAIL
@@ -199,11 +379,14 @@ class _OneMirrorSiteUpdater:
     def updateStop(self):
         assert self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING
         self.bStop = True
-        McUtil.procTerminate(self.proc)
+        if self.bPaused:
+            self.resume()                       # stopped process can't handle SIGTERM
+        self.supervisor.terminate(self.proc.pid, self.mirrorSite.stopTimeout)
 
     def updateProgressCallback(self, progress):
         assert self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING
         if progress > self.progress:
+            self._updateProgressRate(progress)
             self.progress = progress
             logging.info("Mirror site \"%s\" update progress %d%%." % (self.mirrorSite.id, self.progress))
         elif progress == self.progress:
@@ -211,6 +394,17 @@ class _OneMirrorSiteUpdater:
         else:
             raise Exception("invalid progress")
 
+    def upstreamCallback(self, upstreamId):
+        assert self.status in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING]
+        self.upstreamId = upstreamId
+
+    def updateStatisticsCallback(self, bytesTransferred, filesChanged):
+        assert self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING
+        if bytesTransferred is not None:
+            self.bytesTransferred = bytesTransferred
+        if filesChanged is not None:
+            self.filesChanged = filesChanged
+
     def updateErrorCallback(self, exc_info):
         assert self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING
         assert self.excInfo is None
@@ -233,27 +427,49 @@ class _OneMirrorSiteUpdater:
         try:
             GLib.spawn_check_exit_status(status)
             # child process returns ok
-            self.updateHistory.updateFinished(True, self.schedDatetime, curDt)
+            bStop = self.bStop
+            filesChanged = self.filesChanged
+            rx, tx = self.sampler.getRunTraffic(self.mirrorSite.id)
+            self.updateHistory.updateFinished(True, self.startDatetime, curDt, 0, self.bytesTransferred, self.filesChanged, self.upstreamId, rx, tx,
+                                              self.sampler.getRunUsage(self.mirrorSite.id))
+            self.failureCount = 0
+            self.breaker.recordSuccess(self._getUpstreamKey())
             self._clearVars()
             self.status = McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_IDLE
             logging.info("Mirror site \"%s\" update finished." % (self.mirrorSite.id))
+            self.param.diskUsageCollector.requestScan(self.mirrorSite.id)
+            self._notifyAdvertisers()
+            if not bStop:
+                self._notifyDependents(filesChanged != 0)           # None means the updater does not report it
+                self._checkDependencyPending()
         except GLib.Error as e:
             # child process returns failure
             bStop = self.bStop
-            self.updateHistory.updateFinished(False, self.schedDatetime, curDt)
+            rx, tx = self.sampler.getRunTraffic(self.mirrorSite.id)
+            self.updateHistory.updateFinished(False, self.startDatetime, curDt, e.code, self.bytesTransferred, self.filesChanged, self.upstreamId, rx, tx,
+                                              self.sampler.getRunUsage(self.mirrorSite.id))
+            if not bStop:
+                self.failureCount += 1
+                self.breaker.recordFailure(self._getUpstreamKey(), self.mirrorSite.id)
             self._clearVars()
             self.status = McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATE_FAIL
             logging.error("Mirror site \"%s\" update failed (code: %d)." % (self.mirrorSite.id, e.code))
+            self._notifyAdvertisers()                               # a failed or stopped update may have changed files too
             if not bStop:
                 self._retryUpdate(curDt)
+                self._notifyDependents(False)
+        self._checkRemovePending()
 
     def maintainStart(self):
+        if self.bDisposed:
+            return
         assert self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_IDLE
         try:
             self.status = McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_MAINTAINING
             self._createVars()
             self.proc = self._createProc()
-            self.pidWatch = GLib.child_watch_add(self.proc.pid, self.maintainExitCallback)
+            self.supervisor.watch(self.proc, self.maintainExitCallback)
+            self.sampler.addRun(self.mirrorSite.id, self.proc.pid, self.cgroupPath)
             self.stdoutWatch = GLib.io_add_watch(self.proc.stdout, GLib.IO_IN, self._stdoutCallback)
             self.logger = RotatingFile(self.mirrorSite.mainUpdaterLogFile, McConst.rotateLogFileSize, McConst.rotateLogFileCount)
             logging.info("Mirror site \"%s\" maintainer started." % (self.mirrorSite.id))
@@ -266,7 +482,7 @@ class _OneMirrorSiteUpdater:
     def maintainStop(self):
         assert self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_MAINTAINING
         self.bStop = True
-        McUtil.procTerminate(self.proc)
+        self.supervisor.terminate(self.proc.pid, self.mirrorSite.stopTimeout)
 
     def maintainErrorCallback(self, exc_info):
         assert self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_MAINTAINING
@@ -287,27 +503,89 @@ class _OneMirrorSiteUpdater:
         logging.error("Mirror site \"%s\" maintainer exited (code: %d), restart it in %d seconds." % (self.mirrorSite.id, code, McMirrorSiteUpdater.MIRROR_SITE_RESTART_INTERVAL))
         if not bStop:
             self.reMaintainHandler = GLib.timeout_add_seconds(McMirrorSiteUpdater.MIRROR_SITE_RESTART_INTERVAL, self._reMaintainCallback)
+        self._checkRemovePending()
+
+    def pause(self):
+        assert self.status in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING]
+        assert not self.bPaused
+        # cgroup freezer is preferred, it also catches the processes which left the process group
+        if self.cgroupPath is None or not self.cgroupManager.freezeRunGroup(self.cgroupPath, True):
+            try:
+                os.killpg(self.proc.pid, signal.SIGSTOP)
+            except ProcessLookupError:
+                return                          # exit callback is pending
+        self.bPaused = True
+        logging.info("Mirror site \"%s\" paused." % (self.mirrorSite.id))
+
+    def resume(self):
+        assert self.bPaused
+        if self.cgroupPath is None or not self.cgroupManager.freezeRunGroup(self.cgroupPath, False):
+            try:
+                os.killpg(self.proc.pid, signal.SIGCONT)
+            except ProcessLookupError:
+                pass
+        self.bPaused = False
+        logging.info("Mirror site \"%s\" resumed." % (self.mirrorSite.id))
+
+    def getEta(self):
+        # unit: seconds, returns None if it can't be estimated
+        assert self.status in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING]
+        curDt = datetime.now()
+        if self.progressRate is not None and self.progressRate > 0:
+            ret = (100 - self.progress) / self.progressRate - (curDt - self.progressDatetime).total_seconds()
+        elif self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING and self.updateHistory.getUpdateDurationPercentile(50) is not None:
+            ret = self.updateHistory.getUpdateDurationPercentile(50) - (curDt - self.startDatetime).total_seconds()
+        else:
+            return None
+        return max(0, int(ret))
+
+    def _updateProgressRate(self, progress):
+        # exponentially weighted moving average of the progress rate, recent samples weigh more
+        curDt = datetime.now()
+        seconds = max(1, (curDt - self.progressDatetime).total_seconds())
+        rate = (progress - self.progress) / seconds
+        if self.progressRate is None:
+            self.progressRate = rate
+        else:
+            self.progressRate = 0.3 * rate + 0.7 * self.progressRate
+        self.progressDatetime = curDt
+
+    def _predictUpdateDuration(self):
+        # be pessimistic, a long update that overruns the prefered update period is worse than a deferred one
+        ret = self.updateHistory.getUpdateDurationPercentile(90)
+        if ret is not None:
+            ret = timedelta(seconds=ret)
+        return ret
 
     def _stdoutCallback(self, source, cb_condition):
         try:
-            self.logger.write(source.read())
+            self.logger.readFrom(source.fileno())
         finally:
             return True
 
     def _createVars(self):
         self.bStop = False
+        self.bPaused = False
         self.proc = None
-        self.pidWatch = None
+        self.cgroupPath = None
         self.stdoutWatch = None
         self.logger = None
         self.excInfo = None
 
         if self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING:
+            self.startDatetime = datetime.now()
             self.progress = 0
+            self.progressDatetime = self.startDatetime
+            self.progressRate = None                # unit: percent per second
             self.holdFor = None
         elif self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING:
             self.schedDatetime = None
+            self.startDatetime = datetime.now()
             self.progress = 0
+            self.progressDatetime = self.startDatetime
+            self.progressRate = None                # unit: percent per second
+            self.bytesTransferred = None
+            self.filesChanged = None
             self.holdFor = None
         elif self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_MAINTAINING:
             pass
@@ -317,11 +595,19 @@ class _OneMirrorSiteUpdater:
     def _clearVars(self):
         if self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING:
             del self.holdFor
+            del self.progressRate
+            del self.progressDatetime
             del self.progress
+            del self.startDatetime
         elif self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING:
-            del self.schedDatetime
             del self.holdFor
+            del self.filesChanged
+            del self.bytesTransferred
+            del self.progressRate
+            del self.progressDatetime
             del self.progress
+            del self.startDatetime
+            del self.schedDatetime
         elif self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_MAINTAINING:
             pass
         else:
@@ -329,20 +615,36 @@ class _OneMirrorSiteUpdater:
 
         del self.excInfo
         if self.logger is not None:
+            if self.proc is not None:
+                try:
+                    self.logger.readFrom(self.proc.stdout.fileno())      # save the remaining output
+                except OSError:
+                    pass
             self.logger.close()
         del self.logger
         if self.stdoutWatch is not None:
             GLib.source_remove(self.stdoutWatch)
         del self.stdoutWatch
-        if self.pidWatch is not None:
-            GLib.source_remove(self.pidWatch)
-        del self.pidWatch
+        if self.sampler.hasRun(self.mirrorSite.id):
+            self.sampler.removeRun(self.mirrorSite.id)
+        if self.bPaused:
+            self.resume()
+        del self.bPaused
         if self.proc is not None:
-            McUtil.procTerminate(self.proc, wait=True)
+            if self.proc.returncode is None:
+                # process is still running, let supervisor reap it
+                self.supervisor.terminate(self.proc.pid, self.mirrorSite.stopTimeout)
+                self.supervisor.detach(self.proc.pid)
             self.apiServer.removeMirrorSite(self.mirrorSite.id, self, self.proc.pid)
         del self.proc
+        if self.cgroupPath is not None:
+            self.cgroupManager.destroyRunGroup(self.cgroupPath)
+        del self.cgroupPath
         del self.bStop
 
+        if self.admission.isRunning(self.mirrorSite.id):
+            self.admission.release(self.mirrorSite.id)
+
     def _createProc(self):
         cmd = []
 
@@ -385,42 +687,202 @@ class _OneMirrorSiteUpdater:
 
             cmd.append(json.dumps(args))
 
+        # create cgroup, limits in main config file are applied on all the runs as a whole
+        if self.cgroupManager.isAvailable():
+            self.cgroupPath = self.cgroupManager.createRunGroup(self.mirrorSite.id, self.mirrorSite.resourceLimitDict)
+            cmd = self.cgroupManager.getJoinCommand(self.cgroupPath, cmd)
+
         # create process
         proc = subprocess.Popen(cmd,
                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
                                 bufsize=0,
-                                cwd=self.mirrorSite.pluginStateDir)
+                                cwd=self.mirrorSite.pluginStateDir,
+                                start_new_session=True)
         fcntl.fcntl(proc.stdout, fcntl.F_SETFL, fcntl.fcntl(proc.stdout, fcntl.F_GETFL) | os.O_NONBLOCK)
         self.apiServer.addMirrorSite(self.mirrorSite.id, self, proc.pid)
 
         return proc
 
+    def _initRequest(self):
+        if self.bDisposed:
+            return
+        if not self.breaker.isAllowed(self._getUpstreamKey(), self.mirrorSite.id):
+            openUntil = self.breaker.getOpenUntil(self._getUpstreamKey())
+            if openUntil is not None:
+                seconds = max(1, int((openUntil - datetime.now()).total_seconds()))
+                self.reInitHandler = GLib.timeout_add_seconds(seconds, self._reInitCallback)
+                logging.info("Mirror site \"%s\" initialization postponed for %d seconds, upstream is unavailable." % (self.mirrorSite.id, seconds))
+            else:
+                self.breaker.addWaiter(self._getUpstreamKey(), self.mirrorSite.id, self._initRequest)
+                logging.info("Mirror site \"%s\" initialization postponed, upstream is being probed." % (self.mirrorSite.id))
+            return
+        if self.shedder.isOverloaded():
+            self.shedder.addWaiter(self.mirrorSite.id, self._initRequest)
+            logging.info("Mirror site \"%s\" initialization postponed, serving load is high." % (self.mirrorSite.id))
+            return
+        self.admission.submit(self.mirrorSite, _AdmissionQueue.PRIORITY_INIT, self.initStart)
+
+    def _updateRequest(self, schedDatetime):
+        if self.bDisposed:
+            return
+        if self.removeCallback is not None:
+            logging.info("Mirror site \"%s\" updating ignored on \"%s\", mirror site is being removed." % (self.mirrorSite.id, schedDatetime.strftime("%Y-%m-%d %H:%M")))
+            return
+        if self.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING:
+            logging.info("Mirror site \"%s\" updating ignored on \"%s\", last update is not finished." % (self.mirrorSite.id, schedDatetime.strftime("%Y-%m-%d %H:%M")))
+            return
+        if self.admission.isWaiting(self.mirrorSite.id):
+            logging.info("Mirror site \"%s\" updating ignored on \"%s\", last update is still waiting to be admitted." % (self.mirrorSite.id, schedDatetime.strftime("%Y-%m-%d %H:%M")))
+            return
+        if self.shedder.isOverloaded():
+            # update requested by user is still a manual one when the load becomes low
+            if self.bManualRequest:
+                self.shedder.addWaiter(self.mirrorSite.id, self._triggerManualUpdate)
+                logging.info("Mirror site \"%s\" updating requested by user deferred, serving load is high." % (self.mirrorSite.id))
+            else:
+                self.shedder.addWaiter(self.mirrorSite.id, lambda: self._triggerUpdate(None))
+                logging.info("Mirror site \"%s\" updating deferred on \"%s\", serving load is high." % (self.mirrorSite.id, schedDatetime.strftime("%Y-%m-%d %H:%M")))
+            return
+        depId = self._getUnreadyDependency()
+        if depId is not None:
+            # updated when the mirror site it depends on is ready
+            self.bDependencyPending = True
+            logging.info("Mirror site \"%s\" updating held on \"%s\", mirror site \"%s\" is not ready." % (self.mirrorSite.id, schedDatetime.strftime("%Y-%m-%d %H:%M"), depId))
+            return
+        if self.bManualRequest:
+            if self.breaker.getOpenUntil(self._getUpstreamKey()) is not None:
+                logging.info("Mirror site \"%s\" updating requested by user, upstream is unavailable but it is tried anyway." % (self.mirrorSite.id))
+        elif not self.breaker.isAllowed(self._getUpstreamKey(), self.mirrorSite.id):
+            # re-check when the breaker half-opens, or update immediately when it closes
+            openUntil = self.breaker.getOpenUntil(self._getUpstreamKey())
+            if openUntil is not None:
+                self.invoker.addCallback(lambda: self._triggerUpdate(openUntil))
+            self.breaker.addWaiter(self._getUpstreamKey(), self.mirrorSite.id, lambda: self._triggerUpdate(None))
+            logging.info("Mirror site \"%s\" updating ignored on \"%s\", upstream is unavailable." % (self.mirrorSite.id, schedDatetime.strftime("%Y-%m-%d %H:%M")))
+            return
+        self.admission.submit(self.mirrorSite, _AdmissionQueue.PRIORITY_SCHEDULED, lambda: self.updateStart(schedDatetime))
+
     def _reInitCallback(self):
         del self.reInitHandler
-        self.initStart()
+        self._initRequest()
         return False
 
     def _postInit(self, finishDatetime):
         for name in self.mirrorSite.advertiserDict:
-            self.invoker.addCallback(lambda: self.param.advertiserDict[name].advertise_mirror_site(self.mirrorSite.id))
+            self.advertiseDebouncer.add(name, self.mirrorSite.id)
         if self.mirrorSite.updaterExe is not None:
             if self.mirrorSite.schedType == "interval":
-                self.scheduler.addIntervalJob(self.mirrorSite.id, finishDatetime, self.mirrorSite.schedInterval, self.updateStart)
+                self.scheduler.addIntervalJob(self.mirrorSite.id, finishDatetime, self.mirrorSite.schedInterval, self._updateRequest, self.mirrorSite.schedJitter, self._predictUpdateDuration)
             elif self.mirrorSite.schedType == "cronexpr":
-                self.scheduler.addCronJob(self.mirrorSite.id, finishDatetime, self.mirrorSite.schedCronExpr, self.updateStart)
+                self.scheduler.addCronJob(self.mirrorSite.id, finishDatetime, self.mirrorSite.schedCronExpr, self._updateRequest, self.mirrorSite.schedJitter, self._predictUpdateDuration)
             else:
                 assert False
+            count = self.scheduler.getJobMissedCount(self.mirrorSite.id)
+            if count > 0:
+                logging.info("Mirror site \"%s\" missed %d scheduled updates, next update on \"%s\"." % (self.mirrorSite.id, count, self.scheduler.getJobNextSchedDatetime(self.mirrorSite.id).strftime("%Y-%m-%d %H:%M")))
         elif self.mirrorSite.maintainerExe is not None:
             self.invoker.addCallback(self.maintainStart)
 
+    def _triggerUpdate(self, triggerDatetime):
+        # called later by invoker, circuit breaker or load shedder, mirror site may be removed in between
+        if self.bDisposed:
+            return
+        if self.mirrorSite.id not in self.scheduler.jobDict:
+            return                              # not initialized yet
+        if triggerDatetime is None:
+            self.scheduler.triggerJobNow(self.mirrorSite.id)
+        else:
+            self.scheduler.triggerJobAt(self.mirrorSite.id, triggerDatetime)
+
+    def _triggerManualUpdate(self):
+        # called later by load shedder, mirror site may be removed or be updating in between
+        if self.bDisposed:
+            return
+        if self.mirrorSite.id not in self.scheduler.jobDict:
+            return
+        if self.status not in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_IDLE, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATE_FAIL]:
+            return
+        self.updateNow()
+
+    def _checkRemovePending(self):
+        if self.removeCallback is not None:
+            self.removeCallback()
+
+    def _getUnreadyDependency(self):
+        # returns id of the first mirror site it depends on which is not initialized or is being initialized or updated
+        # mirror site being reloaded is not ready either
+        for depId in self.mirrorSite.dependsOnList:
+            obj = self.updaterDict.get(depId)
+            if obj is None:
+                return depId
+            if not obj.updateHistory.isInitialized():
+                return depId
+            if obj.status in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING]:
+                return depId
+        return None
+
+    def _notifyAdvertisers(self):
+        # advertisers which cache file content drop the cache of this mirror site
+        # called when an update starts and when it exits, successful or not, files-changed reported by the updater is not trusted
+        for name in self.mirrorSite.advertiserDict:
+            obj = self.param.advertiserDict[name]
+            if not hasattr(obj, "notify_mirror_site_updated"):
+                continue
+            try:
+                obj.notify_mirror_site_updated(self.mirrorSite.id)
+            except Exception:
+                logging.error("Advertiser \"%s\" failed to refresh mirror site \"%s\"." % (name, self.mirrorSite.id), exc_info=True)
+
+    def _notifyDependents(self, bChanged):
+        # dependents are updated if there're changes, held dependents are released anyway
+        for msId in self.dependentDict.get(self.mirrorSite.id, []):
+            obj = self.updaterDict[msId]
+            if bChanged:
+                obj.bDependencyPending = True
+            elif obj.bDependencyPending:
+                pass
+            else:
+                logging.info("Mirror site \"%s\" updating skipped, mirror site \"%s\" has no change." % (msId, self.mirrorSite.id))
+            obj._checkDependencyPending()
+
+    def _checkDependencyPending(self):
+        # pending update is triggered when it can be started, updating mirror site is checked again when the update finishes
+        if self.bDisposed:
+            return
+        if not self.bDependencyPending:
+            return
+        if self.status not in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_IDLE, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATE_FAIL]:
+            return
+        if self.mirrorSite.id not in self.scheduler.jobDict:
+            return
+        if self._getUnreadyDependency() is not None:
+            return
+        self.scheduler.triggerJobNow(self.mirrorSite.id)
+
     def _retryUpdate(self, finishDatetime):
         if self.mirrorSite.updateRetryType == "interval":
-            newDt = finishDatetime + self.mirrorSite.updateRetryInterval
+            seconds = self._getBackoffSeconds(self.mirrorSite.updateRetryInterval.total_seconds())
+            newDt = finishDatetime + timedelta(seconds=seconds)
             self.scheduler.triggerJobAt(self.mirrorSite.id, newDt)
         elif self.mirrorSite.updateRetryType == "cronexpr":
-            newDt = croniter(self.mirrorSite.updateRetryCronExpr, finishDatetime, datetime).get_next()
+            # first retry follows the cron expression, the later ones are delayed by backoff
+            seconds = self._getBackoffSeconds(self.param.mainCfg["retryBackoff"]["base"]) if self.failureCount > 1 else 0
+            newDt = CronExpr(self.mirrorSite.updateRetryCronExpr).getNext(finishDatetime + timedelta(seconds=seconds))
             self.scheduler.triggerJobAt(self.mirrorSite.id, newDt)
 
+    def _getUpstreamKey(self):
+        # mirror sites which don't report upstream are tracked individually
+        if self.upstreamId is not None:
+            return self.upstreamId
+        else:
+            return "mirror-site:" + self.mirrorSite.id
+
+    def _getBackoffSeconds(self, baseSeconds):
+        # exponential backoff with up to 50% jitter on top, retries of the mirror sites sharing one upstream are spread out
+        # jitter only delays, a retry never comes earlier than the backoff (or the configured retry interval)
+        delay = min(self.param.mainCfg["retryBackoff"]["cap"], baseSeconds * 2 ** min(max(self.failureCount - 1, 0), 32))
+        return max(1, int(delay + random.uniform(0, delay / 2)))
+
     def _reMaintainCallback(self):
         del self.reMaintainHandler
         self.maintainStart()
@@ -498,6 +960,31 @@ class _ApiServer(UnixDomainSocketApiServer):
 
             return
 
+        if data["message"] == "upstream":
+            if "id" not in data["data"]:
+                raise Exception("\"data.id\" field does not exist in notification")
+            if not isinstance(data["data"]["id"], str) or data["data"]["id"] == "":
+                raise Exception("\"data.id\" field does not contain a non-empty string")
+
+            if obj.mirrorSite.initializerExe is not None and obj.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING:
+                obj.upstreamCallback(data["data"]["id"])
+            elif obj.mirrorSite.updaterExe is not None and obj.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING:
+                obj.upstreamCallback(data["data"]["id"])
+            else:
+                assert False
+            return
+
+        if data["message"] == "statistics":
+            for key in ["bytes", "files-changed"]:
+                if key in data["data"] and not (isinstance(data["data"][key], int) and data["data"][key] >= 0):
+                    raise Exception("\"data.%s\" field does not contain a non-negative integer value" % (key))
+
+            if obj.mirrorSite.updaterExe is not None and obj.status == McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING:
+                obj.updateStatisticsCallback(data["data"].get("bytes"), data["data"].get("files-changed"))
+            else:
+                assert False
+            return
+
         if data["message"] == "error":
             if "exc_info" not in data["data"]:
                 raise Exception("\"data.exc_info\" field does not exist in notification")
@@ -533,6 +1020,215 @@ class _ApiServer(UnixDomainSocketApiServer):
         raise Exception("message type \"%s\" is not supported" % (data["message"]))
 
 
+class _ProcessSampler:
+
+    """
+    Samples the process trees of the running initializers, updaters and maintainers periodically,
+    in a background thread, results are applied in main thread.
+    Network traffic is accounted by the TCP sockets of the run, traffic of a socket is counted up
+    to the last sample before it is gone. If the run has a cgroup, only the sockets created in the
+    cgroup are dumped, filtered by the kernel, every NET_INTERVAL, sockets closed by the process
+    tree are counted until they are finished. Otherwise all the sockets are dumped every INTERVAL
+    and matched against the fds of the process tree.
+    CPU time and disk IO of a process are counted up to its last sample, RSS and open fds are
+    the sums over the process tree. Samples of a mirror site are kept in a ring buffer, which
+    is retained after the run ends, until the next run starts.
+    """
+
+    INTERVAL = 5
+    NET_INTERVAL = 1
+    MAX_SAMPLE_COUNT = 720                      # one hour
+
+    def __init__(self, cgroupManager):
+        self.cgroupManager = cgroupManager
+        self.sampleDict = dict()                # dict<mirror-id,deque<(time,cpu-time,rss,io-read,io-write,fds,net-rx,net-tx)>>
+
+        # members shared with the sampling thread, protected by self.cond
+        self.cond = threading.Condition()
+        self.runDict = dict()                   # dict<mirror-id,run-object>
+        self.bStop = False
+
+        # members only used by the sampling thread
+        self.bNetAvailable = True
+        self.bCgroupFilter = True
+
+        self.thread = None                      # started by the first run, so that nothing is left if our creator fails
+
+    def dispose(self):
+        if self.thread is not None:
+            with self.cond:
+                self.bStop = True
+                self.cond.notify()
+            self.thread.join()
+            self.thread = None
+        self.sampleDict = dict()
+        self.runDict = dict()
+
+    def hasRun(self, mirrorId):
+        return mirrorId in self.runDict
+
+    def addRun(self, mirrorId, pid, cgroupPath):
+        assert mirrorId not in self.runDict
+        obj = DynObject()
+        obj.pid = pid
+        obj.cgroupPath = cgroupPath
+        obj.cgroupId = self.cgroupManager.getGroupId(cgroupPath) if cgroupPath is not None else None
+        obj.sockDict = dict()                   # dict<socket-cookie,(bytes-received,bytes-sent)>
+        obj.closedRx = 0
+        obj.closedTx = 0
+        obj.procDict = dict()                   # dict<(pid,start-time),(cpu-time,io-read,io-write)>
+        obj.exitedCpuTime = 0
+        obj.exitedIoRead = 0
+        obj.exitedIoWrite = 0
+        obj.rssMax = 0
+        obj.fdMax = 0
+        self.sampleDict[mirrorId] = collections.deque(maxlen=self.MAX_SAMPLE_COUNT)
+        with self.cond:
+            self.runDict[mirrorId] = obj
+            self.cond.notify()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._threadFunc, name="process-sampler")
+            self.thread.start()
+
+    def removeRun(self, mirrorId):
+        # samples of the run in progress are dropped when they are applied
+        with self.cond:
+            del self.runDict[mirrorId]
+
+    def getRunTraffic(self, mirrorId):
+        # returns (bytes-received, bytes-sent)
+        obj = self.runDict[mirrorId]
+        return (obj.closedRx + sum([x[0] for x in obj.sockDict.values()]), obj.closedTx + sum([x[1] for x in obj.sockDict.values()]))
+
+    def getRunUsage(self, mirrorId):
+        # returns the summary of the resource usage, it is stored in the update history
+        obj = self.runDict[mirrorId]
+        cpuTime, ioRead, ioWrite = self._getRunTotal(obj)
+        return {
+            "cpu-time": round(cpuTime, 2),
+            "rss-max": obj.rssMax,
+            "io-read": ioRead,
+            "io-write": ioWrite,
+            "fd-max": obj.fdMax,
+        }
+
+    def getSampleList(self, mirrorId):
+        # returns empty list if the mirror site has never been run
+        return list(self.sampleDict.get(mirrorId, []))
+
+    def _threadFunc(self):
+        tick = 0
+        while True:
+            with self.cond:
+                while not self.bStop and len(self.runDict) == 0:
+                    self.cond.wait()
+                deadline = time.monotonic() + self.NET_INTERVAL
+                while not self.bStop and time.monotonic() < deadline:
+                    self.cond.wait(deadline - time.monotonic())
+                if self.bStop:
+                    return
+                runList = list(self.runDict.items())
+
+            tick += 1
+            bFull = (tick % (self.INTERVAL // self.NET_INTERVAL) == 0)
+            try:
+                GLib.idle_add(self._sampled, self._sample(runList, bFull), bFull)
+            except Exception:
+                logging.error("Sampling updater processes failed.", exc_info=True)
+
+    def _sample(self, runList, bFull):
+        # called in sampling thread, processes are sampled only if bFull is True
+        # returns dict<mirror-id,(run-object,(proc-dict,rss,fds)|None,sock-dict|None)>
+        ret = dict()
+        trafficDict = None
+        for mirrorId, obj in runList:
+            procData = None
+            inodeSet = set()
+            if bFull:
+                rss = 0
+                fdCount = 0
+                procDict = dict()
+                for pid in self._getPidList(obj):
+                    usage = McUtil.getProcessResourceUsage(pid)
+                    fdInfo = McUtil.getProcessFdInfo(pid)
+                    if usage is None or fdInfo is None:
+                        continue                # process has exited
+                    procDict[(pid, usage[0])] = (usage[1], usage[3], usage[4])
+                    rss += usage[2]
+                    fdCount += fdInfo[0]
+                    inodeSet |= fdInfo[1]
+                procData = (procDict, rss, fdCount)
+
+            sockDict = None
+            if self.bNetAvailable and obj.cgroupId is not None and self.bCgroupFilter:
+                try:
+                    sockDict = {k: (v[1], v[2]) for k, v in McUtil.getTcpSocketTraffic(obj.cgroupId).items()}
+                except OSError as e:
+                    if e.errno != errno.EINVAL:
+                        raise
+                    self.bCgroupFilter = False
+                    logging.warning("sock_diag can not filter sockets by cgroup (linux < 5.9), network traffic of updaters is sampled every %d seconds." % (self.INTERVAL))
+            if self.bNetAvailable and sockDict is None and bFull:
+                if trafficDict is None:
+                    try:
+                        trafficDict = McUtil.getTcpSocketTraffic()
+                    except OSError as e:
+                        self.bNetAvailable = False
+                        logging.warning("Network traffic of updaters is not accounted, sock_diag is not available (%s)." % (e))
+                if trafficDict is not None:
+                    sockDict = {k: (v[1], v[2]) for k, v in trafficDict.items() if v[0] in inodeSet}
+
+            ret[mirrorId] = (obj, procData, sockDict)
+        return ret
+
+    def _sampled(self, resultDict, bFull):
+        # called in main thread
+        if self.bStop:
+            return False
+        curTime = time.time()
+        for mirrorId, (obj, procData, sockDict) in resultDict.items():
+            if self.runDict.get(mirrorId) is not obj:
+                continue                        # run ended during sampling
+
+            if procData is not None:
+                procDict, rss, fdCount = procData
+                for key, value in obj.procDict.items():
+                    if key not in procDict:
+                        obj.exitedCpuTime += value[0]
+                        obj.exitedIoRead += value[1]
+                        obj.exitedIoWrite += value[2]
+                obj.procDict = procDict
+                obj.rssMax = max(obj.rssMax, rss)
+                obj.fdMax = max(obj.fdMax, fdCount)
+
+            if sockDict is not None:
+                for cookie, value in obj.sockDict.items():
+                    if cookie not in sockDict:
+                        obj.closedRx += value[0]
+                        obj.closedTx += value[1]
+                obj.sockDict = sockDict
+
+            if bFull:
+                cpuTime, ioRead, ioWrite = self._getRunTotal(obj)
+                rx, tx = self.getRunTraffic(mirrorId)
+                self.sampleDict[mirrorId].append((curTime, cpuTime, rss, ioRead, ioWrite, fdCount, rx, tx))
+        return False
+
+    def _getRunTotal(self, obj):
+        # returns (cpu-time,io-read,io-write)
+        return (obj.exitedCpuTime + sum([x[0] for x in obj.procDict.values()]),
+                obj.exitedIoRead + sum([x[1] for x in obj.procDict.values()]),
+                obj.exitedIoWrite + sum([x[2] for x in obj.procDict.values()]))
+
+    def _getPidList(self, obj):
+        if obj.cgroupPath is not None:
+            return self.cgroupManager.getPidList(obj.cgroupPath)
+        try:
+            return [obj.pid] + [x.pid for x in psutil.Process(obj.pid).children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return []
+
+
 class _IdleInvoker:
 
     def __init__(self):
@@ -554,197 +1250,564 @@ class _IdleInvoker:
         return False
 
 
-class _Scheduler:
+class _AdvertiseDebouncer:
 
-    def __init__(self):
-        self.jobDict = OrderedDict()            # dict<id,(type,param,callback)>
-        self.jobInfoDict = dict()               # dict<id,[lastSchedDatetime,nextSchedDatetime]>
-        self.nextDatetime = datetime.max
-        self.timeoutHandler = None
+    """
+    Mirror sites are advertised in batches, one batch for each advertiser, when no more mirror
+    site comes in for QUIET_TIME, or MAX_DELAY after the first one comes in. So a burst of mirror
+    sites (at startup, or after a reload) costs each advertiser one config generation and one
+    server reload, instead of one for each mirror site.
+    Advertisers without advertise_mirror_sites() are called for each mirror site.
+    """
 
-    def dispose(self):
-        if self.timeoutHandler is not None:
-            GLib.source_remove(self.timeoutHandler)
-            self.timeoutHandler = None
-        self.nextDatetime = datetime.max
-        self.jobInfoDict = dict()
-        self.jobDict = OrderedDict()
-
-    def addCronJob(self, jobId, lastSchedDatetime, cronExpr, jobCallback):
-        assert jobId not in self.jobDict
-        now = datetime.now()
-        self.jobDict[jobId] = ("cron", croniter(cronExpr, now, datetime), jobCallback)
-        self.jobInfoDict[jobId] = [lastSchedDatetime, self.__cronGetNextDatetime(now, self.jobDict[jobId][1])]
-        self._timeoutMayBecomeEarly(jobId, now)
+    QUIET_TIME = 0.5            # seconds
+    MAX_DELAY = 5               # seconds
 
-    def addIntervalJob(self, jobId, lastSchedDatetime, interval, jobCallback):
-        assert jobId not in self.jobDict
-        now = datetime.now()
-        self.jobDict[jobId] = ("interval", interval, jobCallback)
-        self.jobInfoDict[jobId] = [lastSchedDatetime, self.__intervalGetNextDatetime(now, lastSchedDatetime, interval)]
-        self._timeoutMayBecomeEarly(jobId, now)
-
-    def pauseJobUntil(self, jobId, untilDatetime):
-        assert jobId in self.jobDict
-        if untilDatetime > self.jobInfoDict[jobId][1]:
-            self.jobInfoDict[jobId][1] = untilDatetime
-            self._timeoutMayBecomeLate()
-
-    def triggerJobAt(self, jobId, triggerDatetime):
-        assert jobId in self.jobDict
-        if triggerDatetime < self.jobInfoDict[jobId][1]:
-            self.jobInfoDict[jobId][1] = triggerDatetime
-            self._timeoutMayBecomeEarly(jobId, datetime.now())
-            return True
+    def __init__(self, param):
+        self.param = param
+        self.pendingDict = dict()                       # dict<advertiser-name,list<mirror-id>>
+        self.firstTime = None
+        self.timer = None
+
+    def dispose(self):
+        if self.timer is not None:
+            GLib.source_remove(self.timer)
+            self.timer = None
+        self.pendingDict = dict()
+
+    def add(self, name, mirrorSiteId):
+        self.pendingDict.setdefault(name, []).append(mirrorSiteId)
+        if self.timer is not None:
+            GLib.source_remove(self.timer)
         else:
-            return False
+            self.firstTime = time.monotonic()
+        delay = min(self.QUIET_TIME, self.firstTime + self.MAX_DELAY - time.monotonic())
+        self.timer = GLib.timeout_add(max(0, int(delay * 1000)), self._timerCallback)
+
+    def cancel(self, mirrorSiteId):
+        for name in list(self.pendingDict.keys()):
+            if mirrorSiteId in self.pendingDict[name]:
+                self.pendingDict[name].remove(mirrorSiteId)
+                if len(self.pendingDict[name]) == 0:
+                    del self.pendingDict[name]
+
+    def _timerCallback(self):
+        self.timer = None
+        pendingDict = self.pendingDict
+        self.pendingDict = dict()
+        for name, msIdList in sorted(pendingDict.items()):
+            obj = self.param.advertiserDict[name]
+            try:
+                if hasattr(obj, "advertise_mirror_sites"):
+                    obj.advertise_mirror_sites(msIdList)
+                else:
+                    for msId in msIdList:
+                        obj.advertise_mirror_site(msId)
+                logging.info("Advertiser \"%s\" advertised mirror sites %s." % (name, ",".join(msIdList)))
+            except Exception:
+                logging.error("Advertiser \"%s\" failed to advertise mirror sites %s." % (name, ",".join(msIdList)), exc_info=True)
+        return False
 
-    def triggerJobNow(self, jobId):
-        assert jobId in self.jobDict
-        self._execJob(jobId, datetime.now())
-        self._timeoutMayBecomeLate()
 
-    def getJobLastSchedDatetime(self, jobId):
-        assert jobId in self.jobDict
-        return self.jobInfoDict[jobId][0]
+class _LoadShedder:
 
-    def getJobNextSchedDatetime(self, jobId):
-        assert jobId in self.jobDict
-        return self.jobInfoDict[jobId][1]
+    """
+    Watches the serving load, which is the outgoing throughput of the network interfaces
+    and the number of established connections on the ports of the main advertiser and the
+    advertisers. When any of them reaches its high threshold, the running initializers and
+    updaters are paused, and the scheduled updates are deferred. They are resumed after all
+    of them have stayed below their low thresholds for "resumeDelay" seconds.
+    """
 
-    def _timeoutMayBecomeLate(self):
-        m = min([x[1] for x in self.jobInfoDict.values()])
-        if m > self.nextDatetime:
-            self.__updateTimeout(datetime.now(), m)
+    def __init__(self, cfg, param, scheduler, updaterDict, invoker):
+        self.cfg = cfg
+        self.param = param
+        self.scheduler = scheduler
+        self.updaterDict = updaterDict
+        self.invoker = invoker
 
-    def _timeoutMayBecomeEarly(self, jobId, curDatetime):
-        if self.jobInfoDict[jobId][1] < self.nextDatetime:
-            self.__updateTimeout(curDatetime, self.jobInfoDict[jobId][1])
+        self.bOverloaded = False
+        self.lowSince = None                            # monotonic time since when the load is low
+        self.lastTxBytes = None
+        self.lastTime = None
+        self.deferredJobDict = dict()                   # dict<mirror-id,original-sched-datetime>
+        self.waiterDict = dict()                        # dict<mirror-id,func>
 
-    def _jobCallback(self):
-        now = datetime.now()
+        self.timer = None
+        if self.cfg["bandwidthHigh"] is not None or self.cfg["connectionHigh"] is not None:
+            self.timer = GLib.timeout_add_seconds(self.cfg["interval"], self._timerCallback)
 
-        # execute jobs
-        bExecuted = False
-        for jobId in self.jobDict:
-            if self.jobInfoDict[jobId][1] <= now:
-                bExecuted = True
-                self._execJob(jobId, self.jobInfoDict[jobId][1])
-        assert bExecuted
+    def dispose(self):
+        if self.timer is not None:
+            GLib.source_remove(self.timer)
+            self.timer = None
+        self.waiterDict = dict()
 
-        # recalculate timeout
-        m = min([x[1] for x in self.jobInfoDict.values()])
-        assert m > self.nextDatetime
-        self.__updateTimeout(now, m)
+    def isOverloaded(self):
+        return self.bOverloaded
 
-        return False
+    def addWaiter(self, mirrorId, func):
+        # func is called when the load becomes low
+        self.waiterDict[mirrorId] = func
 
-    def _execJob(self, jobId, curDatetime):
-        # execute job
-        self.jobDict[jobId][2](curDatetime)
+    def hasWaiter(self, mirrorId):
+        return mirrorId in self.waiterDict
 
-        # record last sched time
-        self.jobInfoDict[jobId][0] = curDatetime
+    def removeMirrorSite(self, mirrorId):
+        self.deferredJobDict.pop(mirrorId, None)
+        self.waiterDict.pop(mirrorId, None)
 
-        # calculate next sched time
-        if self.jobDict[jobId][0] == "cron":
-            self.jobInfoDict[jobId][1] = self.__cronGetNextDatetime(curDatetime, self.jobDict[jobId][1])
-        elif self.jobDict[jobId][0] == "interval":
-            self.jobInfoDict[jobId][1] = self.__intervalGetNextDatetime(curDatetime, self.jobInfoDict[jobId][0], self.jobDict[jobId][1])
+    def _timerCallback(self):
+        try:
+            self._check()
+        except Exception:
+            logging.error("Checking serving load failed.", exc_info=True)
+        return True
+
+    def _check(self):
+        curTime = time.monotonic()
+        bHigh, bLow, desc = self._getLoad(curTime)
+        if not self.bOverloaded:
+            if bHigh:
+                self.bOverloaded = True
+                self.lowSince = None
+                logging.warning("Serving load is high (%s), updaters are paused." % (desc))
+        elif not bLow:
+            self.lowSince = None
+        elif self.lowSince is None:
+            self.lowSince = curTime
+        elif curTime - self.lowSince >= self.cfg["resumeDelay"]:
+            self.bOverloaded = False
+            self.lowSince = None
+            logging.info("Serving load is low (%s), updaters are resumed." % (desc))
+            self._resumeAll()
+
+        # initializers and updaters started by force are paused as well
+        if self.bOverloaded:
+            self._pauseAll()
+
+    def _getLoad(self, curTime):
+        # returns (reaches-high-threshold,below-low-threshold,description)
+        bHigh, bLow, descList = False, True, []
+
+        if self.cfg["bandwidthHigh"] is not None:
+            txBytes = McUtil.getInterfaceTxBytes(self.cfg["interfaces"])
+            if self.lastTxBytes is not None:
+                rate = max(0, txBytes - self.lastTxBytes) / max(0.001, curTime - self.lastTime)
+                bHigh = bHigh or rate >= self.cfg["bandwidthHigh"]
+                bLow = bLow and rate < self.cfg["bandwidthLow"]
+                descList.append("%d KiB/s sent" % (rate // 1024))
+            else:
+                bLow = False                            # no rate for the first sample
+            self.lastTxBytes = txBytes
+            self.lastTime = curTime
+
+        if self.cfg["connectionHigh"] is not None:
+            portList = [self.param.mainPort]
+            for obj in self.param.advertiserDict.values():
+                if obj.get_port() is not None:
+                    portList.append(obj.get_port())
+            count = McUtil.getTcpConnectionCount(portList)
+            bHigh = bHigh or count >= self.cfg["connectionHigh"]
+            bLow = bLow and count < self.cfg["connectionLow"]
+            descList.append("%d connections" % (count))
+
+        return (bHigh, bLow, ", ".join(descList))
+
+    def _pauseAll(self):
+        for updater in self.updaterDict.values():
+            if updater.status in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING]:
+                if not updater.bPaused:
+                    updater.pause()
+
+        # defer the updates which are due before the next check
+        untilDatetime = datetime.now() + timedelta(seconds=self.cfg["interval"] * 2)
+        for jobId in list(self.scheduler.jobDict):
+            schedDatetime = self.scheduler.getJobNextSchedDatetime(jobId)
+            if schedDatetime < untilDatetime:
+                self.deferredJobDict.setdefault(jobId, schedDatetime)
+                self.scheduler.pauseJobUntil(jobId, untilDatetime)
+
+    def _resumeAll(self):
+        for updater in self.updaterDict.values():
+            if updater.status in [McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_INITING, McMirrorSiteUpdater.MIRROR_SITE_UPDATE_STATUS_UPDATING]:
+                if updater.bPaused:
+                    updater.resume()
+
+        # deferred updates are admitted by the admission queue, so they don't start all at once
+        curDatetime = datetime.now()
+        for jobId, schedDatetime in self.deferredJobDict.items():
+            if jobId in self.scheduler.jobDict:
+                self.scheduler.triggerJobAt(jobId, max(curDatetime, schedDatetime))
+        self.deferredJobDict = dict()
+
+        for func in self.waiterDict.values():
+            self.invoker.addCallback(func)
+        self.waiterDict = dict()
+
+
+class _CircuitBreaker:
+
+    """
+    Tracks consecutive failures of the mirror sites sharing one upstream.
+    The breaker opens after "threshold" consecutive failures, no mirror site of
+    that upstream is started until the cooldown passes. Then one mirror site
+    is let through as a probe, the breaker closes if the probe succeeds,
+    otherwise it opens again with a doubled cooldown.
+    """
+
+    STATE_CLOSED = 0
+    STATE_OPEN = 1
+    STATE_HALF_OPEN = 2
+
+    def __init__(self, cfg, invoker):
+        self.threshold = cfg["threshold"]
+        self.cooldown = cfg["cooldown"]                 # unit: seconds
+        self.maxCooldown = cfg["maxCooldown"]           # unit: seconds
+        self.invoker = invoker
+        self.upstreamDict = dict()                      # dict<upstream-id,state-object>, only for the failing upstreams
+        self.waiterDict = dict()                        # dict<upstream-id,dict<mirror-id,func>>
+
+    def isAllowed(self, upstreamId, mirrorId):
+        obj = self.upstreamDict.get(upstreamId)
+        if obj is None or obj.state == self.STATE_CLOSED:
+            return True
+
+        now = datetime.now()
+        if obj.state == self.STATE_OPEN:
+            if now < obj.openUntil:
+                return False
+        elif obj.state == self.STATE_HALF_OPEN:
+            if obj.probeMirrorId == mirrorId:
+                return True
+            if now - obj.probeSince < timedelta(seconds=self.maxCooldown):
+                return False                            # probe is not finished
         else:
             assert False
 
-    def __updateTimeout(self, curDatetime, nextDatetime):
-        if self.timeoutHandler is not None:
-            GLib.source_remove(self.timeoutHandler)
-        self.nextDatetime = nextDatetime
-        interval = math.ceil((nextDatetime - curDatetime).total_seconds())
-        interval = max(interval, 1)
-        self.timeoutHandler = GLib.timeout_add_seconds(interval, self._jobCallback)
-
-    def __cronGetNextDatetime(self, curDatetime, croniterIter):
-        while croniterIter.get_current() <= curDatetime:
-            croniterIter.get_next()
-        return croniterIter.get_current()
-
-    def __intervalGetNextDatetime(self, curDatetime, lastSchedTime, interval):
-        if lastSchedTime is None:
-            return curDatetime
-        else:
-            return max(lastSchedTime + interval, curDatetime)
+        # let this mirror site probe the upstream
+        obj.state = self.STATE_HALF_OPEN
+        obj.probeMirrorId = mirrorId
+        obj.probeSince = now
+        logging.info("Upstream \"%s\" is probed by mirror site \"%s\"." % (upstreamId, mirrorId))
+        return True
+
+    def dispose(self):
+        self.waiterDict = dict()
+
+    def getOpenUntil(self, upstreamId):
+        # returns None if the breaker is not open
+        obj = self.upstreamDict.get(upstreamId)
+        if obj is not None and obj.state == self.STATE_OPEN:
+            return obj.openUntil
+        return None
+
+    def addWaiter(self, upstreamId, mirrorId, func):
+        # func is called when the breaker closes
+        self.waiterDict.setdefault(upstreamId, dict())[mirrorId] = func
+
+    def removeWaiter(self, mirrorId):
+        for upstreamId in list(self.waiterDict):
+            self.waiterDict[upstreamId].pop(mirrorId, None)
+            if len(self.waiterDict[upstreamId]) == 0:
+                del self.waiterDict[upstreamId]
+
+    def recordSuccess(self, upstreamId):
+        obj = self.upstreamDict.pop(upstreamId, None)
+        if obj is not None and obj.state != self.STATE_CLOSED:
+            logging.info("Upstream \"%s\" is available again." % (upstreamId))
+        for func in self.waiterDict.pop(upstreamId, dict()).values():
+            self.invoker.addCallback(func)
+
+    def recordFailure(self, upstreamId, mirrorId):
+        obj = self.upstreamDict.get(upstreamId)
+        if obj is None:
+            obj = DynObject()
+            obj.state = self.STATE_CLOSED
+            obj.failureCount = 0
+            obj.cooldown = self.cooldown
+            self.upstreamDict[upstreamId] = obj
+        obj.failureCount += 1
+
+        if obj.state == self.STATE_HALF_OPEN and obj.probeMirrorId == mirrorId:
+            obj.cooldown = min(obj.cooldown * 2, self.maxCooldown)
+            self._open(upstreamId, obj)
+        elif obj.state == self.STATE_CLOSED and obj.failureCount >= self.threshold:
+            self._open(upstreamId, obj)
+
+    def _open(self, upstreamId, obj):
+        obj.state = self.STATE_OPEN
+        obj.openUntil = datetime.now() + timedelta(seconds=obj.cooldown)
+        obj.probeMirrorId = None
+        obj.probeSince = None
+        logging.warning("Upstream \"%s\" failed %d times in a row, mirror sites using it are held for %d seconds." % (upstreamId, obj.failureCount, obj.cooldown))
+
+
+class _AdmissionQueue:
+
+    """
+    Limits the number of initializers and updaters running at the same time.
+    There are a global limit, per-storage-type limits and per-plugin limits.
+    Jobs that can not be admitted wait in a priority queue, job with smaller
+    priority value is admitted first, jobs with the same priority are admitted
+    in FIFO order.
+    """
+
+    PRIORITY_MANUAL = 0
+    PRIORITY_INIT = 1
+    PRIORITY_SCHEDULED = 2
+
+    def __init__(self, limitDict, invoker):
+        self.invoker = invoker
+        self.globalLimit = limitDict["global"]          # None means no limit
+        self.storageLimitDict = limitDict["storage"]    # dict<storage-name,limit>
+        self.pluginLimitDict = limitDict["plugin"]      # dict<plugin-name,limit>
+
+        self.runningDict = dict()                       # dict<mirror-id,mirror-site>
+        self.storageCountDict = dict()                  # dict<storage-name,running-count>
+        self.pluginCountDict = dict()                   # dict<plugin-name,running-count>
+
+        self.waitingDict = dict()                       # dict<mirror-id,[priority,seq,mirror-site,enqueueDatetime,startFunc]>
+        self.waitingHeap = []                           # list<(priority,seq,mirror-id)>, items not matching waitingDict are stale
+        self.seq = 0
+        self.bDisposed = False
+
+    def dispose(self):
+        self.bDisposed = True
+        self.waitingHeap = []
+        self.waitingDict = dict()
+
+    def isRunning(self, mirrorId):
+        return mirrorId in self.runningDict
+
+    def isWaiting(self, mirrorId):
+        return mirrorId in self.waitingDict
+
+    def getQueueDepth(self):
+        return len(self.waitingDict)
+
+    def getWaitSeconds(self, mirrorId):
+        assert mirrorId in self.waitingDict
+        return int((datetime.now() - self.waitingDict[mirrorId][3]).total_seconds())
+
+    def submit(self, mirrorSite, priority, startFunc):
+        assert mirrorSite.id not in self.runningDict
+        assert mirrorSite.id not in self.waitingDict
+
+        self.seq += 1
+        self.waitingDict[mirrorSite.id] = [priority, self.seq, mirrorSite, datetime.now(), startFunc]
+        heapq.heappush(self.waitingHeap, (priority, self.seq, mirrorSite.id))
+        self._dispatch()
+        if mirrorSite.id in self.waitingDict:
+            logging.info("Mirror site \"%s\" is waiting to be admitted, %d jobs in queue." % (mirrorSite.id, len(self.waitingDict)))
+
+    def promote(self, mirrorId, priority):
+        item = self.waitingDict.get(mirrorId)
+        if item is None or item[0] <= priority:
+            return
+        self.seq += 1
+        item[0] = priority
+        item[1] = self.seq
+        heapq.heappush(self.waitingHeap, (priority, self.seq, mirrorId))       # the old heap item becomes stale
+        self._dispatch()
+
+    def cancel(self, mirrorId):
+        # heap item becomes stale
+        self.waitingDict.pop(mirrorId, None)
+
+    def release(self, mirrorId):
+        mirrorSite = self.runningDict.pop(mirrorId)
+        for st in mirrorSite.storageDict:
+            self.storageCountDict[st] -= 1
+        self.pluginCountDict[mirrorSite.pluginName] -= 1
+
+        # start waiting jobs after the caller has finished its own business
+        if len(self.waitingDict) > 0:
+            self.invoker.addCallback(self._dispatch)
+
+    def _dispatch(self):
+        if self.bDisposed:
+            return
+
+        blockedList = []
+        while len(self.waitingHeap) > 0:
+            if self.globalLimit is not None and len(self.runningDict) >= self.globalLimit:
+                break
+
+            priority, seq, mirrorId = heapq.heappop(self.waitingHeap)
+            item = self.waitingDict.get(mirrorId)
+            if item is None or item[1] != seq:
+                continue
+            if not self._hasFreeSlot(item[2]):
+                blockedList.append((priority, seq, mirrorId))
+                continue
+
+            del self.waitingDict[mirrorId]
+            self.runningDict[mirrorId] = item[2]
+            for st in item[2].storageDict:
+                self.storageCountDict[st] = self.storageCountDict.get(st, 0) + 1
+            self.pluginCountDict[item[2].pluginName] = self.pluginCountDict.get(item[2].pluginName, 0) + 1
+            item[4]()
+
+        for item in blockedList:
+            heapq.heappush(self.waitingHeap, item)
+
+    def _hasFreeSlot(self, mirrorSite):
+        for st in mirrorSite.storageDict:
+            if st in self.storageLimitDict and self.storageCountDict.get(st, 0) >= self.storageLimitDict[st]:
+                return False
+        if mirrorSite.pluginName in self.pluginLimitDict:
+            if self.pluginCountDict.get(mirrorSite.pluginName, 0) >= self.pluginLimitDict[mirrorSite.pluginName]:
+                return False
+        return True
+
+
+class _Scheduler(McScheduler):
+
+    def _addTimer(self, seconds, func):
+        return GLib.timeout_add_seconds(seconds, func)
+
+    def _removeTimer(self, timer):
+        GLib.source_remove(timer)
 
 
 class _UpdateHistory:
 
-    def __init__(self, updateHistoryFilename, needInitialization=True):
-        self._updateFn = updateHistoryFilename
-        self._needInit = needInitialization
-        self._maxLen = 10
+    """
+    Update history is stored in "<updateHistoryFilename>.jsonl" as an append-only record log.
+    Legacy history file is converted on first use.
+    A read-only history is for tools running beside the daemon, nothing is converted or created.
+    """
 
-        if not self._needInit:
-            McUtil.touchFile(self._updateFn)
+    def __init__(self, updateHistoryFilename, needInitialization=True, bReadOnly=False):
+        self._legacyFn = updateHistoryFilename
+        self._needInit = needInitialization
+        self._maxLen = 50                       # number of successful updates used for duration prediction
+        self._maxRecordCount = 10000
 
-        self._updateInfoList = []
-        self._readFromFile()
+        self._log = RecordLogFile(updateHistoryFilename + ".jsonl", self._recordKey, self._maxRecordCount, bReadOnly)
+        if not self._log.exists() and not bReadOnly:
+            if os.path.exists(self._legacyFn):
+                self._migrateFromLegacyFile()
+            elif not self._needInit:
+                self._log.create()
 
-        self._averageUpdateDuration = None      # unit: seconds
-        self._calcAverageDuration()
+        self._lastRecord = None                 # loaded on demand
+        self._durationList = None               # loaded on demand, sorted, unit: seconds
 
     def isInitialized(self):
-        return os.path.exists(self._updateFn)
+        if self._log.bReadOnly and not self._needInit:
+            return True                         # created on first use
+        return self._log.exists()
 
     def getLastUpdateInfo(self):
-        if len(self._updateInfoList) > 0:
-            # list order: from old to new
-            return self._updateInfoList[-1]
-        else:
-            return None
+        if self._lastRecord is None:
+            tlist = self._log.getLast(1)
+            if len(tlist) > 0:
+                self._lastRecord = self._recordToObj(tlist[0])
+        return self._lastRecord
 
-    def getAverageUpdateDuration(self):
-        return self._averageUpdateDuration
+    def getLastUpdateInfoList(self, n):
+        # list order: from old to new
+        return [self._recordToObj(x) for x in self._log.getLast(n)]
 
-    def initFinished(self, endTime):
-        assert self._needInit
-        assert len(self._updateInfoList) == 0
+    def getUpdateInfoListBetween(self, startDatetime, endDatetime):
+        # returns records whose end time is in [startDatetime, endDatetime], list order: from old to new
+        return [self._recordToObj(x) for x in self._log.getBetween(startDatetime.timestamp(), endDatetime.timestamp())]
 
-        # add init-item
-        obj = DynObject()
-        obj.bSuccess = True
-        obj.startTime = None
-        obj.endTime = endTime
-        self._updateInfoList.append(obj)
-
-        # save to file
-        self._saveToFile()
-
-    def updateFinished(self, bSuccess, startTime, endTime):
-        # remove init-item
-        if len(self._updateInfoList) > 0 and self._updateInfoList[-1].startTime is None:
-            assert len(self._updateInfoList) == 1
-            self._updateInfoList = []
-
-        # remove update-failed-item
-        # we only store the last one update-failed-item
-        if len(self._updateInfoList) > 0 and not self._updateInfoList[-1].bSuccess:
-            del self._updateInfoList[-1]
-
-        # add update-item
-        obj = DynObject()
-        obj.bSuccess = bSuccess
-        obj.startTime = startTime
-        obj.endTime = endTime
-        self._updateInfoList.append(obj)
+    def getAverageUpdateDuration(self):
+        # unit: seconds, returns None if there's no successful update
+        durationList = self._getDurationList()
+        if len(durationList) > 0:
+            return int(statistics.mean(durationList))
+        else:
+            return None
 
-        # keep list length
-        while len(self._updateInfoList) >= self._maxLen:
-            self._updateInfoList.pop(0)
+    def getUpdateDurationPercentile(self, percent):
+        # unit: seconds, linear interpolation between the closest ranks of the recent successful updates
+        # returns None if there's no successful update
+        durationList = self._getDurationList()
+        if len(durationList) == 0:
+            return None
+        pos = (len(durationList) - 1) * percent / 100
+        i = int(pos)
+        if i + 1 < len(durationList):
+            return int(durationList[i] + (durationList[i + 1] - durationList[i]) * (pos - i))
+        else:
+            return int(durationList[i])
 
-        # post processing
-        self._calcAverageDuration()
-        self._saveToFile()
+    def getNetworkTotal(self):
+        # returns (bytes-received, bytes-sent) of all the recorded runs
+        obj = self.getLastUpdateInfo()
+        if obj is not None and obj.netRxTotal is not None:
+            return (obj.netRxTotal, obj.netTxTotal)
+        else:
+            return (0, 0)
 
-    def _readFromFile(self):
-        lineList = McUtil.readFile(self._updateFn, defaultContent="").split("\n")
+    def initFinished(self, endTime, upstreamId=None, netRx=None, netTx=None, usage=None):
+        assert self._needInit
+        assert self._log.getCount() == 0
+
+        if not self._log.exists():
+            self._log.create()
+        self._append(True, None, endTime, 0, None, None, upstreamId, netRx, netTx, usage)
+
+    def updateFinished(self, bSuccess, startTime, endTime, exitCode=None, bytesTransferred=None, filesChanged=None, upstreamId=None, netRx=None, netTx=None, usage=None):
+        self._append(bSuccess, startTime, endTime, exitCode, bytesTransferred, filesChanged, upstreamId, netRx, netTx, usage)
+        self._durationList = None
+
+    def _append(self, bSuccess, startTime, endTime, exitCode, bytesTransferred, filesChanged, upstreamId, netRx=None, netTx=None, usage=None):
+        # network totals are carried by every record, so that they survive compaction
+        rxTotal, txTotal = self.getNetworkTotal()
+        record = {
+            "start": startTime.strftime(McUtil.stdTmFmt()) if startTime is not None else None,
+            "end": endTime.strftime(McUtil.stdTmFmt()),
+            "success": bSuccess,
+            "exit-code": exitCode,
+            "bytes": bytesTransferred,
+            "files-changed": filesChanged,
+            "upstream": upstreamId,
+            "net-rx": netRx,
+            "net-tx": netTx,
+            "net-rx-total": rxTotal + (netRx or 0),
+            "net-tx-total": txTotal + (netTx or 0),
+            "usage": usage,                     # resource usage summary, see _ProcessSampler.getRunUsage()
+        }
+        self._log.append(record)
+        self._lastRecord = self._recordToObj(record)
+
+    def _getDurationList(self):
+        if self._durationList is None:
+            # init-item and update-failed-item are not used, at most 4 times of records are read
+            tlist = self._log.getLast(self._maxLen * 4)
+            tlist = [self._recordToObj(x) for x in tlist]
+            tlist = [x for x in tlist if x.startTime is not None and x.bSuccess][-self._maxLen:]
+            self._durationList = sorted([max(0, (x.endTime - x.startTime).total_seconds()) for x in tlist])
+        return self._durationList
+
+    def _recordKey(self, record):
+        return datetime.strptime(record["end"], McUtil.stdTmFmt()).timestamp()
+
+    def _recordToObj(self, record):
+        obj = DynObject()
+        obj.bSuccess = record["success"]
+        obj.startTime = datetime.strptime(record["start"], McUtil.stdTmFmt()) if record["start"] is not None else None
+        obj.endTime = datetime.strptime(record["end"], McUtil.stdTmFmt())
+        obj.exitCode = record.get("exit-code")
+        obj.bytesTransferred = record.get("bytes")
+        obj.filesChanged = record.get("files-changed")
+        obj.upstreamId = record.get("upstream")
+        obj.netRx = record.get("net-rx")
+        obj.netTx = record.get("net-tx")
+        obj.netRxTotal = record.get("net-rx-total")
+        obj.netTxTotal = record.get("net-tx-total")
+        obj.usage = record.get("usage")
+        return obj
+
+    def _migrateFromLegacyFile(self):
+        # legacy file is a text file, one update in each line, columns are: is-successful, start-time, end-time
+        self._log.create()
+        lineList = McUtil.readFile(self._legacyFn, defaultContent="").split("\n")
         for i in range(0, len(lineList)):
             if lineList[i].strip() == "" or lineList[i].startswith("#"):
                 continue
@@ -752,47 +1815,23 @@ class _UpdateHistory:
                 m = re.fullmatch(" *(\\S+) +(\\S+ \\S+) +(\\S+ \\S+) *", lineList[i])
                 if m is None:
                     raise ValueError()
-                obj = DynObject()
                 # column 1
                 if m.group(1) == "true":
-                    obj.bSuccess = True
+                    bSuccess = True
                 elif m.group(1) == "false":
-                    obj.bSuccess = False
+                    bSuccess = False
                 else:
                     raise ValueError()
                 # column 2
                 if m.group(2) == "none":
-                    obj.startTime = None
+                    startTime = None
                 else:
-                    obj.startTime = datetime.strptime(m.group(2), McUtil.stdTmFmt())
+                    startTime = datetime.strptime(m.group(2), McUtil.stdTmFmt())
                 # column 3
-                obj.endTime = datetime.strptime(m.group(3), McUtil.stdTmFmt())
+                endTime = datetime.strptime(m.group(3), McUtil.stdTmFmt())
                 # record data
-                self._updateInfoList.append(obj)
+                self._append(bSuccess, startTime, endTime, None, None, None, None)
             except ValueError:
-                logging.warning("Line %d is invalid in file \"%s\"." % (i + 1, self._updateFn))
+                logging.warning("Line %d is invalid in file \"%s\"." % (i + 1, self._legacyFn))
                 logging.warning(lineList[i])
-
-    def _saveToFile(self):
-        with open(self._updateFn, "w") as f:
-            f.write("# is-successful             start-time             end-time\n")
-            for item in self._updateInfoList:
-                if item.bSuccess:
-                    f.write("  true                    ")
-                else:
-                    f.write("  false                   ")
-                if item.startTime is None:
-                    f.write("  none                   ")
-                else:
-                    f.write("  " + item.startTime.strftime(McUtil.stdTmFmt()) + "    ")
-                if True:
-                    f.write(item.endTime.strftime(McUtil.stdTmFmt()) + "\n")
-
-    def _calcAverageDuration(self):
-        tlist = [x for x in self._updateInfoList if x.startTime is not None and x.bSuccess]     # remove init-item and update-failed-item
-        if len(tlist) > 0:
-            tlist = [(x.endTime - x.startTime).total_seconds() // 60 for x in tlist]
-            self._averageUpdateDuration = statistics.mean(tlist)
-            self._averageUpdateDuration = min(1, int(self._averageUpdateDuration))
-        else:
-            self._averageUpdateDuration = 1
+        os.unlink(self._legacyFn)
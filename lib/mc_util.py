@@ -12,6 +12,7 @@ import prctl
 import ctypes
 import struct
 import shutil
+import signal
 import random
 import psutil
 import socket
@@ -312,47 +313,32 @@ class McUtil:
             else:
                 assert False
 
-    @staticmethod
-    def getFreeSocketPort(portType):
-        if portType == "tcp":
-            stlist = [socket.SOCK_STREAM]
-        elif portType == "udp":
-            stlist = [socket.SOCK_DGRAM]
-        elif portType == "tcp+udp":
-            stlist = [socket.SOCK_STREAM, socket.SOCK_DGRAM]
-        else:
-            assert False
-
-        for port in range(10000, 65536):
-            bFound = True
-            for sType in stlist:
-                s = socket.socket(socket.AF_INET, sType)
-                try:
-                    s.bind((('', port)))
-                except socket.error:
-                    bFound = False
-                finally:
-                    s.close()
-            if bFound:
-                return port
-
-        raise Exception("no valid port")
-
     @staticmethod
     def waitSocketPortForProc(portType, ip, port, proc, timeout=10):
+        # tcp port is probed by connecting to it, which is much cheaper than enumerating all the sockets in the system
         assert portType in ["tcp", "udp"]
-        for i in range(0, timeout*10):
+        if ip == "0.0.0.0":
+            ip = "127.0.0.1"
+        elif ip == "::":
+            ip = "::1"
+
+        deadline = time.monotonic() + timeout
+        while True:
             if proc.poll() is not None:
                 raise Exception("process terminated")
-            time.sleep(0.1)
-            for c in psutil.net_connections(kind=portType):
-                # if c.pid == proc.pid and c.status == "LISTEN":        # FIXME: for apache, c.pid is wrong, result of netstat is right
-                if c.status == "LISTEN":
-                    if c.family == socket.AF_INET and c.laddr[0] == ip and c.laddr[1] == port:
-                        return
-                    if ip == "0.0.0.0" and c.family == socket.AF_INET6 and c.laddr[0] == "::" and c.laddr[1] == port:
+            if portType == "tcp":
+                try:
+                    socket.create_connection((ip, port), timeout=1).close()
+                    return
+                except OSError:
+                    pass
+            else:
+                for c in psutil.net_connections(kind=portType):
+                    if c.laddr and c.laddr[1] == port and c.laddr[0] in [ip, "0.0.0.0", "::"]:
                         return
-        raise Exception("timeout")
+            if time.monotonic() >= deadline:
+                raise Exception("timeout")
+            time.sleep(0.05)
 
     @staticmethod
     def touchFile(filename):
@@ -373,6 +359,159 @@ class McUtil:
             raise Exception("failed to get syscall number for %s" % (syscallName))
         return syscall_number
 
+    @staticmethod
+    def getTcpSocketTraffic(cgroupId=None):
+        # returns dict<socket-cookie,(socket-inode,bytes-received,bytes-acked)> for the TCP sockets, by sock_diag netlink
+        # only the sockets created in the specified cgroup v2 are dumped if cgroupId is not None, filtered by the kernel (linux >= 5.9, EINVAL otherwise)
+        # bytes-acked is used as bytes sent, unacknowledged bytes are not counted
+        # sockets closed but not finished yet (FIN-WAIT-1, LAST-ACK, etc.) are still dumped, with inode 0
+        INET_DIAG_INFO = 2
+        INET_DIAG_BC_CGROUP_COND = 13
+
+        bytecode = b""
+        if cgroupId is not None:
+            # struct inet_diag_bc_op + cgroup id, accept if matched, reject otherwise
+            bytecode = struct.pack("=BBHQ", INET_DIAG_BC_CGROUP_COND, 12, 16, cgroupId)
+
+        ret = dict()
+        for buf, pos, msgLen in McUtil._dumpTcpSockDiag(0xFFFFFFFF, 1 << (INET_DIAG_INFO - 1), bytecode):
+            # struct inet_diag_msg is 72 bytes, cookie is the last field of struct inet_diag_sockid, inode is the last field
+            cookie = struct.unpack_from("=Q", buf, pos + 16 + 44)[0]
+            inode = struct.unpack_from("=I", buf, pos + 16 + 68)[0]
+            attrPos = pos + 16 + 72
+            while attrPos + 4 <= pos + msgLen:
+                attrLen, attrType = struct.unpack_from("=HH", buf, attrPos)
+                if attrLen < 4:
+                    break
+                if attrType == INET_DIAG_INFO and attrLen - 4 >= 136:
+                    # tcpi_bytes_acked and tcpi_bytes_received are at offset 120 of struct tcp_info
+                    bytesAcked, bytesReceived = struct.unpack_from("=QQ", buf, attrPos + 4 + 120)
+                    ret[cookie] = (inode, bytesReceived, bytesAcked)
+                attrPos += (attrLen + 3) & ~3
+        return ret
+
+    @staticmethod
+    def getTcpConnectionCount(portList):
+        # returns number of the established TCP connections whose local port is in portList, by sock_diag netlink
+        # the kernel only dumps the matched sockets, like "ss state established '( sport = :P1 or sport = :P2 )'"
+        TCP_ESTABLISHED = 1
+        INET_DIAG_BC_JMP = 1
+        INET_DIAG_BC_S_EQ = 11
+
+        if len(portList) == 0:
+            return 0
+
+        # "A or B or C" is compiled as "A, JMP, B, JMP, C", every jump is relative to the current struct inet_diag_bc_op
+        # S_EQ: jumps 8 to its JMP if matched, 12 to the next condition otherwise, the last one jumps out of the end to reject
+        # JMP: jumps to the end to accept
+        bytecodeLen = 12 * len(portList) - 4
+        bytecode = b""
+        for port in portList:
+            bytecode += struct.pack("=BBHBBH", INET_DIAG_BC_S_EQ, 8, 12, 0, 0, port)
+            if len(bytecode) < bytecodeLen:
+                bytecode += struct.pack("=BBH", INET_DIAG_BC_JMP, 4, bytecodeLen - len(bytecode))
+
+        ret = 0
+        for dummy in McUtil._dumpTcpSockDiag(1 << TCP_ESTABLISHED, 0, bytecode):
+            ret += 1
+        return ret
+
+    @staticmethod
+    def _dumpTcpSockDiag(stateMask, ext, bytecode):
+        # dumps IPv4 and IPv6 TCP sockets by sock_diag netlink, bytecode (struct inet_diag_bc_op list) is run by the kernel to filter the sockets
+        # yields (buffer,message-position,message-length), message is struct nlmsghdr + struct inet_diag_msg + attributes
+        NETLINK_SOCK_DIAG = 4
+        SOCK_DIAG_BY_FAMILY = 20
+        NLM_F_REQUEST_DUMP = 0x301
+        NLMSG_ERROR = 2
+        NLMSG_DONE = 3
+        INET_DIAG_REQ_BYTECODE = 1
+
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG) as sock:
+            for family in [socket.AF_INET, socket.AF_INET6]:
+                # struct nlmsghdr + struct inet_diag_req_v2 + bytecode attribute
+                req = struct.pack("=BBBBI", family, socket.IPPROTO_TCP, ext, 0, stateMask) + bytes(48)
+                if len(bytecode) > 0:
+                    req += struct.pack("=HH", 4 + len(bytecode), INET_DIAG_REQ_BYTECODE) + bytecode
+                sock.send(struct.pack("=IHHII", 16 + len(req), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST_DUMP, 1, 0) + req)
+
+                bDone = False
+                while not bDone:
+                    buf = sock.recv(65536)
+                    pos = 0
+                    while pos + 16 <= len(buf):
+                        msgLen, msgType = struct.unpack_from("=IH", buf, pos)
+                        if msgType == NLMSG_DONE:
+                            bDone = True
+                            break
+                        if msgType == NLMSG_ERROR:
+                            raise OSError(-struct.unpack_from("=i", buf, pos + 16)[0], "sock_diag failed")
+                        yield (buf, pos, msgLen)
+                        pos += (msgLen + 3) & ~3
+
+    @staticmethod
+    def getInterfaceTxBytes(interfaceList=None):
+        # returns total bytes sent by the specified network interfaces, all the interfaces except loopback if not specified
+        ret = 0
+        with open("/proc/net/dev") as f:
+            for line in f.readlines()[2:]:
+                name, data = line.split(":", 1)
+                name = name.strip()
+                if interfaceList is None:
+                    if name == "lo":
+                        continue
+                elif name not in interfaceList:
+                    continue
+                ret += int(data.split()[8])
+        return ret
+
+    @staticmethod
+    def getProcessFdInfo(pid):
+        # returns (fd-count,set<socket-inode>), returns None if the process has exited
+        ret = set()
+        fdDir = "/proc/%d/fd" % (pid)
+        try:
+            fnList = os.listdir(fdDir)
+        except OSError:
+            return None
+        for fn in fnList:
+            try:
+                target = os.readlink(os.path.join(fdDir, fn))
+            except OSError:
+                continue                        # fd is closed
+            if target.startswith("socket:["):
+                ret.add(int(target[8:-1]))
+        return (len(fnList), ret)
+
+    @staticmethod
+    def getProcessResourceUsage(pid):
+        # returns (start-time,cpu-time,rss,bytes-read,bytes-written), returns None if the process has exited
+        # start-time is in clock ticks since boot, it tells a recycled pid from the old process
+        # cpu-time is in seconds, bytes-read and bytes-written are the bytes really fetched from or sent to the storage layer
+        try:
+            with open("/proc/%d/stat" % (pid)) as f:
+                fieldList = f.read().rsplit(")", 1)[1].split()            # process name may contain spaces and ")"
+            with open("/proc/%d/status" % (pid)) as f:
+                rss = 0
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss = int(line.split()[1]) * 1024                   # kernel threads and zombies have no VmRSS
+                        break
+            ioRead, ioWrite = 0, 0
+            try:
+                with open("/proc/%d/io" % (pid)) as f:
+                    for line in f:
+                        if line.startswith("read_bytes:"):
+                            ioRead = int(line.split()[1])
+                        elif line.startswith("write_bytes:"):
+                            ioWrite = int(line.split()[1])
+            except PermissionError:
+                pass                                                        # process has changed its credentials
+        except (FileNotFoundError, ProcessLookupError):
+            return None
+        clkTck = os.sysconf("SC_CLK_TCK")
+        return (int(fieldList[19]), (int(fieldList[11]) + int(fieldList[12])) / clkTck, rss, ioRead, ioWrite)
+
 
 class StdoutRedirector:
 
@@ -710,42 +849,110 @@ class RotatingFile:
     and renamed to "app.log.1", and if files "app.log.1", "app.log.2" etc.
     exist, then they are renamed to "app.log.2", "app.log.3" etc.
     respectively.
+    Data is buffered, file size is tracked by arithmetic instead of asking
+    the kernel. readFrom() drains a non-blocking pipe, data is moved by
+    splice() without entering user space when the rollover point is far away.
     """
 
+    _chunkSize = 64 * 1024
+    _bufferSize = 256 * 1024
+    _readLimit = 1024 * 1024                # max bytes moved in one readFrom() call, so that the main loop is not starved
+
     def __init__(self, filename, maxBytes, backupCount):
         assert maxBytes > 0 and backupCount > 0
         self.baseFilename = filename
         self.maxBytes = maxBytes
         self.backupCount = backupCount
-        self.f = open(self.baseFilename, "ab", buffering=0)
+        self.buf = bytearray()
+        self.bSplice = hasattr(os, "splice")
+        self._open()
 
     def write(self, s):
-        assert self.f is not None
-        while s != b'':
-            # process one line at a time
-            try:
-                i = s.index(b'\n')
-                sCur = s[:i+1]
-                s = s[i+1:]
-            except ValueError:
-                sCur = s
-                s = b''
+        assert self.fd is not None
+        self.buf += s
+        if len(self.buf) >= self._bufferSize:
+            self.flush()
+
+    def readFrom(self, fd):
+        # read from a non-blocking fd until it is drained or the limit is reached
+        # returns False when end of file is reached
+        assert self.fd is not None
+        total = 0
+        try:
+            while total < self._readLimit:
+                n = 0
+                if self.bSplice and len(self.buf) == 0 and self.size + self._chunkSize < self.maxBytes:
+                    try:
+                        n = os.splice(fd, self.fd, self._chunkSize, flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                        self.size += n
+                    except BlockingIOError:
+                        raise
+                    except OSError:
+                        self.bSplice = False        # fd or file system does not support splice
+                        continue
+                else:
+                    data = os.read(fd, self._chunkSize)
+                    n = len(data)
+                    self.write(data)
+                if n == 0:
+                    return False
+                total += n
+        except BlockingIOError:
+            pass
+        finally:
+            self.flush()
+        return True
 
-            # do roll over
-            if self.f.tell() > 0 and self.f.tell() + len(sCur) >= self.maxBytes:
-                self._doRollover()
+    def flush(self):
+        assert self.fd is not None
+        if len(self.buf) == 0:
+            return
 
-            # write line
-            self.f.write(sCur)
+        mv = memoryview(self.buf)
+        try:
+            pos = 0
+            while pos < len(mv):
+                room = self.maxBytes - 1 - self.size
+                if len(mv) - pos <= room:
+                    n = len(mv) - pos
+                else:
+                    # write the lines which fit, cut at the last line end
+                    i = self.buf.rfind(b'\n', pos, pos + room)
+                    if i >= 0:
+                        n = i + 1 - pos
+                    elif self.size > 0:
+                        self._doRollover()
+                        continue
+                    else:
+                        # current line of data exceeds maxBytes
+                        i = self.buf.find(b'\n', pos)
+                        n = (i + 1 - pos) if i >= 0 else len(mv) - pos
+                self._writeAll(mv[pos:pos + n])
+                pos += n
+        finally:
+            mv.release()
+        self.buf.clear()
 
     def close(self):
-        assert self.f is not None
-        self.f.close()
-        self.f = None
+        assert self.fd is not None
+        self.flush()
+        os.close(self.fd)
+        self.fd = None
+
+    def _open(self):
+        # O_APPEND is not used, splice() does not support it, we are the only writer
+        self.fd = os.open(self.baseFilename, os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        self.size = os.lseek(self.fd, 0, os.SEEK_END)
+
+    def _writeAll(self, mv):
+        while len(mv) > 0:
+            n = os.write(self.fd, mv)
+            self.size += n
+            mv = mv[n:]
 
     def _doRollover(self):
-        self.f.close()
-        self.f = None
+        os.close(self.fd)
+        self.fd = None
 
         for i in range(self.backupCount - 1, 0, -1):
             sfn = "%s.%d" % (self.baseFilename, i)
@@ -760,4 +967,295 @@ class RotatingFile:
             os.remove(dfn)
         os.rename(self.baseFilename, dfn)
 
-        self.f = open(self.baseFilename, "a")
+        self._open()
+
+
+class RecordLogFile:
+    """
+    Append-only record log, records are stored as json lines in the data
+    file, a companion index file ("<filename>.idx") holds one fixed-size
+    (key, offset) entry for each record. Keys must be non-decreasing, so
+    "last N records" and "records between key1 and key2" are answered by
+    seeking the index without parsing the whole log.
+    Records are flushed to disk before their index entries, a partial tail
+    left by a crash is truncated and missing index entries are rebuilt when
+    the log is opened. No file is kept open between operations.
+    If maxCount is specified, the oldest records are dropped when the record
+    count exceeds maxCount by a quarter.
+    A read-only log never writes, it can be opened while another process is
+    appending, records not indexed yet are ignored.
+    """
+
+    _entryFmt = "<dQ"
+    _entrySize = struct.calcsize(_entryFmt)
+
+    def __init__(self, filename, keyFunc, maxCount=None, bReadOnly=False):
+        self.filename = filename
+        self.idxFilename = filename + ".idx"
+        self.keyFunc = keyFunc
+        self.maxCount = maxCount
+        self.bReadOnly = bReadOnly
+        self.count = 0
+        self.dataSize = 0
+        if self.bReadOnly:
+            self._load()
+        else:
+            self._recover()
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def create(self):
+        assert not self.bReadOnly
+        assert not self.exists()
+        with open(self.filename, "wb"):
+            pass
+        with open(self.idxFilename, "wb"):
+            pass
+
+    def getCount(self):
+        return self.count
+
+    def append(self, record):
+        assert not self.bReadOnly
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with open(self.filename, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.idxFilename, "ab") as f:
+            f.write(struct.pack(self._entryFmt, self.keyFunc(record), self.dataSize))
+            f.flush()
+            os.fsync(f.fileno())
+        self.count += 1
+        self.dataSize += len(line)
+
+        if self.maxCount is not None and self.count > self.maxCount + self.maxCount // 4:
+            self.compact(self.maxCount)
+
+    def getLast(self, n):
+        # returns list, order: from old to new
+        n = min(n, self.count)
+        if n <= 0:
+            return []
+        with open(self.idxFilename, "rb") as f:
+            return self._readRecords(self._readEntry(f, self.count - n)[1], self.dataSize)
+
+    def getBetween(self, key1, key2):
+        # returns records whose key is in [key1, key2], order: from old to new
+        if self.count == 0:
+            return []
+        with open(self.idxFilename, "rb") as f:
+            i = self._bisect(f, key1, False)
+            j = self._bisect(f, key2, True)
+            if i >= j:
+                return []
+            if j < self.count:
+                endOffset = self._readEntry(f, j)[1]
+            else:
+                endOffset = self.dataSize
+            return self._readRecords(self._readEntry(f, i)[1], endOffset)
+
+    def compact(self, keepCount):
+        # drop the oldest records, keep the last keepCount records
+        assert not self.bReadOnly
+        if self.count <= keepCount:
+            return
+        with open(self.idxFilename, "rb") as f:
+            f.seek((self.count - keepCount) * self._entrySize)
+            buf = f.read(keepCount * self._entrySize)
+        entryList = [struct.unpack_from(self._entryFmt, buf, i * self._entrySize) for i in range(0, keepCount)]
+        base = entryList[0][1]
+        with open(self.filename, "rb") as f:
+            f.seek(base)
+            data = f.read(self.dataSize - base)
+
+        tmpFn = self.filename + ".tmp"
+        tmpIdxFn = self.idxFilename + ".tmp"
+        with open(tmpFn, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(tmpIdxFn, "wb") as f:
+            f.write(b''.join([struct.pack(self._entryFmt, k, off - base) for k, off in entryList]))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # index file is removed first, it is rebuilt from the data file if we crash in between
+        os.unlink(self.idxFilename)
+        os.rename(tmpFn, self.filename)
+        os.rename(tmpIdxFn, self.idxFilename)
+        self.count = keepCount
+        self.dataSize = len(data)
+
+    def _recover(self):
+        if not os.path.exists(self.filename):
+            if os.path.exists(self.idxFilename):
+                os.unlink(self.idxFilename)
+            return
+
+        dataSize = os.path.getsize(self.filename)
+        if not os.path.exists(self.idxFilename):
+            with open(self.idxFilename, "wb"):
+                pass
+        idxSize = os.path.getsize(self.idxFilename)
+        count = idxSize // self._entrySize
+
+        # read the data after the last indexed record, drop the index entries which point to incomplete records
+        with open(self.idxFilename, "rb") as fi, open(self.filename, "rb") as f:
+            while True:
+                offset = self._readEntry(fi, count - 1)[1] if count > 0 else 0
+                f.seek(offset)
+                tail = f.read()
+                if count == 0 or self._parseLine(tail, 0) is not None:
+                    break
+                count -= 1
+
+        # index the complete records which are not indexed yet
+        entryList = []
+        pos = 0
+        while True:
+            record = self._parseLine(tail, pos)
+            if record is None:
+                break
+            if count == 0 or pos > 0:
+                entryList.append(struct.pack(self._entryFmt, self.keyFunc(record), offset + pos))
+            pos = tail.index(b'\n', pos) + 1
+        validSize = offset + pos
+
+        if validSize < dataSize:
+            os.truncate(self.filename, validSize)
+        if count * self._entrySize < idxSize:
+            os.truncate(self.idxFilename, count * self._entrySize)
+        if len(entryList) > 0:
+            with open(self.idxFilename, "ab") as f:
+                f.write(b''.join(entryList))
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.count = count + len(entryList)
+        self.dataSize = validSize
+
+    def _load(self):
+        # read-only version of _recover(), the indexed complete records are used
+        try:
+            with open(self.idxFilename, "rb") as fi, open(self.filename, "rb") as f:
+                count = os.fstat(fi.fileno()).st_size // self._entrySize
+                while count > 0:
+                    offset = self._readEntry(fi, count - 1)[1]
+                    f.seek(offset)
+                    line = f.readline()
+                    if self._parseLine(line, 0) is not None:
+                        self.count = count
+                        self.dataSize = offset + len(line)
+                        break
+                    count -= 1
+        except FileNotFoundError:
+            pass
+
+    def _parseLine(self, buf, pos):
+        # returns None if the line is not complete
+        i = buf.find(b'\n', pos)
+        if i < 0:
+            return None
+        try:
+            return json.loads(buf[pos:i].decode("utf-8"))
+        except ValueError:
+            return None
+
+    def _readEntry(self, f, i):
+        f.seek(i * self._entrySize)
+        return struct.unpack(self._entryFmt, f.read(self._entrySize))
+
+    def _bisect(self, f, key, bRight):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self._readEntry(f, mid)[0]
+            if k < key or (bRight and k == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _readRecords(self, startOffset, endOffset):
+        with open(self.filename, "rb") as f:
+            f.seek(startOffset)
+            buf = f.read(endOffset - startOffset)
+        return [json.loads(x) for x in buf.decode("utf-8").split("\n") if x != ""]
+
+
+class ChildSupervisor:
+    """
+    Reaps child processes by GLib.child_watch_add(), nothing blocks the main
+    loop. Children must be started with start_new_session=True, signals are
+    sent to the whole process group so that grand-children (ssh, rsync
+    workers...) are terminated too. SIGKILL is sent if the process group is
+    still alive when the deadline expires.
+    """
+
+    def __init__(self):
+        self.childDict = dict()             # dict<pid,child-object>
+
+    def getCount(self):
+        return len(self.childDict)
+
+    def watch(self, proc, exitCallback):
+        # exitCallback(pid, status) is called after the child is reaped
+        assert proc.pid not in self.childDict
+        obj = DynObject()
+        obj.proc = proc
+        obj.exitCallback = exitCallback
+        obj.watchId = GLib.child_watch_add(proc.pid, self._exitCallback)
+        obj.killTimer = None
+        self.childDict[proc.pid] = obj
+
+    def detach(self, pid):
+        # exit callback won't be called, but the child is still reaped
+        if pid in self.childDict:
+            self.childDict[pid].exitCallback = None
+
+    def terminate(self, pid, timeout):
+        # send SIGTERM to the process group, and SIGKILL after timeout seconds
+        obj = self.childDict.get(pid)
+        if obj is None or obj.killTimer is not None:
+            return
+        self._killpg(pid, signal.SIGTERM)
+        obj.killTimer = GLib.timeout_add_seconds(max(1, int(timeout)), self._killTimerCallback, pid)
+
+    def waitAll(self, timeout):
+        # iterate the main context until all the children are reaped or timeout expires
+        # returns the number of children which are still alive
+        deadline = time.monotonic() + timeout
+        ctx = GLib.MainContext.default()
+        wakeup = GLib.timeout_add(100, lambda: True)            # so that ctx.iteration() does not block past deadline
+        try:
+            while len(self.childDict) > 0 and time.monotonic() < deadline:
+                ctx.iteration(True)
+        finally:
+            GLib.source_remove(wakeup)
+        for pid in self.childDict:
+            self._killpg(pid, signal.SIGKILL)
+        return len(self.childDict)
+
+    def _exitCallback(self, pid, status):
+        obj = self.childDict.pop(pid)
+        if obj.killTimer is not None:
+            GLib.source_remove(obj.killTimer)
+            self._killpg(pid, signal.SIGKILL)                   # for the grand-children left behind
+        obj.proc.returncode = os.waitstatus_to_exitcode(status)
+        if obj.exitCallback is not None:
+            obj.exitCallback(pid, status)
+
+    def _killTimerCallback(self, pid):
+        obj = self.childDict[pid]
+        obj.killTimer = None
+        logging.warning("Process %d does not exit in time, killed." % (pid))
+        self._killpg(pid, signal.SIGKILL)
+        return False
+
+    def _killpg(self, pid, sig):
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            pass
@@ -14,6 +14,13 @@ class Storage:
     def dispose(self):
         pass
 
+    def add_mirror_site(self, mirror_site_id, param):
+        assert mirror_site_id not in self._mirrorSiteDict
+        self._mirrorSiteDict[mirror_site_id] = param
+
+    def remove_mirror_site(self, mirror_site_id):
+        del self._mirrorSiteDict[mirror_site_id]
+
     def get_param(self, mirror_site_id):
         assert mirror_site_id in self._mirrorSiteDict
         return {
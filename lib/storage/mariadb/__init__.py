@@ -8,6 +8,7 @@ import mariadb
 import sqlparse
 import lxml.etree
 import subprocess
+import concurrent.futures
 from mc_util import McUtil
 
 
@@ -49,12 +50,20 @@ class Storage:
             # add table files stored in seperate directories as different databases.
             # Although basically mariadb supports this kind of operation, but there're
             # corner cases (for example when the server crashes).
-            for msId in self._mirrorSiteDict:
-                self._serverDict[msId] = _MariadbServer(param["listen-ip"], param["temp-directory"], param["log-directory"],
-                                                        msId,
-                                                        self._mirrorSiteDict[msId]["state-directory"],
-                                                        self._mirrorSiteDict[msId]["data-directory"],
-                                                        self._tableInfoDict[msId])
+            # servers are started concurrently, most of the time is spent on waiting for them
+            futureDict = dict()
+            with concurrent.futures.ThreadPoolExecutor(max(1, len(self._mirrorSiteDict))) as executor:
+                for msId in self._mirrorSiteDict:
+                    futureDict[msId] = executor.submit(_MariadbServer, param["listen-ip"], param["port-allocator"], param["temp-directory"], param["log-directory"],
+                                                       msId,
+                                                       self._mirrorSiteDict[msId]["state-directory"],
+                                                       self._mirrorSiteDict[msId]["data-directory"],
+                                                       self._tableInfoDict[msId])
+            for msId, f in futureDict.items():
+                if f.exception() is None:
+                    self._serverDict[msId] = f.result()
+            for f in futureDict.values():
+                f.result()                                          # raise the first error, started servers are disposed below
             # show log
             if any(self._bAdvertiseDict.values()):
                 logging.info("Advertiser (mariadb) started.")       # here we can not give out port information
@@ -87,7 +96,9 @@ class Storage:
 
 class _MariadbServer:
 
-    def __init__(self, listenIp, tmpDir, logDir, databaseName, stateDir, dataDir, tableInfo):
+    START_TIMEOUT = 60          # crash recovery may take a while
+
+    def __init__(self, listenIp, portAllocator, tmpDir, logDir, databaseName, stateDir, dataDir, tableInfo):
         self._cfgFile = os.path.join(tmpDir, "mariadb-%s.cnf" % (databaseName))
         self._pidFile = os.path.join(tmpDir, "mariadb-%s.pid" % (databaseName))
         tableInfoRecordFile = os.path.join(stateDir, "MARIADB_TABLE_RECORD")
@@ -98,6 +109,8 @@ class _MariadbServer:
         self._dbWritePasswd = "write"
         self._dbReadUser = "anonymous"
 
+        self._portAllocator = portAllocator
+        self._portName = databaseName
         self._port = None
         self._proc = None
         try:
@@ -109,8 +122,8 @@ class _MariadbServer:
             else:
                 bJustInitialized = False
 
-            # allocate listening port
-            self._port = McUtil.getFreeSocketPort("tcp")
+            # allocate listening port, it is kept for this mirror site across restarts
+            self._port = self._portAllocator.reserve_port(self._portName)
 
             # generate mariadb config file
             with open(self._cfgFile, "w") as f:
@@ -130,8 +143,9 @@ class _MariadbServer:
                 f.write(buf)
 
             # start mariadb
+            self._portAllocator.unreserve_port(self._portName)
             self._proc = subprocess.Popen(["/usr/sbin/mysqld", "--defaults-file=%s" % (self._cfgFile)], cwd=tmpDir)
-            McUtil.waitSocketPortForProc("tcp", listenIp, self._port, self._proc)
+            McUtil.waitSocketPortForProc("tcp", listenIp, self._port, self._proc, timeout=self.START_TIMEOUT)
 
             # post-initialize if needed
             if bJustInitialized:
@@ -149,6 +163,7 @@ class _MariadbServer:
             self._proc.wait()
             self._proc = None
         if self._port is not None:
+            self._portAllocator.unreserve_port(self._portName)
             self._port = None
         if os.path.exists(self._pidFile):
             os.unlink(self._pidFile)
@@ -25,7 +25,7 @@ class Storage:
             # The best solution would be using a one-instance-mongodb-server, but we can not do it
             # See the comment in "class storage.mariadb.Storage"
             for msId in self._mirrorSiteDict:
-                self._serverDict[msId] = _MongodbServer(param["listen-ip"], param["temp-directory"], param["log-directory"],
+                self._serverDict[msId] = _MongodbServer(param["listen-ip"], param["port-allocator"], param["temp-directory"], param["log-directory"],
                                                         msId, self._mirrorSiteDict[msId]["data-directory"])
             # show log
             if any(self._bAdvertiseDict.values()):
@@ -60,16 +60,20 @@ class Storage:
 
 class _MongodbServer:
 
-    def __init__(self, listenIp, tmpDir, logDir, databaseName, dataDir, tableInfo):
+    START_TIMEOUT = 60
+
+    def __init__(self, listenIp, portAllocator, tmpDir, logDir, databaseName, dataDir, tableInfo):
         self._cfgFile = os.path.join(tmpDir, "mongodb-%s.conf" % (databaseName))
         self._logFile = os.path.join(logDir, "mongodb-%s.log" % (databaseName))
         self._tmpDir = tmpDir
 
+        self._portAllocator = portAllocator
+        self._portName = databaseName
         self._port = None
         self._proc = None
         try:
             # allocate listening port
-            self._port = McUtil.getFreeSocketPort("tcp")
+            self._port = self._portAllocator.reserve_port(self._portName)
 
             # generate mariadb config file
             with open(self._cfgFile, "w") as f:
@@ -93,8 +97,9 @@ class _MongodbServer:
             with open(self._logFile, "a") as f:
                 f.write("\n\n")
                 f.write("## mongodb #######################\n")
+            self._portAllocator.unreserve_port(self._portName)
             self._proc = subprocess.Popen(["/usr/bin/mongod", "--config", self._cfgFile], cwd=self._tmpDir)
-            McUtil.waitSocketPortForProc("tcp", listenIp, self._port, self._proc)
+            McUtil.waitSocketPortForProc("tcp", listenIp, self._port, self._proc, timeout=self.START_TIMEOUT)
         except Exception:
             self.dispose()
             raise
@@ -105,6 +110,7 @@ class _MongodbServer:
             self._proc.wait()
             self._proc = None
         if self._port is not None:
+            self._portAllocator.unreserve_port(self._portName)
             self._port = None
         if os.path.exists(self._cfgFile):
             os.unlink(self._cfgFile)
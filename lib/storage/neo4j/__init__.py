@@ -29,7 +29,7 @@ class Storage:
             # The best solution would be using a one-instance-neo4j-server, but we can not do it
             # See the comment in "class storage.mariadb.Storage"
             for msId in self._mirrorSiteDict:
-                self._serverDict[msId] = _Neo4jServer(param["listen-ip"], param["temp-directory"], param["log-directory"],
+                self._serverDict[msId] = _Neo4jServer(param["listen-ip"], param["port-allocator"], param["temp-directory"], param["log-directory"],
                                                       msId, self._mirrorSiteDict[msId]["data-directory"])
             # show log
             if any(self._bAdvertiseDict.values()):
@@ -66,16 +66,21 @@ class Storage:
 
 class _Neo4jServer:
 
-    def __init__(self, listenIp, tmpDir, logDir, databaseName, dataDir, tableInfo):
+    START_TIMEOUT = 120         # jvm starts slowly
+
+    def __init__(self, listenIp, portAllocator, tmpDir, logDir, databaseName, dataDir):
         self._cfgDir = os.path.join(tmpDir, "advertiser-neo4j-%s.conf" % (databaseName))
         self._logDir = os.path.join(logDir, "advertiser-neo4j-%s.log" % (databaseName))
+        self._logFile = os.path.join(self._logDir, "neo4j.log")
         self._tmpDir = tmpDir
 
+        self._portAllocator = portAllocator
+        self._portName = databaseName
         self._port = None
         self._proc = None
         try:
             # allocate listening port
-            self._boltPort = McUtil.getFreeSocketPort("tcp")
+            self._boltPort = self._portAllocator.reserve_port(self._portName)
             self._httpPort = 20000
 
             # generate mariadb config file
@@ -83,12 +88,12 @@ class _Neo4jServer:
             os.mkdir(self._logDir)
             with open(os.path.join(self._cfgDir, "neo4j.conf"), "w") as f:
                 buf = ""
-                buf += "dbms.default_database=%s" % (databaseName)
-                buf += "dbms.default_advertised_address=%s" % (listenIp)
-                buf += "dbms.connector.bolt.listen_address=:%d" % (self._boltPort)
-                buf += "dbms.connector.http.listen_address=:%d" % (self._httpPort)
+                buf += "dbms.default_database=%s\n" % (databaseName)
+                buf += "dbms.default_advertised_address=%s\n" % (listenIp)
+                buf += "dbms.connector.bolt.listen_address=:%d\n" % (self._boltPort)
+                buf += "dbms.connector.http.listen_address=:%d\n" % (self._httpPort)
                 buf += "dbms.directories.data=%s\n" % (dataDir)
-                buf += "sdbms.directories.logs=%s\n" % (self._logDir)
+                buf += "dbms.directories.logs=%s\n" % (self._logDir)
                 f.write(buf)
                 # buf += "dbms.connector.bolt.advertised_address=%s:%d" % (listenIp, self._boltPort)        FIXME
                 # buf += "dbms.connector.http.advertised_address=%s:%d" % (listenIp, self._boltPort)        FIXME
@@ -98,10 +103,11 @@ class _Neo4jServer:
             with open(self._logFile, "a") as f:
                 f.write("\n\n")
                 f.write("## neo4j #######################\n")
+            self._portAllocator.unreserve_port(self._portName)
             self._proc = subprocess.Popen(["/opt/neo4j-community-3.5.8/bin/neo4j", "console"],
                                           env={"NEO4J_CONF": self._cfgDir},
                                           cwd=self._tmpDir)
-            McUtil.waitSocketPortForProc("tcp", listenIp, self._port, self._proc)
+            McUtil.waitSocketPortForProc("tcp", listenIp, self._boltPort, self._proc, timeout=self.START_TIMEOUT)
         except Exception:
             self.dispose()
             raise
@@ -111,6 +117,7 @@ class _Neo4jServer:
             self._proc.terminate()
             self._proc.wait()
             self._proc = None
+        self._portAllocator.unreserve_port(self._portName)
         if self._port is not None:
             self._port = None
         if os.path.exists(self._cfgDir):
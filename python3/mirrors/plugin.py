@@ -67,6 +67,29 @@ class ApiClient:
         }).encode("utf-8"))
         self.sock.send(b'\n')
 
+    def upstream_selected(self, upstream_id):
+        # mirror sites reporting the same upstream share failure tracking
+        self.sock.send(json.dumps({
+            "message": "upstream",
+            "data": {
+                "id": upstream_id,
+            },
+        }).encode("utf-8"))
+        self.sock.send(b'\n')
+
+    def statistics_changed(self, bytes_transferred=None, files_changed=None):
+        # values are totals of the current update, not increments
+        data = dict()
+        if bytes_transferred is not None:
+            data["bytes"] = bytes_transferred
+        if files_changed is not None:
+            data["files-changed"] = files_changed
+        self.sock.send(json.dumps({
+            "message": "statistics",
+            "data": data,
+        }).encode("utf-8"))
+        self.sock.send(b'\n')
+
     def error_occured(self, exc_info):
         self.sock.send(json.dumps({
             "message": "error",
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+# Compares the httpstatic advertiser with the apache based httpdir advertiser on the same data.
+# Both advertisers are started by this script with their own temporary directories, load is
+# generated by several client processes with keep-alive connections.
+# Scenarios:
+#   small       GET of random small files (package metadata, small packages)
+#   large       GET of whole large files
+#   range       GET of random 64KiB ranges of large files (resumed or segmented downloads)
+#
+# Examples:
+#   bench-httpstatic.py
+#   bench-httpstatic.py --data-dir /var/cache/mirrors/gentoo/storage-file --duration 30 --concurrency 256
+
+import os
+import sys
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+sys.path.append("/usr/lib64/mirrors")
+from mc_port_allocator import McPortAllocator
+
+
+SMALL_FILE_SIZE_LIMIT = 256 * 1024
+RANGE_SIZE = 64 * 1024
+
+
+def generateData(dataDir, smallCount, largeCount, largeSize):
+    for i in range(0, smallCount):
+        dn = os.path.join(dataDir, "small", "%02d" % (i % 100))
+        os.makedirs(dn, exist_ok=True)
+        with open(os.path.join(dn, "file-%d" % (i)), "wb") as f:
+            f.write(os.urandom(random.choice([512, 2048, 4096, 16384, 65536])))
+    os.makedirs(os.path.join(dataDir, "large"), exist_ok=True)
+    for i in range(0, largeCount):
+        with open(os.path.join(dataDir, "large", "file-%d" % (i)), "wb") as f:
+            for j in range(0, largeSize // (1024 * 1024)):
+                f.write(os.urandom(1024 * 1024))
+
+
+def collectFiles(dataDir):
+    # returns (list<(url-path,size)>,list<(url-path,size)>) for small files and large files
+    smallList, largeList = [], []
+    for root, dirs, files in os.walk(dataDir):
+        for fn in files:
+            fullfn = os.path.join(root, fn)
+            if not os.path.isfile(fullfn):
+                continue
+            size = os.path.getsize(fullfn)
+            path = "/bench/" + os.path.relpath(fullfn, dataDir)
+            if size <= SMALL_FILE_SIZE_LIMIT:
+                smallList.append((path, size))
+            elif size >= RANGE_SIZE:
+                largeList.append((path, size))
+    return (smallList, largeList)
+
+
+def startAdvertiser(name, workDir, allocator, dataDir, workerCount):
+    tmpDir = os.path.join(workDir, name, "tmp")
+    logDir = os.path.join(workDir, name, "log")
+    os.makedirs(tmpDir)
+    os.makedirs(logDir)
+    mod = __import__("advertiser.%s" % (name))
+    mod = getattr(mod, name)
+    param = {
+        "listen-ip": "127.0.0.1",
+        "port-allocator": allocator.getNamespace("advertiser-%s" % (name)),
+        "temp-directory": tmpDir,
+        "log-directory": logDir,
+        "config": {"workers": workerCount} if name == "httpstatic" else dict(),
+        "mirror-sites": {
+            "bench": {
+                "cache-directory": os.path.join(workDir, name, "cache"),
+                "storage-param": {
+                    "file": {
+                        "data-directory": dataDir,
+                    },
+                },
+            },
+        },
+    }
+    obj = mod.Advertiser(param)
+    obj.advertise_mirror_site("bench")
+    time.sleep(1)                               # apache is reloaded gracefully by SIGUSR1
+    return obj
+
+
+async def clientConnection(port, scenario, fileList, deadline, result):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        while time.monotonic() < deadline:
+            path, size = random.choice(fileList)
+            headers = "Host: 127.0.0.1\r\n"
+            if scenario == "range":
+                offset = random.randrange(0, size - RANGE_SIZE + 1)
+                headers += "Range: bytes=%d-%d\r\n" % (offset, offset + RANGE_SIZE - 1)
+            t = time.monotonic()
+            writer.write(("GET %s HTTP/1.1\r\n%s\r\n" % (path, headers)).encode("utf-8"))
+
+            head = await reader.readuntil(b"\r\n\r\n")
+            status = int(head.split(b" ", 2)[1])
+            contentLength = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    contentLength = int(line.split(b":")[1])
+            length = contentLength
+            while length > 0:
+                buf = await reader.read(min(length, 1024 * 1024))
+                if buf == b"":
+                    raise ConnectionError("connection closed")
+                length -= len(buf)
+
+            if status in [200, 206]:
+                result["requests"] += 1
+                result["bytes"] += contentLength
+                result["latency"].append(time.monotonic() - t)
+            else:
+                result["errors"] += 1
+    finally:
+        writer.close()
+
+
+def clientProcess(port, scenario, fileList, connectionCount, duration, queue):
+    async def _main():
+        deadline = time.monotonic() + duration
+        taskList = [clientConnection(port, scenario, fileList, deadline, result) for i in range(0, connectionCount)]
+        for ret in await asyncio.gather(*taskList, return_exceptions=True):
+            if isinstance(ret, Exception):
+                result["errors"] += 1
+
+    random.seed(os.getpid())
+    result = {"requests": 0, "bytes": 0, "errors": 0, "latency": []}
+    asyncio.run(_main())
+    queue.put(result)
+
+
+def runScenario(port, scenario, fileList, concurrency, processCount, duration):
+    queue = multiprocessing.Queue()
+    procList = []
+    for i in range(0, processCount):
+        n = concurrency // processCount + (1 if i < concurrency % processCount else 0)
+        procList.append(multiprocessing.Process(target=clientProcess, args=(port, scenario, fileList, n, duration, queue)))
+    for p in procList:
+        p.start()
+    resultList = [queue.get() for p in procList]
+    for p in procList:
+        p.join()
+
+    latencyList = sorted([x for r in resultList for x in r["latency"]])
+    return {
+        "requests": sum([r["requests"] for r in resultList]),
+        "bytes": sum([r["bytes"] for r in resultList]),
+        "errors": sum([r["errors"] for r in resultList]),
+        "p50": latencyList[len(latencyList) // 2] if len(latencyList) > 0 else 0,
+        "p99": latencyList[min(len(latencyList) - 1, len(latencyList) * 99 // 100)] if len(latencyList) > 0 else 0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the httpstatic advertiser against the httpdir advertiser.")
+    parser.add_argument("--data-dir", help="serve this directory, default: generate test data in a temporary directory")
+    parser.add_argument("--advertisers", default="httpstatic,httpdir", help="advertisers to benchmark, default: httpstatic,httpdir")
+    parser.add_argument("--scenarios", default="small,large,range", help="default: small,large,range")
+    parser.add_argument("--duration", type=int, default=10, help="seconds for each scenario, default: 10")
+    parser.add_argument("--concurrency", type=int, default=64, help="number of client connections, default: 64")
+    parser.add_argument("--client-processes", type=int, default=max(1, os.cpu_count() // 2), help="default: half of the CPUs")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count()), help="worker count of httpstatic, default: number of CPUs, at most 4")
+    parser.add_argument("--small-files", type=int, default=10000, help="number of generated small files, default: 10000")
+    parser.add_argument("--large-files", type=int, default=8, help="number of generated large files, default: 8")
+    parser.add_argument("--large-size", type=int, default=64, help="size of generated large files in MiB, default: 64")
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix="bench-httpstatic-")
+    try:
+        if args.data_dir is not None:
+            dataDir = os.path.realpath(args.data_dir)
+        else:
+            dataDir = os.path.join(workDir, "data")
+            print("Generating test data...")
+            generateData(dataDir, args.small_files, args.large_files, args.large_size * 1024 * 1024)
+        smallList, largeList = collectFiles(dataDir)
+        print("%d small files, %d large files." % (len(smallList), len(largeList)))
+        print("")
+
+        allocator = McPortAllocator("127.0.0.1", os.path.join(workDir, "port-map.json"))
+        fmt = "%-8s %-12s %10s %10s %10s %10s %8s"
+        print(fmt % ("scenario", "advertiser", "req/s", "MiB/s", "p50(ms)", "p99(ms)", "errors"))
+        for name in args.advertisers.split(","):
+            if name == "httpdir" and not os.path.exists("/usr/sbin/apache2"):
+                print("%s skipped, /usr/sbin/apache2 not found." % (name))
+                continue
+            obj = startAdvertiser(name, workDir, allocator, dataDir, args.workers)
+            try:
+                for scenario in args.scenarios.split(","):
+                    fileList = smallList if scenario == "small" else largeList
+                    if len(fileList) == 0:
+                        continue
+                    r = runScenario(obj.get_port(), scenario, fileList, args.concurrency, args.client_processes, args.duration)
+                    print(fmt % (scenario, name,
+                                 "%.0f" % (r["requests"] / args.duration),
+                                 "%.1f" % (r["bytes"] / args.duration / 1024 / 1024),
+                                 "%.1f" % (r["p50"] * 1000),
+                                 "%.1f" % (r["p99"] * 1000),
+                                 r["errors"]))
+            finally:
+                obj.dispose()
+        allocator.dispose()
+    finally:
+        shutil.rmtree(workDir)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+# Measures the dispatch cost of the scheduler engine with a virtual clock.
+# Each dispatched job costs O(log n) heap operations, so the cost per job grows slowly
+# (logarithmically) with the number of jobs, it does not stay flat. Cost per wakeup
+# grows faster, because more jobs become due in each wakeup ("jobs/wakeup" column).
+
+import sys
+import time
+import random
+from datetime import datetime
+from datetime import timedelta
+sys.path.append("/usr/lib64/mirrors")
+from mc_scheduler import McScheduler
+
+
+class VirtualClockScheduler(McScheduler):
+
+    def __init__(self, startDatetime):
+        super().__init__([])
+        self.clock = startDatetime
+
+    def _now(self):
+        return self.clock
+
+    def _addTimer(self, seconds, func):
+        return (self.clock + timedelta(seconds=seconds), func)
+
+    def _removeTimer(self, timer):
+        pass
+
+    def fireTimer(self):
+        self.clock = max(self.clock, self.timer[0])
+        self.timer[1]()
+
+
+def runOne(jobCount, wakeupCount):
+    random.seed(jobCount)
+    now = datetime(2020, 1, 1)
+    sched = VirtualClockScheduler(now)
+    counter = [0]
+
+    def jobCallback(schedDatetime):
+        counter[0] += 1
+
+    # add jobs, last schedule time is spread over one schedule period
+    t = time.perf_counter()
+    for i in range(0, jobCount):
+        interval = timedelta(hours=random.choice([1, 2, 4, 8, 24]))
+        lastSchedDatetime = now - timedelta(seconds=random.randrange(0, int(interval.total_seconds())))
+        sched.addIntervalJob("job-%d" % (i), lastSchedDatetime, interval, jobCallback)
+    addCost = (time.perf_counter() - t) / jobCount
+
+    # pause and trigger jobs, which leaves stale heap items behind
+    t = time.perf_counter()
+    for i in range(0, jobCount):
+        jobId = "job-%d" % (i)
+        if i % 2 == 0:
+            sched.pauseJobUntil(jobId, sched.getJobNextSchedDatetime(jobId) + timedelta(minutes=5))
+        else:
+            sched.triggerJobAt(jobId, sched.getJobNextSchedDatetime(jobId) - timedelta(minutes=5))
+    changeCost = (time.perf_counter() - t) / jobCount
+
+    # dispatch
+    t = time.perf_counter()
+    for i in range(0, wakeupCount):
+        sched.fireTimer()
+    dispatchTime = time.perf_counter() - t
+
+    return (addCost, changeCost, dispatchTime / wakeupCount, dispatchTime / max(counter[0], 1), counter[0] / wakeupCount)
+
+
+print("%8s %14s %14s %16s %14s %12s" % ("jobs", "add (us)", "change (us)", "wakeup (us)", "per job (us)", "jobs/wakeup"))
+for jobCount in [100, 1000, 10000, 50000]:
+    addCost, changeCost, wakeupCost, jobCost, batchSize = runOne(jobCount, 2000)
+    print("%8d %14.2f %14.2f %16.2f %14.2f %12.2f" % (jobCount, addCost * 1e6, changeCost * 1e6, wakeupCost * 1e6, jobCost * 1e6, batchSize))
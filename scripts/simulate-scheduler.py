@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+# Replays the update schedules of the enabled mirror sites with a virtual clock, nothing
+# waits in real time. The scheduler and the admission queue are the ones used by the daemon,
+# update durations and upstream traffic are sampled from the update history of each mirror site.
+# Update histories are opened read-only, it is safe to run beside the daemon.
+# Update failures, retries, dependencies, circuit breaker and load shedding are not modeled.
+#
+# Examples:
+#   simulate-scheduler.py --days 7
+#   simulate-scheduler.py --days 365 --main-cfg ./new-main.conf       (evaluate new schedules or limits)
+
+import os
+import sys
+import heapq
+import random
+import argparse
+from datetime import datetime
+from datetime import timedelta
+sys.path.append("/usr/lib64/mirrors")
+from mc_util import DynObject
+from mc_param import McConst
+from mc_param import McParam
+from mc_daemon import McDaemon
+from mc_plugin import McPluginManager
+from mc_scheduler import McScheduler
+from mc_updater import _AdmissionQueue
+from mc_updater import _UpdateHistory
+
+
+class EventLoop:
+
+    def __init__(self, startDatetime):
+        self.clock = startDatetime
+        self.heap = []                          # list<(datetime,seq,func)>
+        self.seq = 0
+        self.cancelledSet = set()
+
+    def addEvent(self, eventDatetime, func):
+        self.seq += 1
+        heapq.heappush(self.heap, (eventDatetime, self.seq, func))
+        return self.seq
+
+    def cancelEvent(self, seq):
+        self.cancelledSet.add(seq)
+
+    def run(self, endDatetime):
+        while len(self.heap) > 0 and self.heap[0][0] <= endDatetime:
+            eventDatetime, seq, func = heapq.heappop(self.heap)
+            if seq in self.cancelledSet:
+                self.cancelledSet.remove(seq)
+                continue
+            self.clock = max(self.clock, eventDatetime)
+            func()
+        self.clock = endDatetime
+
+
+class VirtualInvoker:
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def addCallback(self, func):
+        self.loop.addEvent(self.loop.clock, func)
+
+    def addDelayedCallback(self, func):
+        self.loop.addEvent(self.loop.clock + timedelta(seconds=1), func)
+
+
+class VirtualClockScheduler(McScheduler):
+
+    def __init__(self, loop, preferedUpdatePeriodList, jitter, catchUpPolicy):
+        self.loop = loop
+        super().__init__(preferedUpdatePeriodList, jitter, catchUpPolicy)
+
+    def _now(self):
+        return self.loop.clock
+
+    def _addTimer(self, seconds, func):
+        return self.loop.addEvent(self.loop.clock + timedelta(seconds=seconds), func)
+
+    def _removeTimer(self, timer):
+        self.loop.cancelEvent(timer)
+
+
+class Simulator:
+
+    def __init__(self, param, startDatetime, defaultDuration):
+        self.param = param
+        self.startDatetime = startDatetime
+        self.defaultDuration = defaultDuration
+        self.loop = EventLoop(startDatetime)
+        self.scheduler = VirtualClockScheduler(self.loop, param.mainCfg["preferedUpdatePeriodList"], param.mainCfg["scheduleJitter"], param.mainCfg["catchUpPolicy"])
+        self.admission = _AdmissionQueue(param.mainCfg["updateConcurrencyLimit"], VirtualInvoker(self.loop))
+
+        self.siteDict = dict()                  # dict<mirror-id,site-object>
+        self.ignoredList = []                   # list<(mirror-id,reason)>
+        self.runningCount = 0
+        self.peakRunningCount = 0
+        self.runningIntegral = 0                # running-count * seconds
+        self.lastChangeDatetime = startDatetime
+
+        for msId, ms in sorted(param.mirrorSiteDict.items()):
+            if ms.updaterExe is None:
+                self.ignoredList.append((msId, "no updater"))
+                continue
+            history = _UpdateHistory(os.path.join(ms.masterDir, "UPDATE_HISTORY"), ms.initializerExe is not None, bReadOnly=True)
+            if not history.isInitialized():
+                self.ignoredList.append((msId, "not initialized"))
+                continue
+            self.siteDict[msId] = self._createSite(ms, history)
+
+    def run(self, endDatetime):
+        self.loop.run(endDatetime)
+        self._changeRunningCount(0)
+        for site in self.siteDict.values():
+            self._integrateStaleness(site)
+
+    def _createSite(self, ms, history):
+        site = DynObject()
+        site.mirrorSite = ms
+        site.sampleList = []                    # list<(duration-seconds,bytes)>
+        for obj in history.getLastUpdateInfoList(500):
+            if obj.bSuccess and obj.startTime is not None:
+                duration = max(1, (obj.endTime - obj.startTime).total_seconds())
+                byteCount = obj.netRx if obj.netRx is not None else obj.bytesTransferred
+                site.sampleList.append((duration, byteCount))
+        p90 = history.getUpdateDurationPercentile(90)
+        site.predictedDuration = timedelta(seconds=p90) if p90 is not None else None
+
+        last = history.getLastUpdateInfo()
+        site.lastFinishDatetime = last.endTime if last is not None else self.startDatetime
+        site.staleStartDatetime = self.startDatetime
+        site.staleIntegral = 0                  # staleness * seconds
+        site.staleMax = (self.startDatetime - site.lastFinishDatetime).total_seconds()
+
+        site.bWaiting = False
+        site.bRunning = False
+        site.submitDatetime = None
+        site.runCount = 0
+        site.skipCount = 0
+        site.waitList = []                      # list<seconds>
+        site.bytesTotal = 0
+        site.bBytesKnown = any([x[1] is not None for x in site.sampleList])
+
+        lastSched = last.endTime if last is not None else None
+        if ms.schedType == "interval":
+            self.scheduler.addIntervalJob(ms.id, lastSched, ms.schedInterval, lambda schedDatetime: self._jobCallback(site, schedDatetime), ms.schedJitter, lambda: site.predictedDuration)
+        elif ms.schedType == "cronexpr":
+            self.scheduler.addCronJob(ms.id, lastSched, ms.schedCronExpr, lambda schedDatetime: self._jobCallback(site, schedDatetime), ms.schedJitter, lambda: site.predictedDuration)
+        else:
+            assert False
+        return site
+
+    def _jobCallback(self, site, schedDatetime):
+        # same as _OneMirrorSiteUpdater._updateRequest()
+        if site.bRunning or site.bWaiting:
+            site.skipCount += 1
+            return
+        site.bWaiting = True
+        site.submitDatetime = self.loop.clock
+        self.admission.submit(site.mirrorSite, _AdmissionQueue.PRIORITY_SCHEDULED, lambda: self._startCallback(site))
+
+    def _startCallback(self, site):
+        site.bWaiting = False
+        site.bRunning = True
+        site.waitList.append((self.loop.clock - site.submitDatetime).total_seconds())
+        self._changeRunningCount(1)
+
+        if len(site.sampleList) > 0:
+            duration, byteCount = random.choice(site.sampleList)
+        else:
+            duration, byteCount = self.defaultDuration.total_seconds(), None
+        self.loop.addEvent(self.loop.clock + timedelta(seconds=duration), lambda: self._finishCallback(site, byteCount))
+
+    def _finishCallback(self, site, byteCount):
+        site.bRunning = False
+        site.runCount += 1
+        site.bytesTotal += byteCount or 0
+        self._integrateStaleness(site)
+        site.lastFinishDatetime = self.loop.clock
+        self._changeRunningCount(-1)
+        self.admission.release(site.mirrorSite.id)
+
+    def _changeRunningCount(self, delta):
+        self.runningIntegral += self.runningCount * (self.loop.clock - self.lastChangeDatetime).total_seconds()
+        self.lastChangeDatetime = self.loop.clock
+        self.runningCount += delta
+        self.peakRunningCount = max(self.peakRunningCount, self.runningCount)
+
+    def _integrateStaleness(self, site):
+        # staleness grows linearly since the last finished update
+        a = (site.staleStartDatetime - site.lastFinishDatetime).total_seconds()
+        b = (self.loop.clock - site.lastFinishDatetime).total_seconds()
+        site.staleIntegral += (b * b - a * a) / 2
+        site.staleMax = max(site.staleMax, b)
+        site.staleStartDatetime = self.loop.clock
+
+
+def fmtHours(seconds):
+    return "%.1fh" % (seconds / 3600)
+
+
+def fmtGiB(byteCount):
+    return "%.2f" % (byteCount / 1024 ** 3)
+
+
+def percentile(sortedList, p):
+    if len(sortedList) == 0:
+        return 0
+    return sortedList[min(len(sortedList) - 1, int(len(sortedList) * p / 100))]
+
+
+def report(sim, days):
+    totalSeconds = days * 24 * 3600
+    waitList = sorted([x for site in sim.siteDict.values() for x in site.waitList])
+    limit = sim.param.mainCfg["updateConcurrencyLimit"]["global"]
+
+    print("Simulated %d days from %s, %d mirror sites, global concurrency limit %s." % (days, sim.startDatetime.strftime("%Y-%m-%d %H:%M"), len(sim.siteDict), limit))
+    for msId, reason in sim.ignoredList:
+        print("    %s ignored, %s." % (msId, reason))
+    print("Concurrency:      peak %d, average %.2f" % (sim.peakRunningCount, sim.runningIntegral / totalSeconds))
+    if len(waitList) > 0:
+        print("Queue wait:       %d admissions, mean %s, p95 %s, max %s" % (len(waitList), fmtHours(sum(waitList) / len(waitList)), fmtHours(percentile(waitList, 95)), fmtHours(waitList[-1])))
+    print("Upstream traffic: %s GiB/day" % (fmtGiB(sum([x.bytesTotal for x in sim.siteDict.values()]) / days)))
+    print("")
+
+    fmt = "%-32s %6s %8s %9s %10s %10s %10s"
+    print(fmt % ("mirror-site", "runs", "skipped", "wait-max", "stale-avg", "stale-max", "GiB/day"))
+    for msId, site in sorted(sim.siteDict.items()):
+        print(fmt % (msId,
+                     site.runCount,
+                     site.skipCount,
+                     fmtHours(max(site.waitList)) if len(site.waitList) > 0 else "-",
+                     fmtHours(site.staleIntegral / totalSeconds),
+                     fmtHours(site.staleMax),
+                     fmtGiB(site.bytesTotal / days) if site.bBytesKnown else "-"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the update schedules of the enabled mirror sites offline.")
+    parser.add_argument("--days", type=int, default=7, help="simulated days, default: 7")
+    parser.add_argument("--start", help="simulation start time in \"YYYY-MM-DD HH:MM\" format, default: now")
+    parser.add_argument("--main-cfg", help="use this main config file instead of %s" % (McConst.mainCfgFile))
+    parser.add_argument("--default-duration", type=int, default=30, help="update duration in minutes for mirror sites with no successful update in history, default: 30")
+    parser.add_argument("--seed", type=int, default=0, help="random seed, default: 0")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if args.main_cfg is not None:
+        McConst.mainCfgFile = args.main_cfg
+    startDatetime = datetime.strptime(args.start, "%Y-%m-%d %H:%M") if args.start is not None else datetime.now()
+
+    param = McParam()
+    McDaemon(param)._loadMainCfg()
+    param.pluginManager = McPluginManager(param)
+    param.pluginManager.loadEnabledPlugins()
+
+    sim = Simulator(param, startDatetime, timedelta(minutes=args.default_duration))
+    sim.run(startDatetime + timedelta(days=args.days))
+    report(sim, args.days)
@@ -150,6 +150,10 @@ class ApiServer(UnixDomainSocketApiServer):
             print("progress %s" % (progress))
             if progress == 100:
                 mainloop.quit()
+        elif data["message"] == "upstream":
+            print("upstream %s" % (data["data"]["id"]))
+        elif data["message"] == "statistics":
+            print("statistics %s" % (data["data"]))
         elif data["message"] == "error":
             print("error %s" % (data["data"]["exc_info"]))
             mainloop.quit()
@@ -191,12 +195,12 @@ if not updateHistory.isInitialized():
     print("init start begin")
     proc = InitOrUpdateProc(pluginId, msObj, debugFlag, True)
     mainloop.run()
-    print("init start end (we don't save to UPDATE_HISTORY file)")
+    print("init start end (we don't save to update history)")
 else:
     print("update start begin")
     proc = InitOrUpdateProc(pluginId, msObj, debugFlag, False)
     mainloop.run()
-    print("update start end (we don't save to UPDATE_HISTORY file)")
+    print("update start end (we don't save to update history)")
 
 # dispose
 proc.dispose()